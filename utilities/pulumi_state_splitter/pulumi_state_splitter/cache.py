@@ -0,0 +1,125 @@
+"""Persistent cache of parsed resource files."""
+
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import tempfile
+import time
+from typing import Optional
+
+import pydantic
+
+import pulumi_state_splitter.model
+
+DEFAULT_MAX_SIZE = 1 << 30
+
+# after which files being written are taken for leftovers of killed processes
+_STALE_SECONDS = 3600
+
+# of the entries, to be increased when they change other than by the model
+_FORMAT_VERSION = 1
+
+
+@functools.cache
+def _model_digest() -> str:
+    """Digest of the resource model, whose pickles do not fit others."""
+    schema = pulumi_state_splitter.model.Resource.model_json_schema()
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+class ResourceCache(pydantic.BaseModel):
+    """An on-disk cache of validated resources.
+
+    Entries are keyed by the resource file path and contents digest, so
+    any change of the contents is a cache miss, while files rewritten with
+    the same contents, as on every split, are hits. Entries made by other
+    versions of the resource model are never hit.
+    Entries are pickles, the cache directory has to be trusted. Entries
+    which cannot be read, for example left partial by a full disk,
+    are misses and removed.
+    Least recently used entries are evicted by `prune`, once per command,
+    to keep the cache within `max_size` bytes.
+    """
+
+    directory: pathlib.Path
+    max_size: int = DEFAULT_MAX_SIZE
+
+    def _entry_path(self, path: pathlib.Path, contents: bytes) -> pathlib.Path:
+        key = hashlib.sha256()
+        for part in (
+            str(_FORMAT_VERSION),
+            _model_digest(),
+            str(path.resolve()),
+            hashlib.sha256(contents).hexdigest(),
+        ):
+            key.update(part.encode())
+            key.update(b"\0")
+        return self.directory / f"{key.hexdigest()}.pickle"
+
+    def get(
+        self, path: pathlib.Path, contents: bytes
+    ) -> Optional[pulumi_state_splitter.model.Resource]:
+        """Looks up a resource parsed from a file with given contents."""
+        entry_path = self._entry_path(path, contents)
+        try:
+            with entry_path.open("rb") as f:
+                resource = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (
+            pickle.UnpicklingError,
+            EOFError,
+            AttributeError,
+            ImportError,
+            ValueError,
+        ):
+            entry_path.unlink(missing_ok=True)
+            return None
+        # the modification time is the last use time for the eviction
+        os.utime(entry_path)
+        return resource
+
+    def put(
+        self,
+        path: pathlib.Path,
+        contents: bytes,
+        resource: pulumi_state_splitter.model.Resource,
+    ):
+        """Stores a resource parsed from a file with given contents."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry_path = self._entry_path(path, contents)
+        # written aside and renamed, so that readers never see partial entries
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            pickle.dump(resource, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, entry_path)
+
+    def prune(self):
+        """Evicts least recently used entries exceeding the size limit.
+
+        Files left partially written by `put` are removed too.
+        """
+        try:
+            paths = list(self.directory.iterdir())
+        except FileNotFoundError:
+            return
+        entries = []
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # evicted or replaced by another process meanwhile
+                continue
+            if path.suffix == ".pickle":
+                entries.append((stat, path))
+            elif stat.st_mtime < time.time() - _STALE_SECONDS:
+                path.unlink(missing_ok=True)
+        size = sum(stat.st_size for stat, _ in entries)
+        entries.sort(key=lambda entry: entry[0].st_mtime_ns)
+        for stat, entry in entries:
+            if size <= self.max_size:
+                break
+            entry.unlink(missing_ok=True)
+            size -= stat.st_size
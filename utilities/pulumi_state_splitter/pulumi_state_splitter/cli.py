@@ -1,16 +1,35 @@
-"""Command line entry point"""
+"""Command line entry point
 
+Only click is imported up front, the modules building pydantic models
+and using YAML are imported by the commands needing them, so that
+the help and argument errors come quickly.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import contextlib
 import functools
+import os
 import pathlib
+import shlex
 import subprocess
 import sys
-from typing import Optional, Sequence
+import time
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 import click
 
-import pulumi_state_splitter.split
-import pulumi_state_splitter.stored_state
-
 
 @click.group()
 @click.option(
@@ -26,7 +45,7 @@ import pulumi_state_splitter.stored_state
     ),
 )
 @click.pass_context
-def cli(ctx: click.Context, backend_directory: str):
+def cli(ctx: click.Context, backend_directory: pathlib.Path):
     """pulumi_yaml_splitter command line interface."""
     ctx.obj = backend_directory
 
@@ -37,9 +56,64 @@ class StackNameOptionType(click.types.StringParamType):
     name = "project-name/stack-name"
 
     def convert(self, value, param, ctx):
+        import pulumi_state_splitter.stored_state
+
         return pulumi_state_splitter.stored_state.StackName.from_path(value)
 
 
+_jobs_option = click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help=(
+        "number of worker processes processing stacks"
+        " or, for a single stack, its resources"
+    ),
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+
+
+def _cache_options(f):
+    @click.option(
+        "--cache-directory",
+        envvar="PULUMI_STATE_SPLITTER_CACHE_DIRECTORY",
+        help="cache parsed resource files in this directory",
+        show_envvar=True,
+        type=click.Path(
+            dir_okay=True,
+            file_okay=False,
+            path_type=pathlib.Path,
+            resolve_path=True,
+        ),
+    )
+    @click.option(
+        "--cache-size",
+        help="size limit of the cache in bytes",
+        show_default="1 GiB",
+        type=click.IntRange(min=0),
+    )
+    @functools.wraps(f)
+    def with_cache(cache_directory, cache_size, **kwargs):
+        cache = None
+        if cache_directory is not None:
+            import pulumi_state_splitter.cache
+
+            if cache_size is None:
+                cache_size = pulumi_state_splitter.cache.DEFAULT_MAX_SIZE
+            cache = pulumi_state_splitter.cache.ResourceCache(
+                directory=cache_directory,
+                max_size=cache_size,
+            )
+        try:
+            f(cache=cache, **kwargs)
+        finally:
+            if cache is not None:
+                cache.prune()
+
+    return with_cache
+
+
 def _command(f):
     @cli.command()
     @click.option(
@@ -61,51 +135,461 @@ def _command(f):
     return maybe_all_stacks
 
 
+_trust_option = click.option(
+    "--trust-input",
+    help="skip validation of resource files unchanged since split",
+    is_flag=True,
+)
+
+
+_stream_option = click.option(
+    "--stream",
+    help="read state files incrementally, keeping less of them in memory",
+    is_flag=True,
+)
+
+
+def _for_each_stack(
+    function: Callable[..., Any],
+    stacks_names: Iterable,
+    jobs: int,
+):
+    """Processes the stacks, reporting the outcomes, exits if any failed."""
+    import pulumi_state_splitter.stacks
+
+    results = pulumi_state_splitter.stacks.for_each_stack(
+        function, stacks_names, jobs=jobs
+    )
+    for result in results:
+        click.echo(str(result), err=True)
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+
+@click.option(
+    "--fanout",
+    default=1,
+    help="spread the resource files of each type over this many subdirectories",
+    show_default=True,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--packed",
+    help="write the resources of each type to a single file, not streaming",
+    is_flag=True,
+)
+@_stream_option
+@_jobs_option
 @_command
-def split(
+def split(  # pylint: disable=too-many-arguments
     backend_dir: pathlib.Path,
     stacks_names: Optional[Sequence["pulumi_state_splitter.stored_state.StackName"]],
+    jobs: int,
+    stream: bool,
+    packed: bool,
+    fanout: int,
 ):
     """Splits single Pulumi stack state files into multiple files each."""
+    import pulumi_state_splitter.layout
+    import pulumi_state_splitter.stacks
+    import pulumi_state_splitter.state_file
+
+    if packed and fanout != 1:
+        raise click.UsageError("--packed and --fanout cannot be combined")
     if stacks_names is None:
         stacks_names = pulumi_state_splitter.state_file.StateFile.find(backend_dir)
-    for stack_name in stacks_names:
-        state_file = pulumi_state_splitter.state_file.StateFile(
-            backend_dir=backend_dir,
-            stack_name=stack_name,
-        )
-        state_file.load()
-        pulumi_state_splitter.split.StateDir.split_state_file(state_file)
+    _for_each_stack(
+        functools.partial(
+            pulumi_state_splitter.stacks.split_stack,
+            backend_dir,
+            streaming=stream,
+            layout=pulumi_state_splitter.layout.Layout(fanout=fanout, packed=packed),
+        ),
+        stacks_names,
+        jobs=jobs,
+    )
 
 
+@_trust_option
+@_stream_option
+@_jobs_option
 @_command
-def unsplit(
+@_cache_options
+def unsplit(  # pylint: disable=too-many-arguments
     backend_dir: pathlib.Path,
-    stacks_names: Optional[Sequence[pulumi_state_splitter.stored_state.StackName]],
+    stacks_names: Optional[Sequence["pulumi_state_splitter.stored_state.StackName"]],
+    jobs: int,
+    cache: Optional["pulumi_state_splitter.cache.ResourceCache"],
+    stream: bool,
+    trust_input: bool,
 ):
     """Merges split Pulumi stack states into single state file each."""
+    import pulumi_state_splitter.split
+    import pulumi_state_splitter.stacks
+
     if stacks_names is None:
         stacks_names = pulumi_state_splitter.split.StateDir.find(backend_dir)
+    _for_each_stack(
+        functools.partial(
+            pulumi_state_splitter.stacks.unsplit_stack,
+            backend_dir,
+            cache=cache,
+            streaming=stream,
+            trust=trust_input,
+        ),
+        stacks_names,
+        jobs=jobs,
+    )
+
+
+@_command
+def verify(
+    backend_dir: pathlib.Path,
+    stacks_names: Optional[Sequence["pulumi_state_splitter.stored_state.StackName"]],
+):
+    """Checks split Pulumi stack states against their manifests."""
+    import pulumi_state_splitter.split
+
+    if stacks_names is None:
+        stacks_names = pulumi_state_splitter.split.StateDir.find(backend_dir)
+    failed = False
     for stack_name in stacks_names:
         state_dir = pulumi_state_splitter.split.StateDir(
             backend_dir=backend_dir,
             stack_name=stack_name,
         )
-        state_dir.load()
-        state_dir.unsplit()
+        report = state_dir.verify()
+        if report is None:
+            click.echo(f"{stack_name}: no manifest", err=True)
+            failed = True
+        elif not report:
+            click.echo(f"{stack_name}:\n{report}", err=True)
+            failed = True
+    sys.exit(int(failed))
+
+
+def _command_env(
+    backend_dir: Optional[pathlib.Path], stack: Optional[str]
+) -> Optional[Dict[str, str]]:
+    """Environment pointing Pulumi to a backend directory and a stack, if any."""
+    env = {}
+    if backend_dir is not None:
+        env["PULUMI_BACKEND_URL"] = backend_dir.as_uri()
+    if stack is not None:
+        env["PULUMI_STACK"] = stack
+    return {**os.environ, **env} if env else None
+
+
+@contextlib.contextmanager
+def _unsplit(
+    unsplitter_options: Dict[str, Any],
+    scratch: bool,
+    scratch_directory: Optional[pathlib.Path],
+) -> Iterator[Tuple[List[int], Optional[pathlib.Path]]]:
+    """Unsplits the states, to a scratch backend directory if asked for.
+
+    Yields the signals received meanwhile, which are deferred, see
+    `pulumi_state_splitter.scratch.deferred_signals`, and the scratch
+    backend directory, if any. Nothing is unsplit once a signal was received.
+    """
+    import pulumi_state_splitter.scratch
+    import pulumi_state_splitter.stacks
+
+    with pulumi_state_splitter.scratch.deferred_signals() as received:
+        if received:
+            yield received, None
+            return
+        with contextlib.ExitStack() as stack:
+            state_file_backend_dir = None
+            if scratch:
+                state_file_backend_dir = stack.enter_context(
+                    pulumi_state_splitter.scratch.backend(
+                        unsplitter_options["backend_dir"], scratch_directory
+                    )
+                )
+            stack.enter_context(
+                pulumi_state_splitter.stacks.Unsplitter(
+                    **unsplitter_options, state_file_backend_dir=state_file_backend_dir
+                )
+            )
+            yield received, state_file_backend_dir
+
+
+def _read_script(
+    _ctx: click.Context, _param: click.Parameter, script: Optional[IO[str]]
+) -> Optional[List[List[str]]]:
+    """Parses a script with a command per line, like a shell does."""
+    if script is None:
+        return None
+    # lines ending with a backslash are continued
+    lines = script.read().replace("\\\n", "").splitlines()
+    return [words for line in lines if (words := shlex.split(line, comments=True))]
+
+
+def _run_command(
+    command: Sequence[str], env: Optional[Dict[str, str]], prefix: str
+) -> int:
+    """Runs a command, returns its exit status.
+
+    With a `prefix` its output, merged with its error output, is echoed
+    line by line after it, so that lines of concurrent commands do not mix.
+    Deferred signals are forwarded to it, see
+    `pulumi_state_splitter.scratch.deferred_signals`.
+    """
+    import pulumi_state_splitter.scratch
+
+    output = {"stdout": subprocess.PIPE, "stderr": subprocess.STDOUT} if prefix else {}
+    with subprocess.Popen(command, env=env, **output) as process:
+        with pulumi_state_splitter.scratch.forwarded_signals(process.pid):
+            if prefix:
+                for line in process.stdout:
+                    click.echo(prefix + line.decode(errors="replace").rstrip("\n"))
+            process.wait()
+    return process.returncode
+
+
+def _run_commands(
+    commands: Sequence[Sequence[str]],
+    env: Optional[Dict[str, str]],
+    keep_going: bool,
+    received: Sequence[int],
+    prefix: str = "",
+) -> int:
+    """Runs commands in turn, returns the exit status of the last failed one.
+
+    Unless `keep_going`, the commands after a failed one are not run,
+    nor any after a signal was `received`. With many commands the exit
+    status of each is reported. Once a signal was received, the exit
+    status is the one of a command killed by it. See `_run_command`
+    for `prefix`.
+    """
+    returncode = 0
+    for command in commands:
+        if received:
+            return 128 + received[0]
+        start = time.perf_counter()
+        command_returncode = _run_command(command, env, prefix)
+        if len(commands) > 1:
+            click.echo(
+                f"{prefix}{shlex.join(command)}: exit status {command_returncode}"
+                f" ({time.perf_counter() - start:.2f}s)",
+                err=True,
+            )
+        if command_returncode:
+            returncode = command_returncode
+            if not keep_going:
+                break
+    return returncode
+
+
+def _run_stack(  # pylint: disable=too-many-arguments
+    stack_name: Any,
+    jobs: int,
+    unsplitter_options: Dict[str, Any],
+    scratch: bool,
+    scratch_directory: Optional[pathlib.Path],
+    commands: Sequence[Sequence[str]],
+    keep_going: bool,
+) -> int:
+    """Runs commands with a stack unsplit and selected, see `run`.
+
+    `{stack}` in the commands is replaced by the stack name, which
+    prefixes their output.
+    """
+    stack = f"organization/{stack_name}"
+    with _unsplit(
+        {**unsplitter_options, "stacks_names": [stack_name], "jobs": jobs},
+        scratch,
+        scratch_directory,
+    ) as (received, state_file_backend_dir):
+        return _run_commands(
+            [
+                [arg.replace("{stack}", stack) for arg in command]
+                for command in commands
+            ],
+            _command_env(state_file_backend_dir, stack),
+            keep_going,
+            received,
+            prefix=f"{stack_name}: ",
+        )
+
+
+def _inferred_stacks(
+    backend_dir: pathlib.Path,
+    commands: Sequence[Sequence[str]],
+) -> Optional[List["pulumi_state_splitter.stored_state.StackName"]]:
+    """The split stacks Pulumi commands select, `None` for all of them.
+
+    Falls back to all the stacks if not known for some of the commands
+    or if some of the stacks are not split, as they may be created.
+    """
+    import pulumi_state_splitter.split
+    import pulumi_state_splitter.targets
+
+    stacks_names = pulumi_state_splitter.targets.commands_stacks(
+        commands, os.environ, pathlib.Path.cwd()
+    )
+    if stacks_names is None:
+        click.echo("stacks not inferred from the commands, using all", err=True)
+        return None
+    found = {
+        str(stack_name)
+        for stack_name in pulumi_state_splitter.split.StateDir.find(backend_dir)
+    }
+    if not all(str(stack_name) in found for stack_name in stacks_names):
+        click.echo("stacks inferred from the commands not split, using all", err=True)
+        return None
+    return stacks_names
 
 
 @click.argument("command", nargs=-1)
+@click.option(
+    "--infer-stacks",
+    help="without --stack, process only the stacks Pulumi commands select",
+    is_flag=True,
+)
+@click.option(
+    "--keep-going",
+    help="with --script, run the commands after a failed one too",
+    is_flag=True,
+)
+@click.option(
+    "--each-stack",
+    help="run the command once per stack, for --jobs stacks at once",
+    is_flag=True,
+)
+@click.option(
+    "--script",
+    callback=_read_script,
+    help="run the commands in this file, one per line, instead of COMMAND",
+    type=click.File(),
+)
+@click.option(
+    "--scratch-directory",
+    envvar="PULUMI_STATE_SPLITTER_SCRATCH_DIRECTORY",
+    help="create scratch backends in this directory",
+    show_default="/dev/shm if it exists",
+    show_envvar=True,
+    type=click.Path(
+        dir_okay=True,
+        exists=True,
+        file_okay=False,
+        path_type=pathlib.Path,
+        resolve_path=True,
+    ),
+)
+@click.option(
+    "--scratch",
+    help="unsplit to a scratch backend the command is pointed to",
+    is_flag=True,
+)
+@_trust_option
+@_stream_option
+@_jobs_option
 @_command
-def run(
+@_cache_options
+def run(  # pylint: disable=too-many-arguments,too-many-locals
     backend_dir: pathlib.Path,
-    stacks_names: Optional[Sequence[pulumi_state_splitter.stored_state.StackName]],
-    command: str,
+    stacks_names: Optional[Sequence["pulumi_state_splitter.stored_state.StackName"]],
+    jobs: int,
+    cache: Optional["pulumi_state_splitter.cache.ResourceCache"],
+    stream: bool,
+    trust_input: bool,
+    scratch: bool,
+    scratch_directory: Optional[pathlib.Path],
+    script: Optional[List[List[str]]],
+    keep_going: bool,
+    infer_stacks: bool,
+    each_stack: bool,
+    command: Sequence[str],
 ):
-    """Runs a command with the stack states unsplit."""
-    with pulumi_state_splitter.split.Unsplitter(
-        backend_dir=backend_dir,
-        stacks_names=stacks_names,
-    ):
-        completed = subprocess.run(command, check=False)
-    sys.exit(completed.returncode)
+    """Runs a command with the stack states unsplit.
+
+    With --script the commands in it are run one after another, with
+    the states unsplit once for all of them. The exit status is the one
+    of the last failed command.
+
+    With --infer-stacks, but no --stack, only the stacks selected by the
+    --stack options of Pulumi commands, or PULUMI_STACK, are processed.
+    All of them are if that fails.
+
+    With --scratch the states are unsplit to a temporary backend directory,
+    in RAM by default, which the command gets as PULUMI_BACKEND_URL, so that
+    Pulumi rewriting the states after every step does not touch the backend
+    directory.
+
+    Interrupting and terminating signals are forwarded to the command,
+    and otherwise deferred until the states are split back. No commands
+    are run after them.
+
+    With --each-stack the commands are run once per stack, with only that
+    stack unsplit and selected: PULUMI_STACK is set to its name, which
+    also replaces {stack} in the commands. Up to --jobs stacks are
+    processed at once, the output of the commands prefixed with the stack
+    name. The exit status and duration for each stack are reported, the
+    exit status is the one of the last stack which failed.
+    """
+    import pulumi_state_splitter.scratch
+    import pulumi_state_splitter.split
+    import pulumi_state_splitter.stacks
+
+    if script is not None and command:
+        raise click.UsageError("COMMAND cannot be given with --script")
+    commands = script if script is not None else [command]
+    if infer_stacks and stacks_names is None:
+        stacks_names = _inferred_stacks(backend_dir, commands)
+    unsplitter_options = {
+        "backend_dir": backend_dir,
+        "cache": cache,
+        "streaming": stream,
+        "trust": trust_input,
+    }
+    returncode = 0
+    with pulumi_state_splitter.scratch.deferred_signals() as received:
+        if each_stack:
+            if stacks_names is None:
+                stacks_names = pulumi_state_splitter.split.StateDir.find(backend_dir)
+            results = pulumi_state_splitter.stacks.for_each_stack(
+                functools.partial(
+                    _run_stack,
+                    unsplitter_options=unsplitter_options,
+                    scratch=scratch,
+                    scratch_directory=scratch_directory,
+                    commands=commands,
+                    keep_going=keep_going,
+                ),
+                stacks_names,
+                jobs=jobs,
+            )
+            for result in results:
+                if result.error is None:
+                    click.echo(
+                        f"{result.stack_name}: exit status {result.result}"
+                        f" ({result.seconds:.2f}s)",
+                        err=True,
+                    )
+                    returncode = result.result or returncode
+                else:
+                    click.echo(str(result), err=True)
+                    returncode = 1
+        else:
+            try:
+                with _unsplit(
+                    {**unsplitter_options, "stacks_names": stacks_names, "jobs": jobs},
+                    scratch,
+                    scratch_directory,
+                ) as (received, state_file_backend_dir):
+                    returncode = _run_commands(
+                        commands,
+                        _command_env(state_file_backend_dir, None),
+                        keep_going,
+                        received,
+                    )
+            except (pulumi_state_splitter.stacks.StacksError, TimeoutError) as error:
+                click.echo(
+                    "\n".join([str(error), *getattr(error, "__notes__", [])]), err=True
+                )
+                sys.exit(1)
+    if received:
+        sys.exit(128 + received[0])
+    sys.exit(returncode)
@@ -1,13 +1,61 @@
 """Filesystem operations."""
 
 import errno
+import hashlib
+import os
 import pathlib
+from typing import IO
 
 
-def rmdir_if_empty(path: pathlib.Path):
-    """Removes a directory if it is empty."""
+def rmdir_if_empty(path: pathlib.Path, missing_ok: bool = False):
+    """Removes a directory if it is empty.
+
+    With `missing_ok` a directory removed already, for example by another
+    process removing a sibling, is not an error.
+    """
     try:
         path.rmdir()
+    except FileNotFoundError:
+        if not missing_ok:
+            raise
     except OSError as e:
         if e.errno != errno.ENOTEMPTY:
             raise
+
+
+def make_directories(path: pathlib.Path):
+    """Creates a directory and its missing parents.
+
+    Parents removed meanwhile by another process removing a sibling with
+    `rmdir_if_empty` are created again.
+    """
+    while True:
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+            return
+        except FileNotFoundError:
+            continue
+        except FileExistsError as e:
+            # also raised for directories removed again while checked
+            if os.path.lexists(e.filename) and not os.path.isdir(e.filename):
+                raise
+
+
+def open_making_directories(path: pathlib.Path, mode: str) -> IO:
+    """Opens a file for writing, creating its missing parent directories.
+
+    See `make_directories`, the parent may be removed again before the
+    file is created.
+    """
+    while True:
+        make_directories(path.parent)
+        try:
+            return path.open(mode)
+        except FileNotFoundError:
+            continue
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """Computes the SHA-256 digest of a file."""
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
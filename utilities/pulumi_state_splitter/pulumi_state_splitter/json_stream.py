@@ -0,0 +1,116 @@
+"""Incremental reading of large JSON documents."""
+
+import json
+from typing import IO, Any, Iterator
+
+_NUMBER = "0123456789+-.eE"
+_WHITESPACE = " \t\n\r"
+
+
+class Reader:
+    """Reads a JSON document from a text stream piece by piece.
+
+    Only the values being read at the moment are kept in memory,
+    so a document can be processed in bounded memory by iterating
+    over its containers with `members` and `items`.
+    """
+
+    def __init__(self, stream: IO[str], chunk_size: int = 1 << 16):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        """Reads more of the stream, returns False at its end."""
+        if self._eof:
+            return False
+        # dropping the consumed part of the buffer
+        self._buffer = self._buffer[self._position :]
+        self._position = 0
+        # reading at least as much as is buffered, so that decoding
+        # of values spanning many chunks is retried logarithmically
+        chunk = self._stream.read(max(self._chunk_size, len(self._buffer)))
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer += chunk
+        return True
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character, empty at the end."""
+        while True:
+            while self._position < len(self._buffer):
+                if self._buffer[self._position] not in _WHITESPACE:
+                    return self._buffer[self._position]
+                self._position += 1
+            if not self._fill():
+                return ""
+
+    def _expect(self, characters: str) -> str:
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(
+                f"expected one of {characters!r}, got {character or 'end'!r}"
+            )
+        self._position += 1
+        return character
+
+    def value(self) -> Any:
+        """Reads the next value as a whole."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number can continue past the end of the buffer
+            if (
+                isinstance(value, (int, float))
+                and not self._buffer[end:].strip(_NUMBER)
+                and self._fill()
+            ):
+                continue
+            self._position = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Iterates over the keys of the next value, an object.
+
+        The caller has to read the value of each key before the next one.
+        """
+        self._expect("{")
+        if self.peek() == "}":
+            self._position += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError(f"expected an object key, got {key!r}")
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+    def items(self) -> Iterator[None]:
+        """Iterates over the next value, an array.
+
+        The caller has to read each item before the next one.
+        """
+        self._expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+        while True:
+            yield
+            if self._expect(",]") == "]":
+                return
+
+    def end(self):
+        """Checks that there is nothing but whitespace left."""
+        if self.peek():
+            raise ValueError("extra data after the JSON document")
@@ -0,0 +1,54 @@
+"""Arrangement of the files of a split stack state."""
+
+import hashlib
+import pathlib
+
+import pydantic
+
+import pulumi_state_splitter.model
+
+
+class Layout(pydantic.BaseModel):
+    """Arrangement of the resource files in a state directory.
+
+    Resource files are in directories named after their types. With
+    `fanout` over 1 the files of each type directory are spread over
+    that many subdirectories, named after hashes of the resources names,
+    so that types with many resources do not make huge directories.
+    With `packed` the resources of each type directory are documents
+    of a single file instead, sorted by their names.
+    A state directory's layout is recorded in its state file.
+    """
+
+    fanout: int = pydantic.Field(default=1, ge=1)
+    packed: bool = False
+
+    @pydantic.model_validator(mode="after")
+    def _check_packed(self) -> "Layout":
+        if self.packed and self.fanout != 1:
+            raise ValueError("packed resource files cannot be spread")
+        return self
+
+    def subpath(
+        self, directory: pathlib.Path, resource: pulumi_state_splitter.model.Resource
+    ) -> pathlib.Path:
+        """Path of a resource state file in its parent's directory."""
+        type_dir_name = resource.type.replace(":", "-")  # für Windows
+        if self.packed:
+            return directory / f"{type_dir_name}.yaml"
+        name = resource.name
+        if self.fanout == 1:
+            return directory / type_dir_name / f"{name}.yaml"
+        digest = hashlib.sha256(name.encode()).digest()
+        shard = int.from_bytes(digest[:8], "big") % self.fanout
+        width = len(f"{self.fanout - 1:x}")
+        return directory / type_dir_name / f"{shard:0{width}x}" / f"{name}.yaml"
+
+    def directory(
+        self, subpath: pathlib.Path, resource: pulumi_state_splitter.model.Resource
+    ) -> pathlib.Path:
+        """Path of the directory of a resource's children, see `subpath`."""
+        directory = subpath.with_suffix("")
+        if self.packed:
+            return directory / resource.name
+        return directory
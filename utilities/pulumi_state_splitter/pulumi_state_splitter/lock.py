@@ -0,0 +1,182 @@
+"""Advisory locks on stacks, for processes sharing a backend directory.
+
+A stack is locked with `flock` on an empty lock file under `.pulumi/locks`
+in the backend directory, out of the way of the files of Pulumi, which
+is removed on release. Its holder is looked up in `/proc/locks`, where
+available. Locks are released by the system when their holder dies, so
+lock files left behind are stale and taken over. Without `flock`, on
+Windows, nothing is locked.
+"""
+
+import collections
+import contextlib
+import functools
+import os
+import pathlib
+import time
+from typing import IO, Any, Callable, Dict, Iterator, Optional
+
+import pulumi_state_splitter.fs
+import pulumi_state_splitter.stored_state
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# seconds to wait for a lock, unless set in the environment
+DEFAULT_TIMEOUT = 60.0
+
+TIMEOUT_ENVIRONMENT_VARIABLE = "PULUMI_STATE_SPLITTER_LOCK_TIMEOUT"
+
+_POLL_INTERVAL = 0.05
+
+_PROC_LOCKS = pathlib.Path("/proc/locks")
+
+# locks held by this process and how many times, by lock file path,
+# inherited by worker processes forked meanwhile
+_depths: Dict[pathlib.Path, int] = collections.Counter()
+_files: Dict[pathlib.Path, IO[str]] = {}
+
+
+def lock_path(
+    backend_dir: pathlib.Path, stack_name: pulumi_state_splitter.stored_state.StackName
+) -> pathlib.Path:
+    """Path of the lock file of a stack in a backend directory."""
+    directory = backend_dir.absolute() / ".pulumi" / "locks" / stack_name.project
+    return directory / f"{stack_name.stack}.lock"
+
+
+def _timeout() -> float:
+    value = os.environ.get(TIMEOUT_ENVIRONMENT_VARIABLE)
+    return DEFAULT_TIMEOUT if value is None else float(value)
+
+
+def _holder(path: pathlib.Path) -> str:
+    """Description of the holder of a lock, as listed in `/proc/locks`."""
+    try:
+        stat = path.stat()
+        lines = _PROC_LOCKS.read_text(encoding="ascii").splitlines()
+    except OSError:
+        # released meanwhile, or not on Linux
+        return "another process"
+    device = f"{os.major(stat.st_dev):02x}:{os.minor(stat.st_dev):02x}:{stat.st_ino}"
+    # lines like "1: FLOCK  ADVISORY  WRITE <pid> <device> 0 EOF",
+    # with "->" after the number for the processes waiting for the lock
+    pids = [
+        fields[4]
+        for fields in map(str.split, lines)
+        if fields[1] == "FLOCK" and fields[5] == device
+    ]
+    if not pids:
+        return "another process"
+    try:
+        os.kill(int(pids[0]), 0)
+    except ProcessLookupError:
+        # the lock file was inherited by a process it started
+        return f"process {pids[0]}, no longer running"
+    except PermissionError:
+        pass
+    return f"process {pids[0]}"
+
+
+def _open_locked(path: pathlib.Path) -> Optional[IO[str]]:
+    """Opens and locks a lock file, `None` if it is locked already."""
+    # its directory is shared with other stacks, possibly unlocked concurrently
+    f = pulumi_state_splitter.fs.open_making_directories(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # the previous holder may have removed it before releasing it
+        if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+            return f
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    f.close()
+    return None
+
+
+def _lock(
+    path: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    timeout: float,
+) -> IO[str]:
+    deadline = time.monotonic() + timeout
+    while (f := _open_locked(path)) is None:
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"stack {stack_name} locked by {_holder(path)}"
+                f" for over {timeout:g}s, see {path}"
+            )
+        time.sleep(_POLL_INTERVAL)
+    return f
+
+
+def _unlock(path: pathlib.Path, f: IO[str]):
+    # removed while still locked, so that no one else locks it meanwhile
+    path.unlink()
+    f.close()
+    for directory in path.parent, path.parent.parent, path.parent.parent.parent:
+        # shared with other stacks, possibly locked concurrently
+        pulumi_state_splitter.fs.rmdir_if_empty(directory, missing_ok=True)
+
+
+def acquire(
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    timeout: Optional[float] = None,
+    inherited: bool = False,
+):
+    """Locks a stack in a backend directory, waiting for other holders.
+
+    Raises `TimeoutError` after waiting `timeout` seconds, by default
+    the ones of the `PULUMI_STATE_SPLITTER_LOCK_TIMEOUT` environment
+    variable or `DEFAULT_TIMEOUT`. Locks held by the process already,
+    or `inherited` from the process starting it, are only counted,
+    so that operations taking them can be combined under them.
+    Each call needs a matching `release`.
+    """
+    path = lock_path(backend_dir, stack_name)
+    if fcntl is not None and not inherited and not _depths[path]:
+        _files[path] = _lock(
+            path, stack_name, _timeout() if timeout is None else timeout
+        )
+    _depths[path] += 1
+
+
+def release(
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+):
+    """Releases a lock of a stack taken with `acquire`."""
+    path = lock_path(backend_dir, stack_name)
+    _depths[path] -= 1
+    if not _depths[path]:
+        del _depths[path]
+        if path in _files:
+            _unlock(path, _files.pop(path))
+
+
+@contextlib.contextmanager
+def stack_lock(
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    timeout: Optional[float] = None,
+    inherited: bool = False,
+) -> Iterator[None]:
+    """Holds the lock of a stack in a backend directory, see `acquire`."""
+    acquire(backend_dir, stack_name, timeout=timeout, inherited=inherited)
+    try:
+        yield
+    finally:
+        release(backend_dir, stack_name)
+
+
+def locked(method: Callable[..., Any]) -> Callable[..., Any]:
+    """Makes a method of a stored state hold the lock of its stack."""
+
+    @functools.wraps(method)
+    def with_lock(self, *args, **kwargs):
+        with stack_lock(self.backend_dir, self.stack_name):
+            return method(self, *args, **kwargs)
+
+    return with_lock
@@ -1,13 +1,24 @@
 """Model representing a Pulumi stack state."""
 
-from typing import Any, ClassVar, Iterable, List, Literal, Mapping, Optional, Sequence
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+)
 
 import pydantic
 
 
 # workaround for https://github.com/pydantic/pydantic/discussions/5461
 def _skip_some_falsy_values(
-    model: pydantic.BaseModel, handler: str, attributes: Sequence[str]
+    model: pydantic.BaseModel, handler: Callable, attributes: Sequence[str]
 ):
     """Omits serialization of some attributes with falsy values."""
     return {
@@ -39,16 +50,58 @@ class Resource(pydantic.BaseModel):
     urn: str
 
     @classmethod
-    def find_parents(cls, resources: Iterable["Resource"]) -> List["Resource"]:
-        """Finds parenthood and relationships between resources."""
+    def find_parents(
+        cls, resources: Iterable["Resource"], copy: bool = True
+    ) -> List["Resource"]:
+        """Finds parenthood and relationships between resources.
+
+        Without `copy` the `parent_resource` attributes are set on the passed
+        resources themselves, which is cheaper when the caller owns them.
+        """
         urn2resource = {}
         for resource in resources:
-            urn2resource[resource.urn] = resource.model_copy()
+            urn2resource[resource.urn] = resource.model_copy() if copy else resource
         for resource in urn2resource.values():
             if resource.parent:
                 resource.parent_resource = urn2resource[resource.parent]
         return list(urn2resource.values())
 
+    @classmethod
+    def construct_trusted(cls, data: Mapping[str, Any]) -> "Resource":
+        """Builds a resource from trusted data, skipping the validation.
+
+        Unlike with `model_construct`, the attributes are in the order
+        `model_validate` would set them, so that they serialize the same.
+        """
+        values = {
+            name: (
+                data[name]
+                if name in data
+                else field.get_default(call_default_factory=True)
+            )
+            for name, field in cls.model_fields.items()
+        }
+        values.update(data)
+        return cls.model_construct(_fields_set=data.keys() & values.keys(), **values)
+
+    def intern(self, strings: Dict[str, str]):
+        """Replaces the referencing attributes with equal shared strings.
+
+        Types, URNs and references to other resources repeat a lot
+        in a state, `strings` is the table of strings shared by the
+        resources of a state, to which missing strings are added.
+        """
+        # set directly, as the assignments need no validation
+        attributes = self.__dict__
+        for name in "type", "urn", "parent", "provider":
+            value = attributes[name]
+            if value is not None:
+                attributes[name] = strings.setdefault(value, value)
+        if attributes["dependencies"]:
+            attributes["dependencies"] = [
+                strings.setdefault(urn, urn) for urn in attributes["dependencies"]
+            ]
+
     @property
     def name(self):
         """Pulumi name of the resource."""
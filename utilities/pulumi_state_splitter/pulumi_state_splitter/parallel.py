@@ -0,0 +1,43 @@
+"""Parallel processing."""
+
+import collections
+import concurrent.futures
+import itertools
+from typing import Any, Callable, Iterable, Iterator, List
+
+
+def _map_chunk(function: Callable, chunk: List) -> List:
+    return [function(item) for item in chunk]
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def imap(
+    function: Callable,
+    iterable: Iterable,
+    jobs: int = 1,
+    chunk_size: int = 1,
+) -> Iterator[Any]:
+    """Applies a function to items in worker processes, preserving order.
+
+    Items are sent to `jobs` worker processes in chunks of `chunk_size`,
+    with at most two chunks per worker submitted but not yet consumed.
+    With one job everything happens in the current process.
+    """
+    chunks = _chunks(iterable, chunk_size)
+    if jobs == 1:
+        for chunk in chunks:
+            yield from _map_chunk(function, chunk)
+        return
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = collections.deque()
+        for chunk in chunks:
+            if len(futures) == 2 * jobs:
+                yield from futures.popleft().result()
+            futures.append(executor.submit(_map_chunk, function, chunk))
+        while futures:
+            yield from futures.popleft().result()
@@ -0,0 +1,136 @@
+"""Scratch Pulumi backend directories, for commands writing states often."""
+
+import contextlib
+import filecmp
+import multiprocessing
+import os
+import pathlib
+import shutil
+import signal
+import tempfile
+from typing import Iterator, List, Optional, Set
+
+# a tmpfs on Linux, so that scratch backends are in RAM
+DEFAULT_PARENT = pathlib.Path("/dev/shm")
+
+# Python is killed by these, without running any cleanup, and SIGINT
+# interrupts it anywhere
+_SIGNALS = tuple(
+    getattr(signal, name)
+    for name in ("SIGINT", "SIGTERM", "SIGHUP")
+    if hasattr(signal, name)
+)
+
+# of the blocks deferring signals, innermost last
+_deferrals: List[List[int]] = []
+
+# processes the deferred signals are forwarded to, like commands run
+_forwarded: Set[int] = set()
+
+
+def _copy_back(scratch_dir: pathlib.Path, backend_dir: pathlib.Path):
+    """Copies the files added to or changed in a scratch backend."""
+    for path in sorted((scratch_dir / ".pulumi").rglob("*")):
+        if not path.is_file():
+            continue
+        target = backend_dir / path.relative_to(scratch_dir)
+        if target.is_file() and filecmp.cmp(path, target, shallow=False):
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, target)
+
+
+@contextlib.contextmanager
+def backend(
+    backend_dir: pathlib.Path, parent: Optional[pathlib.Path] = None
+) -> Iterator[pathlib.Path]:
+    """A temporary Pulumi backend directory standing in for another one.
+
+    It is created in `parent`, `DEFAULT_PARENT` if it exists or else the
+    temporary directory if None, with the metadata of the backend copied
+    in. On exit the files left in its `.pulumi` directory, like update
+    history, backups or states not split back, are copied to the backend
+    directory, then it is removed, unless they could not be copied.
+    If the block fails, for example splitting back the states, nothing is
+    copied, states not split back would get stale split states unsplit over
+    them, and it is kept for recovery, as noted on the exception.
+    """
+    if parent is None and DEFAULT_PARENT.is_dir():
+        parent = DEFAULT_PARENT
+    scratch_dir = pathlib.Path(
+        tempfile.mkdtemp(prefix="pulumi-state-splitter-", dir=parent)
+    )
+    meta = backend_dir / ".pulumi" / "meta.yaml"
+    if meta.is_file():
+        (scratch_dir / ".pulumi").mkdir()
+        shutil.copy2(meta, scratch_dir / ".pulumi" / "meta.yaml")
+    try:
+        yield scratch_dir
+    except BaseException as error:
+        error.add_note(f"scratch backend kept in {scratch_dir}")
+        raise
+    _copy_back(scratch_dir, backend_dir)
+    shutil.rmtree(scratch_dir)
+
+
+def _in_foreground() -> bool:
+    """Whether the process is in the foreground process group of a terminal."""
+    try:
+        return os.tcgetpgrp(0) == os.getpgrp()
+    except OSError:
+        return False
+
+
+def _forward(pid: int, signum: int):
+    with contextlib.suppress(ProcessLookupError):
+        os.kill(pid, signum)
+
+
+@contextlib.contextmanager
+def deferred_signals() -> Iterator[List[int]]:
+    """Defers interrupting and terminating signals until the end of the block.
+
+    The signals received are recorded in the list given, for the caller
+    to act on once the states are safe, and forwarded to the processes
+    it runs meanwhile, see `forwarded_signals`, and to its worker
+    processes, except for interrupts from a terminal, which the terminal
+    sends them already. Only works in the main thread. Nested blocks, and
+    the ones of worker processes forked meanwhile, share the list of
+    the outermost one.
+    """
+    received = _deferrals[0] if _deferrals else []
+
+    def handler(signum, _frame):
+        received.append(signum)
+        if signum == signal.SIGINT and _in_foreground():
+            return
+        # which forward them to the processes they run in turn
+        for process in multiprocessing.active_children():
+            _forward(process.pid, signum)
+        for pid in _forwarded:
+            _forward(pid, signum)
+
+    previous = {signum: signal.signal(signum, handler) for signum in _SIGNALS}
+    _deferrals.append(received)
+    try:
+        yield received
+    finally:
+        _deferrals.pop()
+        for signum, previous_handler in previous.items():
+            signal.signal(signum, previous_handler)
+
+
+@contextlib.contextmanager
+def forwarded_signals(pid: int) -> Iterator[None]:
+    """Forwards the signals deferred meanwhile to a process, see `deferred_signals`.
+
+    The ones received already are forwarded first, as it may have been
+    started after them.
+    """
+    _forwarded.add(pid)
+    try:
+        for signum in _deferrals[-1] if _deferrals else []:
+            _forward(pid, signum)
+        yield
+    finally:
+        _forwarded.discard(pid)
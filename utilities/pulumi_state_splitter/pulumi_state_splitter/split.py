@@ -1,21 +1,254 @@
 """Manipulation of a split stack state file."""
 
+import collections
+import functools
+import hashlib
+import importlib
+import io
 import os
 import pathlib
-from typing import Iterable, Optional, Sequence
+from typing import (
+    Any,
+    Collection,
+    Container,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import pydantic
-import yaml
 
+import pulumi_state_splitter.cache
 import pulumi_state_splitter.fs
+import pulumi_state_splitter.graph
+import pulumi_state_splitter.layout
+import pulumi_state_splitter.lock
 import pulumi_state_splitter.model
+import pulumi_state_splitter.parallel
 import pulumi_state_splitter.state_file
 import pulumi_state_splitter.stored_state
+import pulumi_state_splitter.yaml_io
+
+# resource files parsed or written by a worker process at a time
+_CHUNK_SIZE = 64
+
+# resource attributes determining the order of the resources
+_HEADER_KEYS = ("urn", "parent", "provider", "dependencies")
+
+
+def _load_document(
+    path: pathlib.Path,
+    contents: bytes,
+    cache: Optional[pulumi_state_splitter.cache.ResourceCache],
+    digests: Container[str],
+) -> pulumi_state_splitter.model.Resource:
+    """Loads a resource from a document of a state file, using the cache if given.
+
+    A document with one of the SHA-256 `digests`, listed so in the manifest
+    written along with it, is trusted and not validated.
+    """
+    resource = cache.get(path, contents) if cache is not None else None
+    if resource is not None:
+        return resource
+    data = pulumi_state_splitter.yaml_io.load(io.BytesIO(contents))
+    if digests and hashlib.sha256(contents).hexdigest() in digests:
+        return pulumi_state_splitter.model.Resource.construct_trusted(data)
+    resource = pulumi_state_splitter.model.Resource.model_validate(data)
+    if cache is not None:
+        cache.put(path, contents, resource)
+    return resource
+
+
+def _load_resources(
+    item: Tuple[pathlib.Path, Collection[str]],
+    cache: Optional[pulumi_state_splitter.cache.ResourceCache] = None,
+    documents: bool = False,
+) -> List[Any]:
+    """Loads the resources of a state file given with its digests in the manifest.
+
+    See `_load_document`, a file has one document unless packed.
+    With `documents` each resource is paired with its document.
+    """
+    path, digests = item
+    loaded = []
+    for document in pulumi_state_splitter.yaml_io.split_documents(path.read_bytes()):
+        resource = _load_document(path, document, cache, digests)
+        loaded.append((resource, document) if documents else resource)
+    return loaded
+
+
+def _header(data: Mapping[str, Any]) -> Dict[str, Any]:
+    """The attributes of a resource determining the order."""
+    header = {key: data[key] for key in _HEADER_KEYS if data.get(key)}
+    if "dependencies" in header:
+        header["dependencies"] = sorted(header["dependencies"])
+    return header
+
+
+def _load_header(path: pathlib.Path) -> Dict[str, Any]:
+    """Loads the attributes determining the order from a resource file."""
+    with path.open() as f:
+        return _header(pulumi_state_splitter.yaml_io.load(f))
+
+
+class _StaleHeaders(Exception):
+    """Resource files do not match the headers used to order them."""
+
+
+def _dump(data: Any) -> bytes:
+    """Dumps data to YAML file contents."""
+    stream = io.StringIO()
+    pulumi_state_splitter.yaml_io.dump(data, stream)
+    return stream.getvalue().encode()
+
+
+def _write_if_changed(path: pathlib.Path, contents: bytes) -> bool:
+    """Writes a file unless it already has the same contents.
+
+    Returns whether the file was written.
+    """
+    try:
+        if path.read_bytes() == contents:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(contents)
+    return True
+
+
+def _save_file(
+    item: Tuple[pathlib.Path, Sequence[Union[bytes, Dict[str, Any]]]],
+) -> Tuple[bool, List[Tuple[int, str]]]:
+    """Writes a resource state file unless it is unchanged.
+
+    The documents of the file are dumped, unless they are `bytes` holding
+    dumped contents already. Returns whether the file was written and
+    the sizes and SHA-256 digests of the documents.
+    """
+    path, documents = item
+    documents = [
+        document if isinstance(document, bytes) else _dump(document)
+        for document in documents
+    ]
+    written = _write_if_changed(
+        path, pulumi_state_splitter.yaml_io.join_documents(documents)
+    )
+    return written, [
+        (len(document), hashlib.sha256(document).hexdigest()) for document in documents
+    ]
+
+
+def _file_data(resource: pulumi_state_splitter.model.Resource) -> Dict[str, Any]:
+    """The data of a resource written to its file."""
+    resource = resource.model_copy()
+    resource.dependencies = sorted(resource.dependencies)
+    if resource.type == "pulumi:pulumi:Stack":
+        resource.outputs = {}
+    return resource.model_dump(
+        exclude=pulumi_state_splitter.model.Resource.file_exclude
+    )
+
+
+def _resource_file(
+    resource: pulumi_state_splitter.model.Resource,
+    previous: Optional[
+        Mapping[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]
+    ] = None,
+) -> Tuple[Dict[str, Any], Union[bytes, Dict[str, Any]]]:
+    """Prepares a resource to be written to its file.
+
+    Returns the data of the resource and the file contents, dumped already
+    if the data is the same as of the resource in `previous`.
+    """
+    data = _file_data(resource)
+    if previous and resource.urn in previous:
+        known, contents = previous[resource.urn]
+        if _file_data(known) == data:
+            return data, contents
+    return data, data
+
+
+class ManifestEntry(pydantic.BaseModel):
+    """Describes a resource document in a file of a split state.
+
+    Files have a single document, unless in a packed `Layout`, then
+    the entries of their documents follow in order.
+    """
+
+    path: str
+    urn: str
+    size: int
+    sha256: str
+    parent: Optional[str] = None
+    provider: Optional[str] = None
+    dependencies: List[str] = pydantic.Field(default_factory=list)
+
+
+class Manifest(pydantic.BaseModel):
+    """Index of the resource files of a split state."""
+
+    files: List[ManifestEntry] = pydantic.Field(default_factory=list)
+
+
+class VerifyReport(pydantic.BaseModel):
+    """Differences between the resource files and the manifest."""
+
+    missing: List[str] = []
+    modified: List[str] = []
+    unlisted: List[str] = []
+
+    def __bool__(self) -> bool:
+        return not (self.missing or self.modified or self.unlisted)
+
+    def __str__(self) -> str:
+        return "\n".join(
+            f"{problem}: {path}"
+            for problem, paths in (
+                ("missing", self.missing),
+                ("modified", self.modified),
+                ("unlisted", self.unlisted),
+            )
+            for path in paths
+        )
+
+
+class SaveReport(pydantic.BaseModel):
+    """Counts of files affected by saving a split state."""
+
+    written: int = 0
+    skipped: int = 0
+    deleted: int = 0
+
+    def add(self, written: bool):
+        """Counts a written or skipped file."""
+        if written:
+            self.written += 1
+        else:
+            self.skipped += 1
+
+    def __str__(self) -> str:
+        return (
+            f"{self.written} written, {self.skipped} unchanged, "
+            f"{self.deleted} deleted"
+        )
 
 
 class StateDir(pulumi_state_splitter.stored_state.StoredState):
     """Represents a split Pulumi stack state."""
 
+    layout: pulumi_state_splitter.layout.Layout = pydantic.Field(
+        default_factory=pulumi_state_splitter.layout.Layout
+    )
+    # of the unsplit state file, `backend_dir` if None
+    state_file_backend_dir: Optional[pathlib.Path] = None
+
     @property
     def path(self) -> pathlib.Path:
         """Path of the state directory."""
@@ -25,26 +258,81 @@ class StateDir(pulumi_state_splitter.stored_state.StoredState):
     def _state_path(self):
         return self.path / "state.yaml"
 
+    @property
+    def _outputs_path(self):
+        return self.path / "outputs.yaml"
+
+    @property
+    def _manifest_path(self):
+        return self.path / "manifest.yaml"
+
+    def _resource_paths(self) -> List[pathlib.Path]:
+        """Paths of the resource files in the state directory, sorted.
+
+        Packed resource files of the stack's children are in the state
+        directory itself, along with the other files.
+        """
+        paths = []
+        other = {self._state_path, self._outputs_path, self._manifest_path}
+        for dirpath, _, filenames in os.walk(self.path):
+            dirpath = pathlib.Path(dirpath)
+            if dirpath == self.path and not self.layout.packed:
+                continue
+            paths.extend(
+                dirpath / filename
+                for filename in filenames
+                if dirpath / filename not in other
+            )
+        paths.sort()
+        return paths
+
     @classmethod
-    def from_state_file(cls, state_file: pulumi_state_splitter.state_file.StateFile):
-        """Converts a Pulumi stack state file to a split state."""
-        return cls(**state_file.model_dump())
+    def from_state_file(
+        cls,
+        state_file: pulumi_state_splitter.state_file.StateFile,
+        layout: Optional[pulumi_state_splitter.layout.Layout] = None,
+        backend_dir: Optional[pathlib.Path] = None,
+    ):
+        """Converts a Pulumi stack state file to a split state.
+
+        The split state is in `backend_dir`, the state file's if None.
+        """
+        return cls(
+            backend_dir=backend_dir or state_file.backend_dir,
+            stack_name=state_file.stack_name,
+            state=state_file.state,
+            layout=layout or pulumi_state_splitter.layout.Layout(),
+            state_file_backend_dir=state_file.backend_dir,
+        )
 
     def to_state_file(self) -> pulumi_state_splitter.state_file.StateFile:
         """Converts a split state to a Pulumi stack state file."""
-        return pulumi_state_splitter.state_file.StateFile(**self.model_dump())
+        return pulumi_state_splitter.state_file.StateFile(
+            backend_dir=self.state_file_backend_dir or self.backend_dir,
+            stack_name=self.stack_name,
+            state=self.state,
+        )
 
+    @pulumi_state_splitter.lock.locked
     def remove(self):
-        self._state_path.unlink()
+        paths = set()
         if self.state.checkpoint.latest:
-            for resource in self.state.checkpoint.latest.resources:
-                path = self.path / self.resource_subpath(resource)
+            resources = self.state.checkpoint.latest.resources
+            subpaths = self.resource_subpaths(resources, self.layout)
+            for resource in resources:
                 if resource.type == "pulumi:pulumi:Stack":
-                    (self.path / "outputs.yaml").unlink()
-                path.unlink()
-                pulumi_state_splitter.fs.rmdir_if_empty(path.parent)
-        for d in (self.path, self.path.parent):
-            pulumi_state_splitter.fs.rmdir_if_empty(d)
+                    paths.add(self._outputs_path)
+                paths.add(self.path / subpaths[resource.urn])
+        self._remove_files(paths)
+
+    def _remove_files(self, paths: Iterable[pathlib.Path]):
+        """Removes the state, manifest and resource files."""
+        self._state_path.unlink()
+        self._manifest_path.unlink(missing_ok=True)
+        self._unlink(paths)
+        pulumi_state_splitter.fs.rmdir_if_empty(self.path)
+        # shared with other stacks, possibly processed concurrently
+        pulumi_state_splitter.fs.rmdir_if_empty(self.path.parent, missing_ok=True)
 
     @classmethod
     def find(
@@ -59,120 +347,543 @@ class StateDir(pulumi_state_splitter.stored_state.StoredState):
                 stack=stack_dir.name,
             )
 
-    def load(self):
-        """Loads the contents of the state directory."""
+    def _digests(self, trust: bool) -> Dict[pathlib.Path, Set[str]]:
+        """Digests of resource documents in the manifest, if they are trusted."""
+        manifest = self.read_manifest() if trust else None
+        digests = collections.defaultdict(set)
+        for entry in manifest.files if manifest else []:
+            digests[self.path / entry.path].add(entry.sha256)
+        return digests
+
+    def _load_state(self):
+        """Loads the state without the resources and the layout."""
         with self._state_path.open() as f:
-            data = yaml.load(f, yaml.Loader)
+            data = pulumi_state_splitter.yaml_io.load(f)
+        self.layout = pulumi_state_splitter.layout.Layout.model_validate(
+            data.pop("layout", {})
+        )
         self.state = pulumi_state_splitter.model.State.model_validate(data)
+
+    @pulumi_state_splitter.lock.locked
+    def load(
+        self,
+        jobs: int = 1,
+        cache: Optional[pulumi_state_splitter.cache.ResourceCache] = None,
+        trust: bool = False,
+        documents: Optional[Dict[str, bytes]] = None,
+    ):
+        """Loads the contents of the state directory.
+
+        Resource files are parsed and validated by `jobs` worker processes,
+        or taken from the `cache` if they were parsed before. With `trust`
+        documents with contents as listed in the manifest are not validated,
+        as they were written by `save`. The documents of the resources
+        in their files are put in `documents`, if given, by URN.
+        """
+        self._load_state()
         if not self.state.checkpoint.latest:
             return
+        digests = self._digests(trust)
+        strings = {}
         resources = []
-        for dirpath, _, filenames in os.walk(self.path):
-            dirpath = pathlib.Path(dirpath)
-            if dirpath == self.path:
-                continue
-            for filename in filenames:
-                with (dirpath / filename).open() as f:
-                    data = yaml.load(f, yaml.Loader)
-                resource = pulumi_state_splitter.model.Resource.model_validate(data)
+        for file_resources in pulumi_state_splitter.parallel.imap(
+            functools.partial(
+                _load_resources, cache=cache, documents=documents is not None
+            ),
+            ((path, digests.get(path, ())) for path in self._resource_paths()),
+            jobs=jobs,
+            chunk_size=_CHUNK_SIZE,
+        ):
+            for loaded in file_resources:
+                if documents is not None:
+                    resource, document = loaded
+                    documents[resource.urn] = document
+                else:
+                    resource = loaded
                 if resource.type == "pulumi:pulumi:Stack":
-                    with (self.path / "outputs.yaml").open() as f:
-                        resource.outputs = yaml.load(f, yaml.Loader)
+                    with self._outputs_path.open() as f:
+                        resource.outputs = pulumi_state_splitter.yaml_io.load(f)
+                resource.intern(strings)
                 resources.append(resource)
         self.state.checkpoint.latest.resources = (
-            pulumi_state_splitter.model.Resource.find_parents(resources)
+            pulumi_state_splitter.model.Resource.find_parents(resources, copy=False)
         )
 
     @classmethod
     def resource_subpath(
-        cls, resource: pulumi_state_splitter.model.Resource
+        cls,
+        resource: pulumi_state_splitter.model.Resource,
+        layout: Optional[pulumi_state_splitter.layout.Layout] = None,
     ) -> pathlib.Path:
         """Determines where should a resource state be written to."""
-        if (
-            resource.parent_resource
-            and resource.parent_resource.type != "pulumi:pulumi:Stack"
-        ):
-            directory = cls.resource_subpath(resource.parent_resource).with_suffix("")
-        else:
+        return cls.resource_subpaths([resource], layout)[resource.urn]
+
+    @classmethod
+    def resource_subpaths(
+        cls,
+        resources: Iterable[pulumi_state_splitter.model.Resource],
+        layout: Optional[pulumi_state_splitter.layout.Layout] = None,
+    ) -> Dict[str, pathlib.Path]:
+        """Determines where should resources states be written to.
+
+        Returns a mapping from resource URNs to paths, computing
+        the path of every resource and its ancestors only once.
+        The paths are in the default `Layout` unless one is given.
+        """
+        layout = layout or pulumi_state_splitter.layout.Layout()
+        directories = {}
+        subpaths = {}
+        for resource in resources:
+            # ancestors with directories not determined yet, closest first
+            chain = []
+            ancestor = resource
+            while ancestor and ancestor.urn not in subpaths:
+                chain.append(ancestor)
+                ancestor = ancestor.parent_resource
+                if ancestor and ancestor.type == "pulumi:pulumi:Stack":
+                    ancestor = None
+            directory = directories[ancestor.urn] if ancestor else pathlib.Path()
+            for ancestor in reversed(chain):
+                subpath = layout.subpath(directory, ancestor)
+                directory = layout.directory(subpath, ancestor)
+                directories[ancestor.urn] = directory
+                subpaths[ancestor.urn] = subpath
+        return subpaths
+
+    def _streamed_subpaths(
+        self, resources: Iterable[pulumi_state_splitter.model.Resource]
+    ) -> Iterator[Tuple[pulumi_state_splitter.model.Resource, pathlib.Path]]:
+        """Determines where should resources states be written to as they come.
+
+        Parents have to precede their children, as they do in Pulumi
+        state files, so that only directories have to be remembered.
+        """
+        directories = {}
+        for resource in resources:
             directory = pathlib.Path()
-        type_dir_name = resource.type.replace(":", "-")  # für Windows
-        return directory / type_dir_name / f"{resource.name}.yaml"
+            if resource.parent:
+                try:
+                    directory = directories[resource.parent]
+                except KeyError:
+                    raise ValueError(
+                        f"resource {resource.urn} precedes its parent {resource.parent}"
+                    ) from None
+            subpath = self.layout.subpath(directory, resource)
+            if resource.type == "pulumi:pulumi:Stack":
+                directories[resource.urn] = pathlib.Path()
+            else:
+                directories[resource.urn] = self.layout.directory(subpath, resource)
+            yield resource, subpath
+
+    def _files(
+        self,
+        resources: Iterable[Tuple[pulumi_state_splitter.model.Resource, pathlib.Path]],
+    ) -> Iterable[Tuple[pathlib.Path, List[pulumi_state_splitter.model.Resource]]]:
+        """Groups resources given with their subpaths by their files.
+
+        The resources are grouped as they come, unless the layout is packed,
+        then all are collected and each file's are sorted by their names.
+        """
+        if not self.layout.packed:
+            return ((subpath, [resource]) for resource, subpath in resources)
+        files = collections.defaultdict(list)
+        for resource, subpath in resources:
+            files[subpath].append(resource)
+        for file_resources in files.values():
+            file_resources.sort(key=lambda resource: resource.name)
+        return files.items()
+
+    def _remove_stale(self, paths: Container[pathlib.Path]) -> int:
+        """Removes files not in `paths` and directories left empty.
+
+        Returns the number of removed files.
+        """
+        stale = [path for path in self._resource_paths() if path not in paths]
+        if self._outputs_path not in paths and self._outputs_path.exists():
+            stale.append(self._outputs_path)
+        self._unlink(stale)
+        return len(stale)
+
+    def _unlink(self, paths: Iterable[pathlib.Path]):
+        """Removes files and the directories left empty in the state directory."""
+        emptied = set()
+        for path in paths:
+            path.unlink()
+            emptied.update(path.relative_to(self.path).parents)
+        emptied.discard(pathlib.Path())
+        # reversed, so that subdirectories are removed before their parents
+        for directory in sorted(emptied, reverse=True):
+            pulumi_state_splitter.fs.rmdir_if_empty(self.path / directory)
+
+    def _make_directories(self, directory: pathlib.Path, made: Set[pathlib.Path]):
+        """Creates a directory and its parents, unless already `made`."""
+        missing = []
+        while directory.name and directory not in made:
+            made.add(directory)
+            missing.append(directory)
+            directory = directory.parent
+        # reversed, so that parents are created before their subdirectories
+        for subpath in reversed(missing):
+            (self.path / subpath).mkdir(exist_ok=True)
 
-    def save(self):
-        """Writes the contents of the state to a directory."""
-        dump = self.state.model_dump(
+    def _state_data(self) -> Dict[str, Any]:
+        """The contents of the state file, the state without the resources.
+
+        The layout is recorded unless it is the default one.
+        """
+        data = self.state.model_dump(
             exclude={
                 "checkpoint": {
                     "latest": {"resources"},
                 },
             },
         )
-        self.path.mkdir(parents=True, exist_ok=True)
-        with self._state_path.open("w") as f:
-            yaml.dump(dump, f)
-        if not self.state.checkpoint.latest:
-            return
-        for resource in self.state.checkpoint.latest.resources:
-            resource = resource.model_copy()
-            resource.dependencies = sorted(resource.dependencies)
-            if resource.type == "pulumi:pulumi:Stack":
-                with (self.path / "outputs.yaml").open("w") as f:
-                    yaml.dump(resource.outputs or {}, f)
-                    resource.outputs = {}
-            path = self.path / self.resource_subpath(resource)
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with path.open("w") as f:
-                yaml.dump(
-                    resource.model_dump(
-                        exclude=pulumi_state_splitter.model.Resource.file_exclude
-                    ),
-                    f,
-                )
+        layout = self.layout.model_dump(exclude_defaults=True)
+        if layout:
+            data["layout"] = layout
+        return data
 
-    @classmethod
-    def split_state_file(cls, state_file: pulumi_state_splitter.state_file.StateFile):
-        """Splits a Pulumi stack state file into multiple files."""
-        split_state = cls.from_state_file(state_file)
-        split_state.save()
-        state_file.remove()
+    def _save(
+        self,
+        resources: Iterable[Tuple[pulumi_state_splitter.model.Resource, pathlib.Path]],
+        jobs: int,
+        previous: Optional[
+            Mapping[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]
+        ] = None,
+    ) -> SaveReport:
+        """Writes resources given with their subpaths and then the state.
 
-    def unsplit(self):
-        """Merges a split Pulumi stack state into single state file."""
-        state_file = self.to_state_file()
-        state_file.save()
-        self.remove()
+        Only files with changed contents are written and files of resources
+        not given are deleted. Resource files are serialized, compared and
+        written by `jobs` worker processes as the resources come, unless
+        packed, the state is only needed once they are exhausted. Resources
+        equal to ones in `previous`, mapping URNs to resources with their
+        documents' contents, are not serialized again.
+        """
+        report = SaveReport()
+        pulumi_state_splitter.fs.make_directories(self.path)
+        paths = set()
+        top_level = {}
+        # manifest entries waiting for the sizes and digests of the documents
+        pending = collections.deque()
+
+        def files_data():
+            made = set()
+            for subpath, file_resources in self._files(resources):
+                self._make_directories(subpath.parent, made)
+                paths.add(self.path / subpath)
+                documents = []
+                for resource in file_resources:
+                    if resource.type == "pulumi:pulumi:Stack":
+                        top_level[self._outputs_path] = resource.outputs or {}
+                    data, contents = _resource_file(resource, previous)
+                    pending.append(
+                        {
+                            "path": subpath.as_posix(),
+                            **{key: data[key] for key in _HEADER_KEYS if key in data},
+                        }
+                    )
+                    documents.append(contents)
+                yield self.path / subpath, documents
+
+        manifest = []
+        for written, documents in pulumi_state_splitter.parallel.imap(
+            _save_file,
+            files_data(),
+            jobs=jobs,
+            chunk_size=_CHUNK_SIZE,
+        ):
+            report.add(written)
+            manifest.extend(
+                ManifestEntry(size=size, sha256=sha256, **pending.popleft())
+                for size, sha256 in documents
+            )
+        # stable, so that the documents of packed files stay in order
+        manifest.sort(key=lambda entry: entry.path)
 
+        top_level[self._manifest_path] = {
+            "files": [entry.model_dump(exclude_defaults=True) for entry in manifest]
+        }
+        # written last, as it marks a complete state directory
+        top_level[self._state_path] = self._state_data()
+        for path, data in top_level.items():
+            report.add(_write_if_changed(path, _dump(data)))
+        paths.update(top_level)
+        report.deleted = self._remove_stale(paths)
+        return report
 
-class Unsplitter(pydantic.BaseModel):
-    """A context manager unsplitting and splitting the states."""
+    @pulumi_state_splitter.lock.locked
+    def save(
+        self,
+        jobs: int = 1,
+        previous: Optional[
+            Mapping[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]
+        ] = None,
+    ) -> SaveReport:
+        """Writes the contents of the state to a directory.
 
-    backend_dir: pathlib.Path
-    stacks_names: Optional[Sequence[pulumi_state_splitter.stored_state.StackName]] = (
-        pydantic.Field(default_factory=list)
-    )
+        Only files with changed contents are written and files of resources
+        no longer in the state are deleted. Resource files are serialized,
+        compared and written by `jobs` worker processes, except for resources
+        equal to ones in `previous`, mapping URNs to resources with their
+        file contents.
+        """
+        if self.state.checkpoint.latest:
+            resources = self.state.checkpoint.latest.resources
+        else:
+            resources = []
+        subpaths = self.resource_subpaths(resources, self.layout)
+        return self._save(
+            ((resource, subpaths[resource.urn]) for resource in resources),
+            jobs,
+            previous,
+        )
+
+    def read_layout(self) -> pulumi_state_splitter.layout.Layout:
+        """Reads the layout of the state directory from its state file."""
+        with self._state_path.open() as f:
+            data = pulumi_state_splitter.yaml_io.load(f)
+        return pulumi_state_splitter.layout.Layout.model_validate(
+            data.get("layout", {})
+        )
 
-    def __enter__(self):
-        stacks_names = self.stacks_names
-        if stacks_names is None:
-            stacks_names = StateDir.find(self.backend_dir)
-        for stack_name in stacks_names:
-            state_dir = pulumi_state_splitter.split.StateDir(
-                backend_dir=self.backend_dir,
-                stack_name=stack_name,
+    def read_manifest(self) -> Optional[Manifest]:
+        """Reads the manifest of the state directory, if there is one."""
+        try:
+            with self._manifest_path.open() as f:
+                data = pulumi_state_splitter.yaml_io.load(f)
+        except FileNotFoundError:
+            return None
+        return Manifest.model_validate(data)
+
+    def verify(self) -> Optional[VerifyReport]:
+        """Checks the resource files against the manifest.
+
+        Returns `None` if there is no manifest.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+        self.layout = self.read_layout()
+        missing = []
+        modified = []
+        unlisted = {
+            path.relative_to(self.path).as_posix() for path in self._resource_paths()
+        }
+        files = collections.defaultdict(list)
+        for entry in manifest.files:
+            files[entry.path].append((entry.size, entry.sha256))
+        for subpath, documents in files.items():
+            if subpath not in unlisted:
+                missing.append(subpath)
+                continue
+            unlisted.remove(subpath)
+            contents = (self.path / subpath).read_bytes()
+            if documents != [
+                (len(document), hashlib.sha256(document).hexdigest())
+                for document in pulumi_state_splitter.yaml_io.split_documents(contents)
+            ]:
+                modified.append(subpath)
+        return VerifyReport(
+            missing=missing,
+            modified=modified,
+            unlisted=sorted(unlisted),
+        )
+
+    @classmethod
+    def split_state_file(  # pylint: disable=too-many-arguments
+        cls,
+        state_file: pulumi_state_splitter.state_file.StateFile,
+        jobs: int = 1,
+        streaming: bool = False,
+        previous: Optional[
+            Mapping[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]
+        ] = None,
+        layout: Optional[pulumi_state_splitter.layout.Layout] = None,
+        backend_dir: Optional[pathlib.Path] = None,
+    ) -> SaveReport:
+        """Splits a Pulumi stack state file into multiple files.
+
+        With `streaming` the state file is read incrementally while
+        the resources are written instead of having to be loaded,
+        so only the relationships between the resources are kept in memory.
+        Resources equal to ones in `previous`, mapping URNs to resources
+        with their file contents, are not serialized again.
+        The files are arranged in the given `layout`, the default one if none,
+        which cannot be packed when streaming. They are written to
+        `backend_dir`, the one of the state file if None.
+        """
+        if streaming and layout and layout.packed:
+            raise ValueError("packed resource files cannot be split streaming")
+        with pulumi_state_splitter.lock.stack_lock(
+            backend_dir or state_file.backend_dir, state_file.stack_name
+        ):
+            if not streaming:
+                split_state = cls.from_state_file(state_file, layout, backend_dir)
+                report = split_state.save(jobs=jobs, previous=previous)
+                state_file.remove()
+                return report
+
+            split_state = cls(
+                backend_dir=backend_dir or state_file.backend_dir,
+                stack_name=state_file.stack_name,
+                layout=layout or pulumi_state_splitter.layout.Layout(),
+                state_file_backend_dir=state_file.backend_dir,
             )
-            state_dir.load()
-            state_dir.unsplit()
-
-    def __exit__(self, type_, value, traceback):
-        stacks_names = self.stacks_names
-        if stacks_names is None:
-            stacks_names = pulumi_state_splitter.state_file.StateFile.find(
-                self.backend_dir
+
+            def resources():
+                yield from state_file.load_resources()
+                # the rest of the state is known after all the resources
+                split_state.state = state_file.state
+
+            report = split_state._save(
+                split_state._streamed_subpaths(resources()), jobs, previous
             )
-        for stack_name in stacks_names:
-            state_file = pulumi_state_splitter.state_file.StateFile(
-                backend_dir=self.backend_dir,
-                stack_name=stack_name,
+            state_file.remove()
+            return report
+
+    @property
+    def _keeps_files(self) -> bool:
+        """Whether the split state is kept when unsplit to another backend.
+
+        This way splitting it back only writes the files which changed.
+        """
+        return self.state_file_backend_dir not in (None, self.backend_dir)
+
+    @pulumi_state_splitter.lock.locked
+    def unsplit(self):
+        """Merges a split Pulumi stack state into single state file.
+
+        An existing state file with other contents, which may be newer,
+        is not overwritten, `FileExistsError` is raised instead.
+        """
+        state_file = self.to_state_file()
+        state_file.save(replace=False)
+        if not self._keeps_files:
+            self.remove()
+
+    def _headers(self, jobs: int, manifest: bool) -> Dict[pathlib.Path, Dict[str, Any]]:
+        """Reads the attributes determining the order of the resources.
+
+        With `manifest` they are taken from the manifest, unless it does not
+        list exactly the resource files there are, with the same sizes.
+        """
+        paths = self._resource_paths()
+        if manifest and (read := self.read_manifest()):
+            headers = {
+                self.path / entry.path: _header(entry.model_dump())
+                for entry in read.files
+            }
+            if headers.keys() == set(paths) and all(
+                path.stat().st_size == entry.size
+                for path, entry in zip(headers, read.files)
+            ):
+                return headers
+        return dict(
+            zip(
+                paths,
+                pulumi_state_splitter.parallel.imap(
+                    _load_header,
+                    paths,
+                    jobs=jobs,
+                    chunk_size=_CHUNK_SIZE,
+                ),
             )
-            state_file.load()
-            StateDir.split_state_file(state_file)
+        )
+
+    def _unsplit_streaming(
+        self,
+        jobs: int,
+        cache: Optional[pulumi_state_splitter.cache.ResourceCache],
+        manifest: bool,
+        digests: Mapping[pathlib.Path, Set[str]],
+    ) -> List[pathlib.Path]:
+        """Writes the state file from resource files ordered by their headers.
+
+        Files with `digests` are trusted, see `load`.
+        Returns the paths of the files merged into it.
+        """
+        headers = self._headers(jobs=jobs, manifest=manifest)
+        graph = pulumi_state_splitter.graph.Graph(headers.values())
+        by_index = {
+            graph.index[header["urn"]]: path for path, header in headers.items()
+        }
+        paths = [by_index[i] for i in graph.sorted()]
+        del graph, by_index
+
+        merged = []
+
+        def resources():
+            for path, (resource,) in zip(
+                paths,
+                pulumi_state_splitter.parallel.imap(
+                    functools.partial(_load_resources, cache=cache),
+                    ((path, digests.get(path, ())) for path in paths),
+                    jobs=jobs,
+                    chunk_size=_CHUNK_SIZE,
+                ),
+            ):
+                if _header(dict(resource)) != headers[path]:
+                    raise _StaleHeaders(path)
+                if resource.type == "pulumi:pulumi:Stack":
+                    with self._outputs_path.open() as f:
+                        resource.outputs = pulumi_state_splitter.yaml_io.load(f)
+                    merged.append(self._outputs_path)
+                merged.append(path)
+                yield resource
+
+        self.to_state_file().save_resources(resources(), replace=False)
+        return merged
+
+    @pulumi_state_splitter.lock.locked
+    def unsplit_streaming(
+        self,
+        jobs: int = 1,
+        cache: Optional[pulumi_state_splitter.cache.ResourceCache] = None,
+        trust: bool = False,
+    ):
+        """Merges a split Pulumi stack state into single state file.
+
+        Rather than being loaded first, the resource files are read twice.
+        First only the attributes determining the order of the resources
+        are kept, taken from the manifest when it matches the files, then
+        each resource is read and written to the state file in that order.
+        This way only the relationships between the resources are kept
+        in memory. Resource files are read by `jobs` worker processes.
+        See `load` for `trust`. Packed resource files are not supported.
+        An existing state file is not overwritten, see `unsplit`.
+        """
+        self._load_state()
+        if self.layout.packed:
+            raise ValueError("packed resource files cannot be unsplit streaming")
+        merged = []
+        if self.state.checkpoint.latest:
+            digests = self._digests(trust)
+            try:
+                merged = self._unsplit_streaming(jobs, cache, True, digests)
+            except _StaleHeaders:
+                merged = self._unsplit_streaming(jobs, cache, False, digests)
+        else:
+            self.to_state_file().save(replace=False)
+        if not self._keeps_files:
+            self._remove_files(merged)
+
+
+# moved to `pulumi_state_splitter.stacks`, which imports this module
+_STACKS_NAMES = frozenset(
+    [
+        "StackResult",
+        "StacksError",
+        "Unsplitter",
+        "for_each_stack",
+        "split_stack",
+        "unsplit_stack",
+    ]
+)
+
+
+def __getattr__(name: str) -> Any:
+    """Gets the names moved to `pulumi_state_splitter.stacks`, for compatibility."""
+    if name in _STACKS_NAMES:
+        return getattr(importlib.import_module("pulumi_state_splitter.stacks"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
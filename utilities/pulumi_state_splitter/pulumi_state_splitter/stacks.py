@@ -0,0 +1,423 @@
+"""Splitting and unsplitting of whole stacks, many at once."""
+
+import functools
+import pathlib
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import pydantic
+
+import pulumi_state_splitter.cache
+import pulumi_state_splitter.fs
+import pulumi_state_splitter.layout
+import pulumi_state_splitter.lock
+import pulumi_state_splitter.model
+import pulumi_state_splitter.parallel
+import pulumi_state_splitter.split
+import pulumi_state_splitter.state_file
+import pulumi_state_splitter.stored_state
+
+
+class _Unsplit(pydantic.BaseModel):
+    """A stack state as it was when unsplit by `Unsplitter`."""
+
+    state_dir: pulumi_state_splitter.split.StateDir
+    # of the state file
+    size: int
+    sha256: str
+    # of the resource files, by URN
+    contents: Dict[str, bytes]
+
+    def unchanged(self) -> bool:
+        """Checks whether the state file has the same contents still."""
+        path = self.state_dir.to_state_file().path
+        try:
+            if path.stat().st_size != self.size:
+                return False
+        except FileNotFoundError:
+            return False
+        return pulumi_state_splitter.fs.hash_file(path) == self.sha256
+
+    def previous(
+        self,
+    ) -> Dict[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]:
+        """The resources of the state with their file contents, by URN."""
+        return {
+            resource.urn: (resource, self.contents[resource.urn])
+            for resource in self.state_dir.state.checkpoint.latest.resources
+        }
+
+
+class StackResult(pydantic.BaseModel):
+    """The outcome of processing a stack."""
+
+    stack_name: pulumi_state_splitter.stored_state.StackName
+    seconds: float
+    result: Any = None
+    error: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.error is not None:
+            outcome = f"failed: {self.error}"
+        else:
+            outcome = self.result or "done"
+        return f"{self.stack_name}: {outcome} ({self.seconds:.2f}s)"
+
+
+class StacksError(Exception):
+    """Processing of some of the stacks failed."""
+
+    def __init__(self, results: Sequence[StackResult]):
+        super().__init__("\n".join(str(result) for result in results))
+        self.results = results
+
+
+def _timed(
+    function: Callable[..., Any],
+    jobs: int,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+) -> StackResult:
+    """Applies a function to a stack, capturing its failure."""
+    start = time.perf_counter()
+    try:
+        result = function(stack_name, jobs=jobs)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        return StackResult(
+            stack_name=stack_name,
+            seconds=time.perf_counter() - start,
+            error="\n".join(
+                [f"{type(error).__name__}: {error}", *getattr(error, "__notes__", [])]
+            ),
+        )
+    return StackResult(
+        stack_name=stack_name,
+        seconds=time.perf_counter() - start,
+        result=result,
+    )
+
+
+def for_each_stack(
+    function: Callable[..., Any],
+    stacks_names: Iterable[pulumi_state_splitter.stored_state.StackName],
+    jobs: int = 1,
+) -> List[StackResult]:
+    """Applies a function to stacks, returning the results in their order.
+
+    The function is called with a stack name and a number of `jobs` to use.
+    Many stacks are distributed over `jobs` worker processes, each getting
+    one job, while a single stack gets all of them. Failures are captured
+    in the results, so that all the stacks are processed.
+    """
+    stacks_names = list(stacks_names)
+    stack_jobs = jobs if len(stacks_names) > 1 else 1
+    return list(
+        pulumi_state_splitter.parallel.imap(
+            functools.partial(_timed, function, jobs // stack_jobs),
+            stacks_names,
+            jobs=stack_jobs,
+        )
+    )
+
+
+def split_stack(  # pylint: disable=too-many-arguments
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    jobs: int = 1,
+    streaming: bool = False,
+    previous: Optional[
+        Mapping[str, Tuple[pulumi_state_splitter.model.Resource, bytes]]
+    ] = None,
+    layout: Optional[pulumi_state_splitter.layout.Layout] = None,
+    state_file_backend_dir: Optional[pathlib.Path] = None,
+) -> pulumi_state_splitter.split.SaveReport:
+    """Splits a stack state file.
+
+    See `pulumi_state_splitter.split.StateDir.split_state_file`.
+    A packed `layout` is split without `streaming`, which it does not support.
+    The state file is read from `state_file_backend_dir`, if given.
+    """
+    streaming = streaming and not (layout and layout.packed)
+    state_file = pulumi_state_splitter.state_file.StateFile(
+        backend_dir=state_file_backend_dir or backend_dir,
+        stack_name=stack_name,
+    )
+    with pulumi_state_splitter.lock.stack_lock(backend_dir, stack_name):
+        if not streaming:
+            state_file.load()
+        return pulumi_state_splitter.split.StateDir.split_state_file(
+            state_file,
+            jobs=jobs,
+            streaming=streaming,
+            previous=previous,
+            layout=layout,
+            backend_dir=backend_dir,
+        )
+
+
+def unsplit_stack(  # pylint: disable=too-many-arguments
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    jobs: int = 1,
+    cache: Optional[pulumi_state_splitter.cache.ResourceCache] = None,
+    streaming: bool = False,
+    trust: bool = False,
+    state_file_backend_dir: Optional[pathlib.Path] = None,
+):
+    """Unsplits a stack state.
+
+    See `pulumi_state_splitter.split.StateDir.unsplit_streaming`.
+    A packed state is unsplit without `streaming`, which it does not support.
+    The state file is written to `state_file_backend_dir`, if given.
+    """
+    state_dir = pulumi_state_splitter.split.StateDir(
+        backend_dir=backend_dir,
+        stack_name=stack_name,
+        state_file_backend_dir=state_file_backend_dir,
+    )
+    with pulumi_state_splitter.lock.stack_lock(backend_dir, stack_name):
+        if streaming and not state_dir.read_layout().packed:
+            state_dir.unsplit_streaming(jobs=jobs, cache=cache, trust=trust)
+        else:
+            state_dir.load(jobs=jobs, cache=cache, trust=trust)
+            state_dir.unsplit()
+
+
+class Unsplitter(pydantic.BaseModel):
+    """A context manager unsplitting and splitting the states.
+
+    Loaded states are kept in memory with the contents of their resource
+    files. Stacks with byte-for-byte unchanged state files are split
+    from memory on exit, without reading the state files. Other stacks
+    are read again, but only resources changed since are serialized.
+    Nothing is kept in memory with `streaming` or with many stacks
+    processed by `jobs` worker processes, see `for_each_stack`.
+    See `pulumi_state_splitter.split.StateDir.load` for `trust`.
+    Failures for some of the stacks raise `StacksError` once all the stacks
+    are processed, those unsplit already on entry are split back.
+    Stacks are split back in the `Layout` they were in.
+    The state files are in `state_file_backend_dir`, if given, for example
+    a scratch backend, see `pulumi_state_splitter.scratch`. Then the split
+    states are kept meanwhile, those of stacks removed are removed on exit.
+    The stacks are locked from entry to exit, see `pulumi_state_splitter.lock`,
+    those created meanwhile only while split. Without `stacks_names`,
+    stacks unsplit meanwhile by other processes are left to them.
+    """
+
+    backend_dir: pathlib.Path
+    stacks_names: Optional[Sequence[pulumi_state_splitter.stored_state.StackName]] = (
+        pydantic.Field(default_factory=list)
+    )
+    jobs: int = 1
+    cache: Optional[pulumi_state_splitter.cache.ResourceCache] = None
+    streaming: bool = False
+    trust: bool = False
+    state_file_backend_dir: Optional[pathlib.Path] = None
+
+    _unsplit: Dict[str, _Unsplit] = pydantic.PrivateAttr(default_factory=dict)
+    _layouts: Dict[str, pulumi_state_splitter.layout.Layout] = pydantic.PrivateAttr(
+        default_factory=dict
+    )
+    _locked: List[pulumi_state_splitter.stored_state.StackName] = pydantic.PrivateAttr(
+        default_factory=list
+    )
+
+    def _holding_lock(
+        self,
+        function: Callable[..., Any],
+        stack_name: pulumi_state_splitter.stored_state.StackName,
+        jobs: int,
+        **kwargs,
+    ) -> Any:
+        """Applies a method to a stack with its lock held.
+
+        The locks taken on entry are held by the process which entered,
+        worker processes inherit them.
+        """
+        with pulumi_state_splitter.lock.stack_lock(
+            self.backend_dir, stack_name, inherited=stack_name in self._locked
+        ):
+            return function(stack_name, jobs=jobs, **kwargs)
+
+    def _release(self):
+        while self._locked:
+            pulumi_state_splitter.lock.release(self.backend_dir, self._locked.pop())
+
+    def _enter_stack(
+        self,
+        stack_name: pulumi_state_splitter.stored_state.StackName,
+        jobs: int,
+        retain: bool,
+    ) -> Tuple[pulumi_state_splitter.layout.Layout, Optional[_Unsplit]]:
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self.backend_dir,
+            stack_name=stack_name,
+            state_file_backend_dir=self.state_file_backend_dir,
+        )
+        if not retain:
+            layout = state_dir.read_layout()
+            unsplit_stack(
+                self.backend_dir,
+                stack_name,
+                jobs=jobs,
+                cache=self.cache,
+                streaming=self.streaming,
+                trust=self.trust,
+                state_file_backend_dir=self.state_file_backend_dir,
+            )
+            return layout, None
+        contents = {}
+        state_dir.load(
+            jobs=jobs, cache=self.cache, trust=self.trust, documents=contents
+        )
+        state_dir.unsplit()
+        path = state_dir.to_state_file().path
+        return state_dir.layout, _Unsplit(
+            state_dir=state_dir,
+            size=path.stat().st_size,
+            sha256=pulumi_state_splitter.fs.hash_file(path),
+            contents=contents,
+        )
+
+    def _exit_stack(
+        self,
+        stack_name: pulumi_state_splitter.stored_state.StackName,
+        jobs: int,
+    ) -> pulumi_state_splitter.split.SaveReport:
+        unsplit = self._unsplit.pop(str(stack_name), None)
+        previous = None
+        if unsplit and unsplit.state_dir.state.checkpoint.latest:
+            previous = unsplit.previous()
+        if unsplit and unsplit.unchanged():
+            report = unsplit.state_dir.save(jobs=jobs, previous=previous)
+            unsplit.state_dir.to_state_file().remove()
+            return report
+        return split_stack(
+            self.backend_dir,
+            stack_name,
+            jobs=jobs,
+            streaming=self.streaming,
+            previous=previous,
+            layout=self._layouts.get(str(stack_name)),
+            state_file_backend_dir=self.state_file_backend_dir,
+        )
+
+    def __enter__(self):
+        stacks_names = self.stacks_names
+        if stacks_names is None:
+            stacks_names = pulumi_state_splitter.split.StateDir.find(self.backend_dir)
+        stacks_names = list(stacks_names)
+        # in the same order by every process, not to wait for each other
+        for stack_name in sorted(stacks_names, key=str):
+            try:
+                pulumi_state_splitter.lock.acquire(self.backend_dir, stack_name)
+            except TimeoutError:
+                self._release()
+                raise
+            self._locked.append(stack_name)
+        try:
+            self._enter(stacks_names)
+        except BaseException:
+            self._release()
+            raise
+
+    def _enter(self, stacks_names: List[pulumi_state_splitter.stored_state.StackName]):
+        retain = not self.streaming and (self.jobs == 1 or len(stacks_names) == 1)
+        results = for_each_stack(
+            functools.partial(self._holding_lock, self._enter_stack, retain=retain),
+            stacks_names,
+            jobs=self.jobs,
+        )
+        for result in results:
+            if result.error is None:
+                layout, unsplit = result.result
+                self._layouts[str(result.stack_name)] = layout
+                if unsplit is not None:
+                    self._unsplit[str(result.stack_name)] = unsplit
+        failed = [result for result in results if result.error is not None]
+        if failed:
+            self._split(result.stack_name for result in results if result.error is None)
+            raise StacksError(failed)
+
+    def _remove_stack(
+        self,
+        stack_name: pulumi_state_splitter.stored_state.StackName,
+        jobs: int,
+    ):
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self.backend_dir, stack_name=stack_name
+        )
+        state_dir.load(jobs=jobs, cache=self.cache, trust=self.trust)
+        state_dir.remove()
+
+    def _split(
+        self,
+        stacks_names: Iterable[pulumi_state_splitter.stored_state.StackName],
+        removed: Iterable[pulumi_state_splitter.stored_state.StackName] = (),
+    ):
+        results = for_each_stack(
+            functools.partial(self._holding_lock, self._exit_stack),
+            stacks_names,
+            jobs=self.jobs,
+        )
+        results += for_each_stack(
+            functools.partial(self._holding_lock, self._remove_stack),
+            removed,
+            jobs=self.jobs,
+        )
+        failed = [result for result in results if result.error is not None]
+        if failed:
+            raise StacksError(failed)
+
+    def _lock_new(
+        self, stack_name: pulumi_state_splitter.stored_state.StackName
+    ) -> bool:
+        """Locks a stack created meanwhile, unless another process holds it.
+
+        Stacks unsplit by other processes are locked by them.
+        """
+        try:
+            pulumi_state_splitter.lock.acquire(self.backend_dir, stack_name, timeout=0)
+        except TimeoutError:
+            return False
+        self._locked.append(stack_name)
+        # split back by its holder meanwhile
+        return pulumi_state_splitter.state_file.StateFile(
+            backend_dir=self.state_file_backend_dir or self.backend_dir,
+            stack_name=stack_name,
+        ).path.exists()
+
+    def __exit__(self, type_, value, traceback):
+        stacks_names = self.stacks_names
+        removed = []
+        if stacks_names is None:
+            locked = {str(stack_name) for stack_name in self._locked}
+            stacks_names = []
+            for stack_name in sorted(
+                pulumi_state_splitter.state_file.StateFile.find(
+                    self.state_file_backend_dir or self.backend_dir
+                ),
+                key=str,
+            ):
+                if str(stack_name) in locked or self._lock_new(stack_name):
+                    stacks_names.append(stack_name)
+            if self.state_file_backend_dir is not None:
+                found = {str(stack_name) for stack_name in stacks_names}
+                removed = [
+                    pulumi_state_splitter.stored_state.StackName.from_path(name)
+                    for name in self._layouts
+                    if name not in found
+                ]
+        try:
+            self._split(stacks_names, removed)
+        finally:
+            self._release()
@@ -1,12 +1,56 @@
 """Manipulation of the Pulumi stack state file."""
 
+import filecmp
 import pathlib
-from typing import Iterable, List
+from typing import IO, Any, Dict, Iterable, Iterator, List, Sequence
 
 import pulumi_state_splitter.fs
+import pulumi_state_splitter.json_stream
+import pulumi_state_splitter.lock
 import pulumi_state_splitter.model
 import pulumi_state_splitter.stored_state
 
+# how the resources of the latest checkpoint are serialized
+# in a state without them and the indentation of their objects
+_RESOURCES_KEY = '\n            "resources": []'
+_RESOURCE_INDENT = "\n" + 16 * " "
+
+
+def _references(resource: pulumi_state_splitter.model.Resource) -> List[str]:
+    """URNs of the resources which need to precede a resource."""
+    # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L194
+    references = list(resource.dependencies or [])
+    # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L156
+    if resource.provider:
+        references.append(resource.provider.rsplit("::", 1)[0])
+    # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L166
+    if resource.parent:
+        references.append(resource.parent)
+    references.sort()
+    return references
+
+
+def _stream_array(
+    reader: pulumi_state_splitter.json_stream.Reader,
+    path: Sequence[str],
+    into: Dict[str, Any],
+) -> Iterator[Any]:
+    """Reads an object, yielding the items of the array at `path` in it.
+
+    The rest of the object is stored in `into`,
+    with the array at `path` empty.
+    """
+    for key in reader.members():
+        if key != path[0] or reader.peek() not in "{[":
+            into[key] = reader.value()
+        elif len(path) > 1:
+            into[key] = {}
+            yield from _stream_array(reader, path[1:], into[key])
+        else:
+            into[key] = []
+            for _ in reader.items():
+                yield reader.value()
+
 
 def sorted_resources(
     resources: Iterable[pulumi_state_splitter.model.Resource],
@@ -20,30 +64,55 @@ def sorted_resources(
       error: snapshot integrity failure; refusing to use it:
        resource <urn-1> refers to unknown provider <urn-2>`
       ```
+
+    Resources are visited in URN order and each one is preceded by
+    its dependencies, provider and parent, each visited in URN order too.
+    Raises `ValueError` on dependency cycles and references
+    to resources not present in `resources`.
     """
     # sort by URN first
-    urn2resource = dict(sorted((resource.urn, resource) for resource in resources))
-
-    output = {}
-
-    def dependencies_first(resource: pulumi_state_splitter.model.Resource):
-        # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L194
-        dependencies = resource.dependencies.copy()
-        # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L156
-        if resource.provider:
-            provider_urn = resource.provider.rsplit("::", 1)[0]
-            dependencies.append(provider_urn)
-        # https://github.com/pulumi/pulumi/blob/91bcce1/pkg/resource/deploy/snapshot.go#L166
-        if resource.parent:
-            dependencies.append(resource.parent)
-        dependencies.sort()
-        for dependency in dependencies:
-            dependencies_first(urn2resource[dependency])
-        output.setdefault(resource.urn, resource)
-
-    for resource in urn2resource.values():
-        dependencies_first(resource)
-    return list(output.values())
+    urn2resource = {
+        resource.urn: resource
+        for resource in sorted(resources, key=lambda resource: resource.urn)
+    }
+
+    output = []
+    done = set()
+
+    # Iterative depth-first search emitting resources in post-order,
+    # the path holds resources with iterators over their unvisited references.
+    for root in urn2resource.values():
+        if root.urn in done:
+            continue
+        path = [(root, iter(_references(root)))]
+        in_path = {root.urn}
+        while path:
+            resource, references = path[-1]
+            for urn in references:
+                if urn in done:
+                    continue
+                if urn in in_path:
+                    cycle = [r.urn for r, _ in path] + [urn]
+                    start = cycle.index(urn)
+                    cycle = cycle[start:]
+                    raise ValueError(
+                        f"dependency cycle between resources: {' -> '.join(cycle)}"
+                    )
+                try:
+                    reference = urn2resource[urn]
+                except KeyError:
+                    raise ValueError(
+                        f"resource {resource.urn} refers to unknown resource {urn}"
+                    ) from None
+                path.append((reference, iter(_references(reference))))
+                in_path.add(urn)
+                break
+            else:
+                path.pop()
+                in_path.remove(resource.urn)
+                done.add(resource.urn)
+                output.append(resource)
+    return output
 
 
 class StateFile(pulumi_state_splitter.stored_state.StoredState):
@@ -68,6 +137,7 @@ class StateFile(pulumi_state_splitter.stored_state.StoredState):
                 stack=stack_path.with_suffix("").name,
             )
 
+    @pulumi_state_splitter.lock.locked
     def remove(self):
         self.path.unlink()
         for d in (
@@ -75,32 +145,127 @@ class StateFile(pulumi_state_splitter.stored_state.StoredState):
             self.path.parent.parent,
             self.path.parent.parent.parent,
         ):
-            pulumi_state_splitter.fs.rmdir_if_empty(d)
+            # shared with other stacks, possibly processed concurrently
+            pulumi_state_splitter.fs.rmdir_if_empty(d, missing_ok=True)
 
+    @pulumi_state_splitter.lock.locked
     def load(self):
         """Loads the contents of the state file."""
         self.state = pulumi_state_splitter.model.State.model_validate_json(
             self.path.read_text()
         )
         if self.state.checkpoint.latest:
+            strings = {}
+            for resource in self.state.checkpoint.latest.resources:
+                resource.intern(strings)
             self.state.checkpoint.latest.resources = (
                 pulumi_state_splitter.model.Resource.find_parents(
-                    self.state.checkpoint.latest.resources
+                    self.state.checkpoint.latest.resources,
+                    copy=False,
                 )
             )
 
-    def save(self):
-        """Writes the contents of the state to a file."""
-        state = self.state.model_copy(deep=True)
-        if state.checkpoint.latest:
-            state.checkpoint.latest.resources = sorted_resources(
-                state.checkpoint.latest.resources
+    def load_resources(self) -> Iterator[pulumi_state_splitter.model.Resource]:
+        """Loads the contents of the state file incrementally.
+
+        Resources are yielded one by one as they are read, without
+        `parent_resource` set. Once they are exhausted, the state
+        without resources is available in `state`.
+        """
+        data = {}
+        with pulumi_state_splitter.lock.stack_lock(self.backend_dir, self.stack_name):
+            with self.path.open() as f:
+                reader = pulumi_state_splitter.json_stream.Reader(f)
+                for item in _stream_array(
+                    reader, ("checkpoint", "latest", "resources"), data
+                ):
+                    yield pulumi_state_splitter.model.Resource.model_validate(item)
+                reader.end()
+        self.state = pulumi_state_splitter.model.State.model_validate(data)
+
+    @pulumi_state_splitter.lock.locked
+    def save(self, replace: bool = True):
+        """Writes the contents of the state to a file.
+
+        Resources are serialized one by one in `sorted_resources` order
+        into the rest of the state, the output is the same as of
+        serializing the whole state at once. See `save_resources`
+        for `replace`.
+        """
+        latest = self.state.checkpoint.latest
+        self.save_resources(
+            sorted_resources(latest.resources) if latest else [], replace=replace
+        )
+
+    @pulumi_state_splitter.lock.locked
+    def save_resources(
+        self,
+        resources: Iterable[pulumi_state_splitter.model.Resource],
+        replace: bool = True,
+    ):
+        """Writes the state to a file with the given resources.
+
+        The resources in `state` are ignored, the given ones are serialized
+        one by one as they come, in their order. Unless `replace`, an existing
+        state file is left as is: the state is written aside and compared to
+        it, `FileExistsError` is raised if they differ. Then the file written
+        is removed if writing it fails.
+        """
+        aside = not replace and self.path.exists()
+        path = self.path.with_name(f".{self.path.name}.new") if aside else self.path
+        try:
+            with pulumi_state_splitter.fs.open_making_directories(path, "w") as f:
+                self._write(f, resources)
+            if aside and not filecmp.cmp(path, self.path, shallow=False):
+                raise FileExistsError(
+                    f"{self.path} exists with other contents than the state"
+                )
+        except BaseException:
+            if not replace:
+                # partially written, not to be taken for a state
+                path.unlink(missing_ok=True)
+            raise
+        if aside:
+            path.unlink()
+
+    def _write(
+        self, f: IO[str], resources: Iterable[pulumi_state_splitter.model.Resource]
+    ):
+        header = self.state
+        if header.checkpoint.latest:
+            header = header.model_copy(
+                update={
+                    "checkpoint": header.checkpoint.model_copy(
+                        update={
+                            "latest": header.checkpoint.latest.model_copy(
+                                update={"resources": []}
+                            )
+                        }
+                    ),
+                }
             )
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        with self.path.open("w") as f:
+        text = header.model_dump_json(
+            exclude=pulumi_state_splitter.model.State.file_exclude,
+            indent=4,
+        )
+        # splitting around the "]" of the only key at this depth
+        # which holds an empty array, that of "checkpoint.latest"
+        split = None
+        for resource in resources:
+            if split is None:
+                split = text.index(_RESOURCES_KEY) + len(_RESOURCES_KEY) - 1
+                f.write(text[:split])
+            else:
+                f.write(",")
+            f.write(_RESOURCE_INDENT)
             f.write(
-                state.model_dump_json(
-                    exclude=pulumi_state_splitter.model.State.file_exclude,
+                resource.model_dump_json(
+                    exclude=pulumi_state_splitter.model.Resource.file_exclude,
                     indent=4,
-                )
+                ).replace("\n", _RESOURCE_INDENT)
             )
+        if split is None:
+            f.write(text)
+        else:
+            f.write(_RESOURCE_INDENT[:-4])
+            f.write(text[split:])
@@ -0,0 +1,89 @@
+"""Inference of the stacks Pulumi commands operate on."""
+
+import pathlib
+from typing import Iterator, List, Mapping, Optional, Sequence
+
+import yaml
+
+import pulumi_state_splitter.stored_state
+import pulumi_state_splitter.yaml_io
+
+
+def _option_values(args: Sequence[str], short: str, long: str) -> Iterator[str]:
+    """Values of a command line option, in the forms Pulumi accepts."""
+    remaining = iter(args)
+    for arg in remaining:
+        if arg in (short, long):
+            yield next(remaining, "")
+        elif arg.startswith(long + "="):
+            yield arg[len(long) + 1 :]
+        elif arg.startswith(short) and not arg.startswith("--"):
+            yield arg[len(short) :].removeprefix("=")
+
+
+def _project_name(directory: pathlib.Path) -> Optional[str]:
+    """Name of the Pulumi project in a directory, if there is one.
+
+    There is none either if the project file cannot be read or lacks a name.
+    """
+    for file_name in "Pulumi.yaml", "Pulumi.yml":
+        try:
+            with (directory / file_name).open() as f:
+                project = pulumi_state_splitter.yaml_io.load(f)
+        except FileNotFoundError:
+            continue
+        except (OSError, yaml.YAMLError):
+            return None
+        name = project.get("name") if isinstance(project, dict) else None
+        return name if isinstance(name, str) else None
+    return None
+
+
+def command_stack(
+    command: Sequence[str],
+    env: Mapping[str, str],
+    cwd: pathlib.Path,
+) -> Optional[pulumi_state_splitter.stored_state.StackName]:
+    """The stack a Pulumi command selects, `None` if not known.
+
+    The stack is taken from the `--stack` option, or else from the
+    `PULUMI_STACK` environment variable, which some wrappers set.
+    Names without a project are completed with the one in the project
+    directory, `cwd` or the `--cwd` option. The stack selected with
+    `pulumi stack select` is not known.
+    """
+    if not command or pathlib.Path(command[0]).name != "pulumi":
+        return None
+    args = command[1:]
+    stacks = list(_option_values(args, "-s", "--stack"))
+    name = stacks[-1] if stacks else env.get("PULUMI_STACK")
+    if not name:
+        return None
+    if "/" in name:
+        try:
+            return pulumi_state_splitter.stored_state.StackName.from_path(name)
+        except ValueError:
+            return None
+    directories = list(_option_values(args, "-C", "--cwd"))
+    project = _project_name(cwd / directories[-1] if directories else cwd)
+    if project is None:
+        return None
+    return pulumi_state_splitter.stored_state.StackName(project=project, stack=name)
+
+
+def commands_stacks(
+    commands: Sequence[Sequence[str]],
+    env: Mapping[str, str],
+    cwd: pathlib.Path,
+) -> Optional[List[pulumi_state_splitter.stored_state.StackName]]:
+    """The stacks Pulumi commands select, `None` if not known for any.
+
+    See `command_stack`.
+    """
+    stacks = {}
+    for command in commands:
+        stack_name = command_stack(command, env, cwd)
+        if stack_name is None:
+            return None
+        stacks[str(stack_name)] = stack_name
+    return list(stacks.values())
@@ -0,0 +1,74 @@
+"""YAML serialization, using libyaml when available."""
+
+import re
+from typing import IO, Any, Iterable, List
+
+import yaml
+
+# Can be set to False to use the pure Python implementation only.
+USE_LIBYAML = yaml.__with_libyaml__
+
+# Strings which both emitters write the same way, others can be quoted
+# and folded differently.
+_PLAIN_TEXT = re.compile(r"[ -~]*")
+
+# Lines starting documents, other than the first one, in files with many.
+# In documents written by `dump` such lines cannot occur otherwise.
+_DOCUMENT_START = re.compile(rb"^---\n", re.MULTILINE)
+
+# libyaml and the pure Python emitter have different limits for simple
+# mapping keys, this leaves room for quoting.
+_MAX_KEY_LENGTH = 60
+
+
+def _libyaml_emits_same(data: Any, key: bool = False) -> bool:
+    """Checks if libyaml would write `data` like the pure Python emitter."""
+    if isinstance(data, str):
+        if key and not 0 < len(data) <= _MAX_KEY_LENGTH:
+            return False
+        return bool(_PLAIN_TEXT.fullmatch(data))
+    if isinstance(data, dict):
+        return all(
+            _libyaml_emits_same(k, key=True) and _libyaml_emits_same(v)
+            for k, v in data.items()
+        )
+    if isinstance(data, list):
+        return all(_libyaml_emits_same(item) for item in data)
+    return data is None or isinstance(data, (bool, int, float))
+
+
+def load(stream: IO) -> Any:
+    """Loads a YAML document."""
+    return yaml.load(stream, yaml.CSafeLoader if USE_LIBYAML else yaml.SafeLoader)
+
+
+def dump(data: Any, stream: IO):
+    """Writes a YAML document.
+
+    The output is identical regardless of libyaml availability,
+    libyaml is only used for documents it is known to write the same way.
+    """
+    # the pure Python emitter ends top level scalars with a "..." line
+    if USE_LIBYAML and isinstance(data, (dict, list)) and _libyaml_emits_same(data):
+        dumper = yaml.CSafeDumper
+    else:
+        dumper = yaml.SafeDumper
+    yaml.dump(data, stream, Dumper=dumper)
+
+
+def join_documents(documents: Iterable[bytes]) -> bytes:
+    """Joins documents written by `dump` into the contents of a single file."""
+    return b"---\n".join(documents)
+
+
+def split_documents(contents: bytes) -> List[bytes]:
+    """Splits the contents of a file into documents, see `join_documents`.
+
+    The documents are as written by `dump`, so that they can be compared
+    with the documents to be written.
+    """
+    documents = _DOCUMENT_START.split(contents)
+    # explicitly started first document
+    if len(documents) > 1 and not documents[0]:
+        del documents[0]
+    return documents
@@ -0,0 +1,125 @@
+"""Testing `pulumi_state_splitter.cache`."""
+
+import os
+import pathlib
+import unittest.mock
+
+import typeguard
+
+from . import util
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.cache
+    import pulumi_state_splitter.model
+
+
+_RESOURCE = pulumi_state_splitter.model.Resource(
+    type="foo",
+    urn="resource_1",
+    inputs={"bar": "baz"},
+)
+
+
+class TestResourceCache(util.TmpDirTest):
+    """Testing `pulumi_state_splitter.cache.ResourceCache`."""
+
+    def setUp(self):
+        super().setUp()
+        self._cache = pulumi_state_splitter.cache.ResourceCache(
+            directory=self._tmp_dir / "cache",
+        )
+        self._path = self._tmp_dir / "resource_1.yaml"
+        self._path.write_text("contents")
+
+    def test_get_put(self):
+        """Testing `ResourceCache.get` and `ResourceCache.put`."""
+        self.assertIsNone(self._cache.get(self._path, b"contents"))
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        self.assertEqual(self._cache.get(self._path, b"contents"), _RESOURCE)
+
+    def test_get_changed(self):
+        """Testing `ResourceCache.get` with a changed file."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        self.assertIsNone(self._cache.get(self._path, b"other contents"))
+        self.assertIsNone(
+            self._cache.get(self._tmp_dir / "cache" / "..", b"contents"),
+        )
+
+    def test_get_rewritten(self):
+        """Testing `ResourceCache.get` with a file rewritten with the same contents."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        self._path.unlink()
+        self._path.write_text("contents")
+        os.utime(self._path, ns=(0, 0))
+        self.assertEqual(self._cache.get(self._path, b"contents"), _RESOURCE)
+
+    def test_get_corrupt(self):
+        """Testing `ResourceCache.get` with an entry left partially written."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        (entry,) = self._cache.directory.iterdir()
+        entry.write_bytes(entry.read_bytes()[:10])
+        self.assertIsNone(self._cache.get(self._path, b"contents"))
+        self.assertFalse(entry.exists())
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        self.assertEqual(self._cache.get(self._path, b"contents"), _RESOURCE)
+
+    def test_get_other_model(self):
+        """Testing `ResourceCache.get` with an entry of another model version."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.cache, "_model_digest", return_value="other"
+        ):
+            self.assertIsNone(self._cache.get(self._path, b"contents"))
+
+    def test_prune(self):
+        """Testing `ResourceCache.prune` evicting least recently used entries."""
+        paths = [self._tmp_dir / f"resource_{i}.yaml" for i in range(4)]
+        for path in paths:
+            path.write_text(path.name)
+            self._cache.put(path, path.read_bytes(), _RESOURCE)
+        entries = list(self._cache.directory.iterdir())
+        for entry in entries:
+            os.utime(entry, ns=(0, 0))
+
+        self._cache.prune()
+        self.assertEqual(len(list(self._cache.directory.iterdir())), 4)
+
+        for path in paths[0], paths[2]:
+            self._cache.get(path, path.read_bytes())
+        self._cache.max_size = 2 * entries[0].stat().st_size
+        self._cache.prune()
+        self.assertEqual(
+            [self._cache.get(path, path.read_bytes()) for path in paths],
+            [_RESOURCE, None, _RESOURCE, None],
+        )
+
+    def test_prune_leftovers(self):
+        """Testing `ResourceCache.prune` with files left by `put`."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        stale = self._cache.directory / "tmpstale"
+        stale.write_bytes(b"partial")
+        os.utime(stale, ns=(0, 0))
+        fresh = self._cache.directory / "tmpfresh"
+        fresh.write_bytes(b"partial")
+        self._cache.prune()
+        self.assertFalse(stale.exists())
+        # possibly being written by another process
+        self.assertTrue(fresh.exists())
+        self.assertEqual(self._cache.get(self._path, b"contents"), _RESOURCE)
+
+    def test_prune_concurrent(self):
+        """Testing `ResourceCache.prune` with entries evicted meanwhile."""
+        self._cache.put(self._path, b"contents", _RESOURCE)
+        evicted = self._cache.directory / "evicted.pickle"
+        with unittest.mock.patch.object(
+            pathlib.Path,
+            "iterdir",
+            return_value=[evicted, *self._cache.directory.iterdir()],
+        ):
+            self._cache.prune()
+        self.assertEqual(self._cache.get(self._path, b"contents"), _RESOURCE)
+
+    def test_prune_empty(self):
+        """Testing `ResourceCache.prune` with nothing cached yet."""
+        self._cache.prune()
+        self.assertFalse(self._cache.directory.exists())
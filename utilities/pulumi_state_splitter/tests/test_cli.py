@@ -2,6 +2,12 @@
 
 import contextlib
 import itertools
+import os
+import pathlib
+import signal
+import subprocess
+import sys
+import unittest.mock
 from typing import Sequence
 
 import click.testing
@@ -10,11 +16,13 @@ import typeguard
 
 with typeguard.install_import_hook("pulumi_state_splitter"):
     import pulumi_state_splitter
+    import pulumi_state_splitter.cache
+    import pulumi_state_splitter.stacks
 
 from . import data, util
 
 
-class TestCli(util.TmpDirTest):
+class TestCli(util.TmpDirTest):  # pylint: disable=too-many-public-methods
     """Testing `pulumi_state_splitter.cli`."""
 
     def _cli_run(self, args: Sequence[str], want_exit_code=0):
@@ -25,6 +33,7 @@ class TestCli(util.TmpDirTest):
             catch_exceptions=False,
         )
         self.assertEqual(result.exit_code, want_exit_code, result.output)
+        return result
 
     @parameterized.parameterized.expand(
         itertools.product(
@@ -103,6 +112,420 @@ class TestCli(util.TmpDirTest):
         got = util.Directory.load(self._tmp_dir)
         want.compare(got, self)
 
+    def test_split_jobs(self):
+        """Testing `pulumi_state_splitter.cli`, split command with jobs"""
+        data.multi_stack_unsplit().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["split", "--jobs", "2"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_split().compare(got, self)
+
+    def test_split_jobs_errors(self):
+        """Testing `pulumi_state_splitter.cli`, split command with failures"""
+        input_ = data.multi_stack_unsplit()
+        input_[".pulumi"]["stacks"]["test-project-1"]["test-stack-2.json"] = "{}"
+        input_.save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["split", "--jobs", "2"], want_exit_code=1)
+        want = data.multi_stack_split()
+        want["test-project-1"].pop("test-stack-2")
+        want[".pulumi"] = {
+            "stacks": {"test-project-1": {"test-stack-2.json": "{}"}},
+        }
+        got = util.Directory.load(self._tmp_dir)
+        want.compare(got, self)
+
+    def test_split_stream(self):
+        """Testing `pulumi_state_splitter.cli`, split command with streaming"""
+        data.multi_stack_unsplit().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["split", "--stream"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_split().compare(got, self)
+
+    def test_split_run_scratch(self):
+        """Testing `pulumi_state_splitter.cli`, run command with a scratch backend"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir / "backend")
+        scratch_dir = self._tmp_dir / "scratch"
+        scratch_dir.mkdir()
+        script = """
+            test -f backend/test-project-2/test-stack-3/state.yaml
+            test ! -e backend/.pulumi/stacks/test-project-2/test-stack-3.json
+            test -f backend/.pulumi/locks/test-project-2/test-stack-3.lock
+            cd "${PULUMI_BACKEND_URL#file://}"
+            cp .pulumi/stacks/test-project-2/test-stack-3.json \\
+                .pulumi/stacks/test-project-2/test-stack-4.json
+            rm .pulumi/stacks/test-project-1/test-stack-2.json
+            mkdir .pulumi/history
+            echo '{}' > .pulumi/history/update.json
+        """
+        # the split states are kept meanwhile
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(
+                [
+                    "--backend-directory",
+                    "backend",
+                    "run",
+                    "--scratch",
+                    "--scratch-directory",
+                    "scratch",
+                    "--",
+                    "sh",
+                    "-e",
+                    "-c",
+                    script,
+                ]
+            )
+        want = input_
+        want["test-project-2"]["test-stack-4"] = want["test-project-2"]["test-stack-3"]
+        want["test-project-1"].pop("test-stack-2")
+        want[".pulumi"] = {"history": {"update.json": "{}\n"}}
+        got = util.Directory.load(self._tmp_dir / "backend")
+        want.compare(got, self)
+        self.assertEqual(list(scratch_dir.iterdir()), [])
+
+    def test_split_run_scratch_failed(self):
+        """Testing `pulumi_state_splitter.cli`, run command with a scratch backend
+        failing to split back"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir / "backend")
+        scratch_dir = self._tmp_dir / "scratch"
+        scratch_dir.mkdir()
+        with contextlib.chdir(self._tmp_dir):
+            result = self._cli_run(
+                [
+                    "--backend-directory",
+                    "backend",
+                    "run",
+                    "--scratch",
+                    "--scratch-directory",
+                    "scratch",
+                    "--",
+                    "sh",
+                    "-c",
+                    'cd "${PULUMI_BACKEND_URL#file://}"'
+                    " && echo '{' > .pulumi/stacks/test-project-1/test-stack-1.json",
+                ],
+                want_exit_code=1,
+            )
+        (kept,) = scratch_dir.iterdir()
+        self.assertIn(f"scratch backend kept in {kept}", result.output)
+        self.assertEqual(
+            (
+                kept / ".pulumi" / "stacks" / "test-project-1" / "test-stack-1.json"
+            ).read_text(),
+            "{\n",
+        )
+        # not copied back over the split state
+        input_.compare(util.Directory.load(self._tmp_dir / "backend"), self)
+
+    @parameterized.parameterized.expand(
+        [([],), (["--each-stack"],), (["--each-stack", "-j", "2"],)]
+    )
+    def test_run_signal(self, options):
+        """Testing `pulumi_state_splitter.cli`, run command getting a signal"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(
+                [
+                    "run",
+                    *options,
+                    "--",
+                    "sh",
+                    "-c",
+                    'trap "kill $! 2>/dev/null; touch interrupted; exit 1" TERM;'
+                    f" kill -TERM {os.getpid()}; sleep 60 >/dev/null 2>&1 & wait",
+                ],
+                want_exit_code=128 + signal.SIGTERM,
+            )
+        # the command is interrupted and the states are split back
+        input_["interrupted"] = ""
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    def test_run_script_signal(self):
+        """Testing `pulumi_state_splitter.cli`, run script getting a signal"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        script = self._tmp_dir / "script"
+        script.write_text(f"kill -TERM {os.getpid()}\ntouch after\n")
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(
+                ["run", "--script", str(script), "--keep-going"],
+                want_exit_code=128 + signal.SIGTERM,
+            )
+        # no commands are run after it
+        input_["script"] = script.read_text()
+        input_.compare(util.Directory.load(self._tmp_dir), self)
+
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_run_script(self, keep_going):
+        """Testing `pulumi_state_splitter.cli`, run command with a script"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir / "backend")
+        script = self._tmp_dir / "script"
+        script.write_text(
+            """
+            # copying a stack
+            cp .pulumi/stacks/test-project-2/test-stack-3.json \\
+                '.pulumi/stacks/test-project-2/test-stack-4.json'
+
+            false
+            touch ../after
+            """
+        )
+        with contextlib.chdir(self._tmp_dir / "backend"):
+            with unittest.mock.patch.object(
+                pulumi_state_splitter.stacks.Unsplitter,
+                "__enter__",
+                autospec=True,
+                side_effect=pulumi_state_splitter.stacks.Unsplitter.__enter__,
+            ) as enter:
+                self._cli_run(
+                    ["run", "--script", str(script)]
+                    + (["--keep-going"] if keep_going else []),
+                    want_exit_code=1,
+                )
+            self._cli_run(["run", "--script", str(script), "true"], want_exit_code=2)
+        self.assertEqual(enter.call_count, 1)
+        self.assertEqual((self._tmp_dir / "after").exists(), keep_going)
+        want = input_
+        want["test-project-2"]["test-stack-4"] = want["test-project-2"]["test-stack-3"]
+        got = util.Directory.load(self._tmp_dir / "backend")
+        want.compare(got, self)
+
+    @parameterized.parameterized.expand(
+        [
+            (["-s", "test-project-2/test-stack-3"], ["test-stack-3.json"]),
+            (["-s", "test-project-2/test-stack-4"], None),
+            ([], None),
+        ]
+    )
+    def test_run_infer_stacks(self, args, want):
+        """Testing `pulumi_state_splitter.cli`, run command inferring stacks"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir / "backend")
+        pulumi = self._tmp_dir / "bin" / "pulumi"
+        pulumi.parent.mkdir()
+        pulumi.write_text("#!/bin/sh\nls .pulumi/stacks/* > ../listing\n")
+        pulumi.chmod(0o755)
+        with contextlib.chdir(self._tmp_dir / "backend"):
+            self._cli_run(["run", "--infer-stacks", "--", str(pulumi), "up"] + args)
+        listing = (self._tmp_dir / "listing").read_text().split()
+        # all the stacks if not inferred
+        self.assertEqual(
+            sorted(name for name in listing if name.endswith(".json")),
+            want or ["test-stack-1.json", "test-stack-2.json", "test-stack-3.json"],
+        )
+        input_.compare(util.Directory.load(self._tmp_dir / "backend"), self)
+
+    @parameterized.parameterized.expand([("1",), ("2",)])
+    def test_run_each_stack(self, jobs):
+        """Testing `pulumi_state_splitter.cli`, run command for each stack"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir / "backend")
+        command = (
+            'ls .pulumi/stacks/* > "../listing-${PULUMI_STACK##*/}";'
+            ' echo "$PULUMI_STACK" "$1"; test "$1" != "$2"'
+        )
+        with contextlib.chdir(self._tmp_dir / "backend"):
+            result = self._cli_run(
+                ["run", "--each-stack", "-j", jobs, "--", "sh", "-c", command, "sh"]
+                + ["{stack}", "organization/test-project-2/test-stack-3"],
+                want_exit_code=1,
+            )
+        for stack_name in "test-stack-1", "test-stack-2", "test-stack-3":
+            listing = (self._tmp_dir / f"listing-{stack_name}").read_text().split()
+            # other stacks may be unsplit at the same time with many jobs
+            self.assertIn(f"{stack_name}.json", listing)
+            if jobs == "1":
+                self.assertEqual(
+                    [name for name in listing if name.endswith(".json")],
+                    [f"{stack_name}.json"],
+                )
+        if jobs == "1":
+            self.assertIn(
+                "test-project-1/test-stack-2: organization/test-project-1/test-stack-2"
+                " organization/test-project-1/test-stack-2\n",
+                result.output,
+            )
+        self.assertRegex(
+            result.output, r"test-project-2/test-stack-3: exit status 1 \(.*s\)"
+        )
+        self.assertRegex(
+            result.output, r"test-project-1/test-stack-1: exit status 0 \(.*s\)"
+        )
+        input_.compare(util.Directory.load(self._tmp_dir / "backend"), self)
+
+    def test_run_each_stack_error(self):
+        """Testing `pulumi_state_splitter.cli`, run command for each stack failing"""
+        input_ = data.multi_stack_split()
+        input_["test-project-1"]["test-stack-2"]["state.yaml"] = "{}"
+        input_.save(self._tmp_dir / "backend")
+        with contextlib.chdir(self._tmp_dir / "backend"):
+            result = self._cli_run(
+                [
+                    "run",
+                    "--each-stack",
+                    "--",
+                    "sh",
+                    "-c",
+                    'touch "../ran-${PULUMI_STACK##*/}"',
+                ],
+                want_exit_code=1,
+            )
+        self.assertRegex(
+            result.output,
+            "test-project-1/test-stack-2: failed: ValidationError.*",
+        )
+        # the command is run for the other stacks
+        self.assertEqual(
+            sorted(path.name for path in self._tmp_dir.glob("ran-*")),
+            ["ran-test-stack-1", "ran-test-stack-3"],
+        )
+        input_.compare(util.Directory.load(self._tmp_dir / "backend"), self)
+
+    def test_run_locked(self):
+        """Testing `pulumi_state_splitter.cli`, run command with a stack locked"""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        env = {
+            **os.environ,
+            "PULUMI_STATE_SPLITTER_LOCK_TIMEOUT": "0",
+            "PYTHONPATH": str(pathlib.Path(__file__).parent.parent),
+        }
+
+        def run(stack_name=None):
+            return subprocess.run(
+                [sys.executable, "-m", "pulumi_state_splitter"]
+                + ["--backend-directory", str(self._tmp_dir), "run"]
+                + (["--stack", str(stack_name)] if stack_name else [])
+                + ["--", "true"],
+                capture_output=True,
+                check=False,
+                env=env,
+                text=True,
+            )
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir, stacks_names=data.MULTI_STACK_NAMES[:1]
+        ):
+            # the other stacks can be processed meanwhile
+            completed = run(data.MULTI_STACK_NAMES[1])
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            completed = run(data.MULTI_STACK_NAMES[0])
+            self.assertEqual(completed.returncode, 1, completed.stderr)
+            self.assertRegex(
+                completed.stderr,
+                f"^stack test-project-1/test-stack-1 locked by process {os.getpid()}",
+            )
+            # all the stacks, but the one unsplit by another process
+            completed = run()
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            self.assertTrue(
+                (
+                    self._tmp_dir / ".pulumi/stacks/test-project-1/test-stack-1.json"
+                ).exists()
+            )
+            self.assertFalse((self._tmp_dir / "test-project-1/test-stack-1").exists())
+            self.assertFalse((self._tmp_dir / ".pulumi/stacks/test-project-2").exists())
+        input_.compare(util.Directory.load(self._tmp_dir), self)
+
+    def test_split_fanout(self):
+        """Testing `pulumi_state_splitter.cli`, split and run with a fanout"""
+        data.multi_stack_unsplit().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["split", "--fanout", "16"])
+            split = util.Directory.load(self._tmp_dir)
+            self._cli_run(["verify"])
+            self._cli_run(["run", "--", "true"])
+            self._cli_run(["unsplit"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_unsplit().compare(got, self)
+        self.assertIn(
+            "fanout: 16", split["test-project-1"]["test-stack-1"]["state.yaml"]
+        )
+        self.assertNotIn(
+            "pulumi-providers-command", split["test-project-1"]["test-stack-1"]
+        )
+
+    def test_split_packed(self):
+        """Testing `pulumi_state_splitter.cli`, split and run packed"""
+        data.multi_stack_unsplit().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["split", "--packed", "--fanout", "4"], want_exit_code=2)
+            self._cli_run(["split", "--packed", "--stream"])
+            split = util.Directory.load(self._tmp_dir)
+            self._cli_run(["verify"])
+            self._cli_run(["run", "--stream", "--", "true"])
+            self._cli_run(["unsplit", "--stream"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_unsplit().compare(got, self)
+        self.assertIn(
+            "packed: true", split["test-project-1"]["test-stack-1"]["state.yaml"]
+        )
+
+    def test_verify(self):
+        """Testing `pulumi_state_splitter.cli`, verify command"""
+        data.multi_stack_unsplit().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["verify"])
+            self._cli_run(["split"])
+            self._cli_run(["verify"])
+            (self._tmp_dir / "test-project-2/test-stack-3/manifest.yaml").unlink()
+            self._cli_run(["verify"], want_exit_code=1)
+            self._cli_run(["verify", "-s", "test-project-1/test-stack-1"])
+            unlisted = self._tmp_dir / "test-project-1/test-stack-1/foo/bar.yaml"
+            unlisted.parent.mkdir()
+            unlisted.write_text("{}")
+            self._cli_run(
+                ["verify", "-s", "test-project-1/test-stack-1"],
+                want_exit_code=1,
+            )
+
+    def test_unsplit_jobs(self):
+        """Testing `pulumi_state_splitter.cli`, unsplit command with jobs"""
+        data.multi_stack_split().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["unsplit", "--jobs", "2"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_unsplit().compare(got, self)
+
+    def test_unsplit_run_options(self):
+        """Testing `pulumi_state_splitter.cli`, unsplit and run options"""
+        data.multi_stack_split().save(self._tmp_dir)
+        with contextlib.chdir(self._tmp_dir):
+            self._cli_run(["run", "--stream", "true"])
+            self._cli_run(["run", "--trust-input", "true"])
+            self._cli_run(["unsplit", "--stream", "--trust-input"])
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_unsplit().compare(got, self)
+
+    def test_split_run_cache(self):
+        """Testing `pulumi_state_splitter.cli`, run command with a cache"""
+        data.multi_stack_split().save(self._tmp_dir)
+        with (
+            contextlib.chdir(self._tmp_dir),
+            unittest.mock.patch.object(
+                pulumi_state_splitter.cache.ResourceCache,
+                "prune",
+                autospec=True,
+                side_effect=pulumi_state_splitter.cache.ResourceCache.prune,
+            ) as prune,
+        ):
+            self._cli_run(
+                ["run", "--cache-directory", str(self._tmp_dir / "cache"), "true"],
+            )
+            self._cli_run(
+                ["unsplit", "--cache-directory", str(self._tmp_dir / "cache")],
+            )
+        # once per command, not per stack
+        self.assertEqual(prune.call_count, 2)
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_unsplit().compare(got, self)
+
     def test_split_run_error(self):
         """Testing `pulumi_state_splitter.cli`, failing run command"""
         with contextlib.chdir(self._tmp_dir):
@@ -114,3 +537,37 @@ class TestCli(util.TmpDirTest):
                 ],
                 want_exit_code=1,
             )
+
+    @parameterized.parameterized.expand(
+        [
+            ([],),
+            (["split"],),
+            (["unsplit"],),
+            (["run"],),
+        ]
+    )
+    def test_import_time(self, args):
+        """Testing that the help does not import the heavy modules."""
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-m",
+                "pulumi_state_splitter",
+                *args,
+                "--help",
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        # lines like "import time:  self [us] | cumulative | imported package"
+        imported = {
+            line.rsplit("|", 1)[-1].strip()
+            for line in completed.stderr.splitlines()
+            if line.startswith("import time:")
+        }
+        self.assertIn("pulumi_state_splitter.cli", imported)
+        for module in ("pydantic", "yaml", "pulumi_state_splitter.model"):
+            self.assertNotIn(module, imported)
@@ -1,5 +1,8 @@
 """Testing `pulumi_state_splitter.fs`."""
 
+import pathlib
+import unittest.mock
+
 import typeguard
 
 with typeguard.install_import_hook("pulumi_state_splitter"):
@@ -8,6 +11,19 @@ with typeguard.install_import_hook("pulumi_state_splitter"):
 from . import util
 
 
+def _removed_once(function, error):
+    """Makes a function fail once, as if racing with a removal of a directory."""
+    failed = []
+
+    def removed(*args, **kwargs):
+        if not failed:
+            failed.append(error)
+            raise error
+        return function(*args, **kwargs)
+
+    return removed
+
+
 class TestStateFileFilesystem(util.TmpDirTest):
     """Testing `pulumi_state_splitter.fs`."""
 
@@ -28,3 +44,54 @@ class TestStateFileFilesystem(util.TmpDirTest):
         """Testing error handling."""
         with self.assertRaises(FileNotFoundError):
             pulumi_state_splitter.fs.rmdir_if_empty(self._tmp_dir / "nonexistant")
+        filename = self._tmp_dir / "foo.txt"
+        filename.touch()
+        with self.assertRaises(NotADirectoryError):
+            pulumi_state_splitter.fs.rmdir_if_empty(filename, missing_ok=True)
+
+    def test_rmdir_if_empty_missing_ok(self):
+        """Testing skipping of removal of a missing directory."""
+        pulumi_state_splitter.fs.rmdir_if_empty(
+            self._tmp_dir / "nonexistant", missing_ok=True
+        )
+
+    def test_make_directories(self):
+        """Testing creation of a directory and its parents."""
+        path = self._tmp_dir / "foo" / "bar"
+        pulumi_state_splitter.fs.make_directories(path)
+        self.assertTrue(path.is_dir())
+        pulumi_state_splitter.fs.make_directories(path)
+        self.assertTrue(path.is_dir())
+
+    def test_make_directories_removed(self):
+        """Testing creation of a directory with parents removed meanwhile."""
+        path = self._tmp_dir / "foo" / "bar"
+        for error in (
+            FileNotFoundError(),
+            FileExistsError(17, "File exists", str(path.parent)),
+        ):
+            with unittest.mock.patch.object(
+                pathlib.Path, "mkdir", _removed_once(pathlib.Path.mkdir, error)
+            ):
+                pulumi_state_splitter.fs.make_directories(path)
+            self.assertTrue(path.is_dir())
+            path.rmdir()
+            path.parent.rmdir()
+
+    def test_make_directories_file(self):
+        """Testing creation of a directory with a file in the way."""
+        (self._tmp_dir / "foo").touch()
+        with self.assertRaises(FileExistsError):
+            pulumi_state_splitter.fs.make_directories(self._tmp_dir / "foo")
+
+    def test_open_making_directories(self):
+        """Testing opening a file with its directory removed meanwhile."""
+        path = self._tmp_dir / "foo" / "bar.txt"
+        with unittest.mock.patch.object(
+            pathlib.Path,
+            "open",
+            _removed_once(pathlib.Path.open, FileNotFoundError()),
+        ):
+            with pulumi_state_splitter.fs.open_making_directories(path, "w") as f:
+                f.write("bar")
+        self.assertEqual(path.read_text(), "bar")
@@ -0,0 +1,90 @@
+"""Testing `pulumi_state_splitter.graph`."""
+
+import tracemalloc
+import unittest
+
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.graph
+    import pulumi_state_splitter.model
+    import pulumi_state_splitter.state_file
+
+from . import data
+from .test_state_file import _generated_resources
+
+
+def _headers(resources):
+    """Headers of resources as read from their files."""
+    return [
+        resource.model_dump(
+            include={"urn", "parent", "provider", "dependencies"}, exclude_none=True
+        )
+        for resource in resources
+    ]
+
+
+def _sorted_urns(headers):
+    """URNs of resources ordered by `Graph.sorted`."""
+    graph = pulumi_state_splitter.graph.Graph(headers)
+    return [graph.urns[i] for i in graph.sorted()]
+
+
+class TestGraph(unittest.TestCase):
+    """Testing `Graph`."""
+
+    def test_sorted(self):
+        """Testing that resources are ordered as by `sorted_resources`."""
+        for resources in data.resources().values(), _generated_resources(1000):
+            self.assertEqual(
+                _sorted_urns(_headers(resources)),
+                [
+                    resource.urn
+                    for resource in pulumi_state_splitter.state_file.sorted_resources(
+                        resources
+                    )
+                ],
+            )
+
+    def test_sorted_cycle(self):
+        """Testing ordering of resources with a dependency cycle."""
+        headers = [
+            {"urn": "resource_0"},
+            {"urn": "resource_1", "dependencies": ["resource_3"]},
+            {"urn": "resource_2", "parent": "resource_1"},
+            {"urn": "resource_3", "dependencies": ["resource_0", "resource_2"]},
+        ]
+        with self.assertRaisesRegex(
+            ValueError,
+            "resource_1 -> resource_3 -> resource_2 -> resource_1",
+        ):
+            _sorted_urns(headers)
+
+    def test_sorted_unknown(self):
+        """Testing ordering of resources referring to a missing resource."""
+        headers = [{"urn": "resource_0", "provider": "provider::deadbeef"}]
+        with self.assertRaisesRegex(
+            ValueError,
+            "resource_0 refers to unknown resource provider",
+        ):
+            _sorted_urns(headers)
+
+    def test_sorted_memory(self):
+        """Testing that ordering takes less memory than building models."""
+        headers = _headers(_generated_resources(2_000))
+        peaks = {}
+        for graph in False, True:
+            tracemalloc.start()
+            try:
+                if graph:
+                    _sorted_urns(headers)
+                else:
+                    pulumi_state_splitter.state_file.sorted_resources(
+                        pulumi_state_splitter.model.Resource.model_construct(**header)
+                        for header in headers
+                    )
+                _, peaks[graph] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertLess(peaks[True], peaks[False] / 2)
@@ -12,6 +12,7 @@ import yaml
 from . import util
 
 with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.stacks
     import pulumi_state_splitter.state_file
     import pulumi_state_splitter.stored_state
 
@@ -125,13 +126,13 @@ class TestPulumiIntegration(util.TmpDirTest):
 
             pulumi.export("test-output", ref.stdout)
 
-        with pulumi_state_splitter.split.Unsplitter(
+        with pulumi_state_splitter.stacks.Unsplitter(
             backend_dir=self._tmp_dir,
             stacks_names=None,
         ):
             stack = self._create_stack("test-stack", pulumi_program)
 
-        unsplitter = pulumi_state_splitter.split.Unsplitter(
+        unsplitter = pulumi_state_splitter.stacks.Unsplitter(
             backend_dir=self._tmp_dir,
             stacks_names=[
                 pulumi_state_splitter.stored_state.StackName(
@@ -205,7 +206,7 @@ class TestPulumiIntegration(util.TmpDirTest):
             "with-output", pulumi_program_with_output
         )
 
-        unsplitter = pulumi_state_splitter.split.Unsplitter(
+        unsplitter = pulumi_state_splitter.stacks.Unsplitter(
             backend_dir=self._tmp_dir,
             stacks_names=None,
         )
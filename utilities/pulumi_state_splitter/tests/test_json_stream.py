@@ -0,0 +1,71 @@
+"""Testing `pulumi_state_splitter.json_stream`."""
+
+import io
+import json
+import unittest
+
+import parameterized
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.json_stream
+
+
+def _read(reader: pulumi_state_splitter.json_stream.Reader):
+    """Reads a value using the incremental methods for containers."""
+    character = reader.peek()
+    if character == "{":
+        return {key: _read(reader) for key in reader.members()}
+    if character == "[":
+        return [_read(reader) for _ in reader.items()]
+    return reader.value()
+
+
+_DOCUMENT = {
+    "empty object": {},
+    "empty array": [],
+    "numbers": [0, 12345678, -1.5e10, 3.25],
+    "constants": [True, False, None],
+    "nested": {"a": [{"b": ["c", {"d": "e"}]}], "f": "x" * 100},
+    "escapes": 'quote " backslash \\ unicode ü☃',
+}
+
+
+class TestReader(unittest.TestCase):
+    """Testing `pulumi_state_splitter.json_stream.Reader`."""
+
+    @parameterized.parameterized.expand([(1,), (2,), (7,), (1 << 16,)])
+    def test_read(self, chunk_size):
+        """Testing reading of a document in pieces."""
+        for indent in None, 4:
+            text = json.dumps(_DOCUMENT, indent=indent)
+            reader = pulumi_state_splitter.json_stream.Reader(
+                io.StringIO(text), chunk_size=chunk_size
+            )
+            self.assertEqual(_read(reader), _DOCUMENT)
+            reader.end()
+
+    def test_number_at_end(self):
+        """Testing reading of a number split between chunks."""
+        reader = pulumi_state_splitter.json_stream.Reader(
+            io.StringIO("[12345]"), chunk_size=3
+        )
+        self.assertEqual(_read(reader), [12345])
+
+    @parameterized.parameterized.expand(
+        [
+            ("{1: 2}", "expected an object key, got 1"),
+            ('{"a" 2}', "expected one of ':', got '2'"),
+            ("[1 2]", "expected one of ',]', got '2'"),
+            ("[1,", "Expecting value"),
+            ("{} {}", "extra data after the JSON document"),
+        ]
+    )
+    def test_errors(self, text, message):
+        """Testing reading of invalid documents."""
+        reader = pulumi_state_splitter.json_stream.Reader(
+            io.StringIO(text), chunk_size=2
+        )
+        with self.assertRaisesRegex(ValueError, message):
+            _read(reader)
+            reader.end()
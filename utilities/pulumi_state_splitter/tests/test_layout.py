@@ -0,0 +1,75 @@
+"""Testing `pulumi_state_splitter.layout`."""
+
+import collections
+import pathlib
+import unittest
+
+import parameterized
+import pydantic
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.layout
+    import pulumi_state_splitter.model
+
+
+_RESOURCE = pulumi_state_splitter.model.Resource(
+    type="foo:bar:Baz",
+    urn="urn:pulumi:test-stack::test-project::foo:bar:Baz::name",
+)
+
+
+class TestLayout(unittest.TestCase):
+    """Testing `Layout`."""
+
+    @parameterized.parameterized.expand(
+        [
+            (1, "parent/foo-bar-Baz/name.yaml"),
+            (16, "parent/foo-bar-Baz/e/name.yaml"),
+            (256, "parent/foo-bar-Baz/7e/name.yaml"),
+            (100, "parent/foo-bar-Baz/5e/name.yaml"),
+        ]
+    )
+    def test_subpath(self, fanout, want):
+        """Testing `Layout.subpath`."""
+        layout = pulumi_state_splitter.layout.Layout(fanout=fanout)
+        got = layout.subpath(pathlib.Path("parent"), _RESOURCE)
+        self.assertEqual(got, pathlib.Path(want))
+
+    def test_subpath_spread(self):
+        """Testing that `Layout.subpath` spreads resources evenly."""
+        layout = pulumi_state_splitter.layout.Layout(fanout=16)
+        counts = collections.Counter(
+            layout.subpath(
+                pathlib.Path(),
+                pulumi_state_splitter.model.Resource(
+                    type="foo",
+                    urn=f"urn:pulumi:test-stack::test-project::foo::resource-{i}",
+                ),
+            ).parent
+            for i in range(1600)
+        )
+        self.assertEqual(
+            set(counts), {pathlib.Path("foo", f"{shard:x}") for shard in range(16)}
+        )
+        self.assertLess(max(counts.values()), 200)
+
+    def test_fanout_invalid(self):
+        """Testing rejection of a fanout of no subdirectories."""
+        with self.assertRaises(pydantic.ValidationError):
+            pulumi_state_splitter.layout.Layout(fanout=0)
+
+    def test_packed(self):
+        """Testing `Layout.subpath` and `Layout.directory` with packed files."""
+        layout = pulumi_state_splitter.layout.Layout(packed=True)
+        subpath = layout.subpath(pathlib.Path("parent"), _RESOURCE)
+        self.assertEqual(subpath, pathlib.Path("parent/foo-bar-Baz.yaml"))
+        self.assertEqual(
+            layout.directory(subpath, _RESOURCE),
+            pathlib.Path("parent/foo-bar-Baz/name"),
+        )
+
+    def test_packed_invalid(self):
+        """Testing rejection of packed files spread over subdirectories."""
+        with self.assertRaisesRegex(pydantic.ValidationError, "cannot be spread"):
+            pulumi_state_splitter.layout.Layout(fanout=4, packed=True)
@@ -0,0 +1,169 @@
+"""Testing `pulumi_state_splitter.lock`."""
+
+import fcntl
+import importlib
+import os
+import subprocess
+import sys
+import unittest.mock
+
+import parameterized
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.lock
+
+from . import data, util
+
+
+class TestStackLock(util.TmpDirTest):
+    """Testing `stack_lock`."""
+
+    def _hold(self, locker: bool = False) -> int:
+        """Locks the stack's lock file as another process would.
+
+        Returns the process listed as the holder, a `locker` process
+        which exits leaving the lock to this one, if requested.
+        """
+        path = pulumi_state_splitter.lock.lock_path(self._tmp_dir, data.STACK_NAME)
+        path.parent.mkdir(parents=True)
+        path.touch()
+        f = path.open()
+        self.addCleanup(f.close)
+        if not locker:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            return os.getpid()
+        with subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                f"import fcntl; fcntl.flock({f.fileno()}, fcntl.LOCK_EX)",
+            ],
+            pass_fds=[f.fileno()],
+        ) as process:
+            pass
+        return process.pid
+
+    def test_stack_lock(self):
+        """Testing `stack_lock` taken and released."""
+        (self._tmp_dir / ".pulumi").mkdir()
+        (self._tmp_dir / ".pulumi" / "meta.yaml").write_text("version: 1\n")
+        with pulumi_state_splitter.lock.stack_lock(self._tmp_dir, data.STACK_NAME):
+            want = util.Directory.load(self._tmp_dir)
+            want.add_locks([data.STACK_NAME])
+            # held by the process already
+            with pulumi_state_splitter.lock.stack_lock(
+                self._tmp_dir, data.STACK_NAME, timeout=0
+            ):
+                want.compare(util.Directory.load(self._tmp_dir), self)
+            want.compare(util.Directory.load(self._tmp_dir), self)
+        util.Directory({".pulumi": {"meta.yaml": "version: 1\n"}}).compare(
+            util.Directory.load(self._tmp_dir), self
+        )
+
+    def test_stack_lock_timeout(self):
+        """Testing `stack_lock` held by another process."""
+        pid = self._hold()
+        with unittest.mock.patch.dict(
+            os.environ, {"PULUMI_STATE_SPLITTER_LOCK_TIMEOUT": "0.1"}
+        ):
+            with self.assertRaisesRegex(
+                TimeoutError,
+                f"^stack test-project/test-stack locked by process {pid}"
+                " for over 0.1s, see .*/.pulumi/locks/test-project/test-stack.lock$",
+            ):
+                with pulumi_state_splitter.lock.stack_lock(
+                    self._tmp_dir, data.STACK_NAME
+                ):
+                    self.fail("locked")
+        # not taken over
+        self.assertTrue(
+            pulumi_state_splitter.lock.lock_path(
+                self._tmp_dir, data.STACK_NAME
+            ).exists()
+        )
+
+    def test_stack_lock_holder_gone(self):
+        """Testing `stack_lock` held by a process started by a gone holder."""
+        pid = self._hold(locker=True)
+        with self.assertRaisesRegex(
+            TimeoutError, f"locked by process {pid}, no longer running for"
+        ):
+            with pulumi_state_splitter.lock.stack_lock(
+                self._tmp_dir, data.STACK_NAME, timeout=0
+            ):
+                self.fail("locked")
+
+    def test_stack_lock_holder_other_user(self):
+        """Testing `stack_lock` held by a process of another user."""
+        pid = self._hold()
+        with unittest.mock.patch("os.kill", side_effect=PermissionError):
+            with self.assertRaisesRegex(TimeoutError, f"locked by process {pid} for"):
+                with pulumi_state_splitter.lock.stack_lock(
+                    self._tmp_dir, data.STACK_NAME, timeout=0
+                ):
+                    self.fail("locked")
+
+    @parameterized.parameterized.expand(
+        [
+            (
+                "unlisted",
+                "1: POSIX  ADVISORY  WRITE 1234 00:00:1 0 EOF\n"
+                "2: -> FLOCK  ADVISORY  WRITE 1234 00:00:1 0 EOF\n",
+            ),
+            ("unknown", None),
+        ]
+    )
+    def test_stack_lock_holder(self, _, proc_locks):
+        """Testing `stack_lock` held by a process not in `/proc/locks`."""
+        self._hold()
+        path = self._tmp_dir / "locks"
+        if proc_locks is not None:
+            path.write_text(proc_locks)
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.lock, "_PROC_LOCKS", path
+        ):
+            with self.assertRaisesRegex(TimeoutError, "locked by another process for"):
+                with pulumi_state_splitter.lock.stack_lock(
+                    self._tmp_dir, data.STACK_NAME, timeout=0
+                ):
+                    self.fail("locked")
+
+    def test_stack_lock_stale(self):
+        """Testing `stack_lock` taking over a lock file left behind."""
+        path = pulumi_state_splitter.lock.lock_path(self._tmp_dir, data.STACK_NAME)
+        path.parent.mkdir(parents=True)
+        path.touch()
+        with pulumi_state_splitter.lock.stack_lock(
+            self._tmp_dir, data.STACK_NAME, timeout=0
+        ):
+            self.assertEqual(path.read_text(), "")
+        self.assertEqual(list(self._tmp_dir.iterdir()), [])
+
+    def test_stack_lock_inherited(self):
+        """Testing `stack_lock` inherited from another process."""
+        self._hold()
+        with pulumi_state_splitter.lock.stack_lock(
+            self._tmp_dir, data.STACK_NAME, timeout=0, inherited=True
+        ):
+            with pulumi_state_splitter.lock.stack_lock(
+                self._tmp_dir, data.STACK_NAME, timeout=0
+            ):
+                pass
+        # left to its holder
+        self.assertTrue(
+            pulumi_state_splitter.lock.lock_path(
+                self._tmp_dir, data.STACK_NAME
+            ).exists()
+        )
+
+    def test_stack_lock_unsupported(self):
+        """Testing `stack_lock` without `flock`, as on Windows."""
+        self.addCleanup(importlib.reload, pulumi_state_splitter.lock)
+        with unittest.mock.patch.dict(sys.modules, {"fcntl": None}):
+            importlib.reload(pulumi_state_splitter.lock)
+        self._hold()
+        with pulumi_state_splitter.lock.stack_lock(
+            self._tmp_dir, data.STACK_NAME, timeout=0
+        ):
+            pass
@@ -1,5 +1,6 @@
 """Testing `pulumi_state_splitter.model`."""
 
+import tracemalloc
 import unittest
 
 import typeguard
@@ -36,6 +37,48 @@ class TestModel(unittest.TestCase):
         self.assertIs(out["resource_4"].parent_resource, out["resource_1"])
         self.assertIsNone(out["resource_1"].parent_resource)
 
+    def test_find_parents_no_copy(self):
+        """Testing `pulumi_state_splitter.model.Resource.find_parents`
+
+        linking the resources in place.
+        """
+        resources = data.resources()
+        out = util.resource_map(
+            pulumi_state_splitter.model.Resource.find_parents(
+                resources.values(),
+                copy=False,
+            )
+        )
+
+        self.assertIs(out["resource_4"], resources["resource_4"])
+        self.assertIs(resources["resource_4"].parent_resource, resources["resource_1"])
+        self.assertIsNone(resources["resource_1"].parent_resource)
+
+    def test_find_parents_memory(self):
+        """Testing peak memory usage of `Resource.find_parents`."""
+        peaks = {}
+        for copy in True, False:
+            resources = [
+                pulumi_state_splitter.model.Resource(
+                    type="foo",
+                    urn=f"resource_{i}",
+                    parent=f"resource_{i // 2}" if i else None,
+                    inputs={"index": i},
+                )
+                for i in range(20_000)
+            ]
+            tracemalloc.start()
+            try:
+                pulumi_state_splitter.model.Resource.find_parents(
+                    resources,
+                    copy=copy,
+                )
+                _, peaks[copy] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertLess(peaks[False], peaks[True] / 2)
+
     def test_serialization_skip_attributes(self):
         """Testing that a particular attributes are skipped when falsy."""
         dump_0 = self._RESOURCES["resource_0"].model_dump()
@@ -48,6 +91,34 @@ class TestModel(unittest.TestCase):
         self.assertNotIn("outputs", dump_4)
         self.assertIn("parent", dump_4)
 
+    def test_construct_trusted(self):
+        """Testing `pulumi_state_splitter.model.Resource.construct_trusted`."""
+        for resource in data.stack_state()["checkpoint"]["latest"]["resources"]:
+            want = pulumi_state_splitter.model.Resource.model_validate(resource)
+            got = pulumi_state_splitter.model.Resource.construct_trusted(resource)
+            self.assertEqual(got, want)
+            self.assertEqual(got.model_fields_set, want.model_fields_set)
+            self.assertEqual(
+                got.model_dump_json(indent=4), want.model_dump_json(indent=4)
+            )
+
+    def test_intern(self):
+        """Testing `pulumi_state_splitter.model.Resource.intern`."""
+        resources = [
+            pulumi_state_splitter.model.Resource.model_validate(resource)
+            for resource in data.stack_state()["checkpoint"]["latest"]["resources"]
+        ]
+        want = [resource.model_copy(deep=True) for resource in resources]
+        strings = {}
+        for resource in resources:
+            resource.intern(strings)
+
+        self.assertEqual(resources, want)
+        for resource in resources:
+            for value in resource.type, resource.urn, *resource.dependencies:
+                self.assertIs(value, strings[value])
+        self.assertIs(resources[2].parent, resources[1].urn)
+
     def test_bad_version(self):
         """Testing checking if we are handling the supported version."""
         with self.assertRaises(ValueError):
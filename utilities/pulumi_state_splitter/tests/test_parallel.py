@@ -0,0 +1,51 @@
+"""Testing `pulumi_state_splitter.parallel`."""
+
+import operator
+import os
+import unittest
+
+import parameterized
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.parallel
+
+
+def _with_pid(item):
+    return item, os.getpid()
+
+
+class TestParallel(unittest.TestCase):
+    """Testing `pulumi_state_splitter.parallel`."""
+
+    @parameterized.parameterized.expand(
+        [
+            (1, 1),
+            (1, 7),
+            (3, 1),
+            (3, 7),
+        ]
+    )
+    def test_imap(self, jobs, chunk_size):
+        """Testing `pulumi_state_splitter.parallel.imap`."""
+        got = list(
+            pulumi_state_splitter.parallel.imap(
+                _with_pid,
+                iter(range(100)),
+                jobs=jobs,
+                chunk_size=chunk_size,
+            )
+        )
+        self.assertEqual(list(map(operator.itemgetter(0), got)), list(range(100)))
+        pids = set(map(operator.itemgetter(1), got))
+        if jobs == 1:
+            self.assertEqual(pids, {os.getpid()})
+        else:
+            self.assertNotIn(os.getpid(), pids)
+
+    def test_imap_empty(self):
+        """Testing `pulumi_state_splitter.parallel.imap` with no items."""
+        self.assertEqual(
+            list(pulumi_state_splitter.parallel.imap(_with_pid, [], jobs=2)),
+            [],
+        )
@@ -0,0 +1,165 @@
+"""Testing `pulumi_state_splitter.scratch`."""
+
+import multiprocessing
+import os
+import signal
+import subprocess
+import time
+import unittest.mock
+
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.scratch
+
+from . import util
+
+
+class TestScratch(util.TmpDirTest):
+    """Testing `pulumi_state_splitter.scratch`."""
+
+    def setUp(self):
+        super().setUp()
+        self._backend_dir = self._tmp_dir / "backend"
+        self._parent = self._tmp_dir / "scratch"
+        self._parent.mkdir()
+        util.Directory(
+            {
+                ".pulumi": {
+                    "meta.yaml": "version: 1\n",
+                    "history": {"old.json": "{}"},
+                },
+            }
+        ).save(self._backend_dir)
+
+    def test_backend(self):
+        """Testing `backend` copying files in and back."""
+        with pulumi_state_splitter.scratch.backend(
+            self._backend_dir, self._parent
+        ) as scratch_dir:
+            self.assertEqual(scratch_dir.parent, self._parent)
+            util.Directory(
+                {".pulumi": {"meta.yaml": "version: 1\n"}},
+            ).compare(util.Directory.load(scratch_dir), self)
+            (scratch_dir / ".pulumi" / "history").mkdir()
+            (scratch_dir / ".pulumi" / "history" / "new.json").write_text("[]")
+
+        self.assertEqual(list(self._parent.iterdir()), [])
+        util.Directory(
+            {
+                ".pulumi": {
+                    "meta.yaml": "version: 1\n",
+                    "history": {"old.json": "{}", "new.json": "[]"},
+                },
+            }
+        ).compare(util.Directory.load(self._backend_dir), self)
+
+    def test_backend_default_parent(self):
+        """Testing `backend` in the default directory."""
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.scratch, "DEFAULT_PARENT", self._parent
+        ):
+            with pulumi_state_splitter.scratch.backend(
+                self._backend_dir
+            ) as scratch_dir:
+                self.assertEqual(scratch_dir.parent, self._parent)
+
+    def test_backend_kept(self):
+        """Testing that `backend` is kept if its files are not copied back."""
+        with self.assertRaises(OSError):
+            with pulumi_state_splitter.scratch.backend(
+                self._backend_dir, self._parent
+            ) as scratch_dir:
+                (scratch_dir / ".pulumi" / "new.json").write_text("[]")
+                copy = unittest.mock.patch.object(
+                    pulumi_state_splitter.scratch.shutil,
+                    "copy2",
+                    side_effect=OSError("disk full"),
+                )
+                copy.start()
+                self.addCleanup(copy.stop)
+        self.assertEqual(list(self._parent.iterdir()), [scratch_dir])
+
+    def test_backend_failed(self):
+        """Testing that `backend` is kept as is if the block fails."""
+        with self.assertRaises(ValueError) as raised:
+            with pulumi_state_splitter.scratch.backend(
+                self._backend_dir, self._parent
+            ) as scratch_dir:
+                (scratch_dir / ".pulumi" / "new.json").write_text("[]")
+                raise ValueError("split back failed")
+        self.assertEqual(
+            raised.exception.__notes__, [f"scratch backend kept in {scratch_dir}"]
+        )
+        self.assertEqual(list(self._parent.iterdir()), [scratch_dir])
+        self.assertFalse((self._backend_dir / ".pulumi" / "new.json").exists())
+
+    def test_deferred_signals(self):
+        """Testing `deferred_signals`."""
+        previous = signal.getsignal(signal.SIGTERM)
+        with pulumi_state_splitter.scratch.deferred_signals() as received:
+            os.kill(os.getpid(), signal.SIGTERM)
+            os.kill(os.getpid(), signal.SIGINT)
+        self.assertEqual(received, [signal.SIGTERM, signal.SIGINT])
+        self.assertIs(signal.getsignal(signal.SIGTERM), previous)
+
+    def test_deferred_signals_nested(self):
+        """Testing nested `deferred_signals` sharing the received signals."""
+        with pulumi_state_splitter.scratch.deferred_signals() as received:
+            os.kill(os.getpid(), signal.SIGTERM)
+            with pulumi_state_splitter.scratch.deferred_signals() as nested:
+                self.assertIs(nested, received)
+                os.kill(os.getpid(), signal.SIGINT)
+            os.kill(os.getpid(), signal.SIGHUP)
+        self.assertEqual(received, [signal.SIGTERM, signal.SIGINT, signal.SIGHUP])
+        with pulumi_state_splitter.scratch.deferred_signals() as received:
+            self.assertEqual(received, [])
+
+    def test_forwarded_signals(self):
+        """Testing `forwarded_signals`."""
+        with pulumi_state_splitter.scratch.deferred_signals() as received:
+            with subprocess.Popen(["sleep", "60"]) as process:
+                with pulumi_state_splitter.scratch.forwarded_signals(process.pid):
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    self.assertEqual(process.wait(), -signal.SIGTERM)
+            # to the processes started after them too
+            with subprocess.Popen(["sleep", "60"]) as process:
+                with pulumi_state_splitter.scratch.forwarded_signals(process.pid):
+                    self.assertEqual(process.wait(), -signal.SIGTERM)
+        self.assertEqual(received, [signal.SIGTERM])
+
+    def test_forwarded_signals_workers(self):
+        """Testing `deferred_signals` forwarding signals to worker processes."""
+        context = multiprocessing.get_context("fork")
+        ready = context.Event()
+        with pulumi_state_splitter.scratch.deferred_signals() as received:
+
+            def wait():
+                ready.set()
+                # deferring them too, in a copy of the list
+                while not received:
+                    time.sleep(0.01)
+
+            process = context.Process(target=wait, daemon=True)
+            process.start()
+            # signals received while forking are lost
+            self.assertTrue(ready.wait(10))
+            os.kill(os.getpid(), signal.SIGTERM)
+            process.join(10)
+        self.assertEqual(process.exitcode, 0)
+
+    def test_forwarded_signals_terminal(self):
+        """Testing `deferred_signals` not forwarding interrupts from a terminal."""
+        for tcgetpgrp, forwarded in (
+            ({"return_value": os.getpgrp()}, []),
+            ({"side_effect": OSError}, [unittest.mock.call(1234, signal.SIGINT)]),
+        ):
+            with unittest.mock.patch(
+                "os.tcgetpgrp", **tcgetpgrp
+            ), unittest.mock.patch.object(
+                pulumi_state_splitter.scratch, "_forward"
+            ) as forward:
+                with pulumi_state_splitter.scratch.deferred_signals():
+                    with pulumi_state_splitter.scratch.forwarded_signals(1234):
+                        os.kill(os.getpid(), signal.SIGINT)
+            self.assertEqual(forward.call_args_list, forwarded)
@@ -1,17 +1,26 @@
 """Testing `pulumi_state_splitter.split`."""
 
+import contextlib
+import hashlib
+import itertools
 import pathlib
+import time
 import unittest
+import unittest.mock
 
+import parameterized
 import typeguard
 import yaml
 
 from . import data, util
 
 with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.cache
+    import pulumi_state_splitter.layout
     import pulumi_state_splitter.model
     import pulumi_state_splitter.split
     import pulumi_state_splitter.state_file
+    import pulumi_state_splitter.yaml_io
 
 
 _TRIVIAL_MODEL = pulumi_state_splitter.model.State(
@@ -25,6 +34,59 @@ def _delattr_if_exists(obj, name):
         delattr(obj, name)
 
 
+def _component_hierarchy(depth: int, fan_out: int):
+    """Generates a tree of resources under a stack resource."""
+    stack = pulumi_state_splitter.model.Resource(
+        type="pulumi:pulumi:Stack",
+        urn="urn:pulumi:stack::project::pulumi:pulumi:Stack::project-stack",
+    )
+    resources = [stack]
+    level = [stack]
+    for i in range(depth):
+        level = [
+            pulumi_state_splitter.model.Resource(
+                type=f"test:index:Component{i}",
+                urn=f"urn:pulumi:stack::project::test:index:Component{i}::{name}",
+                parent=parent.urn,
+                parent_resource=parent,
+            )
+            for j, parent in enumerate(level)
+            for name in (f"component-{j}-{k}" for k in range(fan_out))
+        ]
+        resources.extend(level)
+    return resources
+
+
+def _manifest_entries(directory: util.Directory, prefix=pathlib.PurePosixPath()):
+    """Builds manifest entries for resource files in a directory tree."""
+    for name, contents in sorted(directory.items()):
+        if isinstance(contents, dict):
+            yield from _manifest_entries(contents, prefix / name)
+            continue
+        encoded = contents.encode()
+        resource = yaml.safe_load(contents)
+        yield {
+            "path": str(prefix / name),
+            "size": len(encoded),
+            "sha256": hashlib.sha256(encoded).hexdigest(),
+            **{
+                key: resource[key]
+                for key in ("urn", "parent", "provider", "dependencies")
+                if resource.get(key)
+            },
+        }
+
+
+def _manifest(stack_directory: util.Directory) -> str:
+    """Builds the manifest of a split stack directory."""
+    subdirectories = {
+        name: contents
+        for name, contents in stack_directory.items()
+        if isinstance(contents, dict)
+    }
+    return yaml.dump({"files": list(_manifest_entries(subdirectories))})
+
+
 class TestStateDirPure(unittest.TestCase):
     """Testing `StateDir` without filesystem interactions."""
 
@@ -60,6 +122,21 @@ class TestStateDirPure(unittest.TestCase):
             state_file.state,
         )
 
+    def test_from_state_file_backend_dir(self):
+        """Testing `StateDir.from_state_file` into another backend directory."""
+        state_file = pulumi_state_splitter.state_file.StateFile(
+            backend_dir=pathlib.Path("var/tmp"),
+            stack_name=data.STACK_NAME,
+            state=_TRIVIAL_MODEL,
+        )
+        state_dir = pulumi_state_splitter.split.StateDir.from_state_file(
+            state_file, backend_dir=pathlib.Path("var/backend")
+        )
+        self.assertEqual(
+            state_dir.path, pathlib.Path("var/backend/test-project/test-stack")
+        )
+        self.assertEqual(state_dir.to_state_file(), state_file)
+
     def test_to_state_file(self):
         """Testing `StateDir.to_state_file`."""
         state_dir = pulumi_state_splitter.split.StateDir(
@@ -117,14 +194,45 @@ class TestStateDirPure(unittest.TestCase):
         want = pathlib.Path("foo/parent/bar/child/baz-acme/grandchild.yaml")
         self.assertEqual(got, want)
 
+    def test_resource_subpaths(self):
+        """Testing `StateDir.resource_subpaths` with a deep hierarchy."""
+        resources = _component_hierarchy(depth=6, fan_out=3)
+
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.layout.Layout,
+            "subpath",
+            autospec=True,
+            side_effect=pulumi_state_splitter.layout.Layout.subpath,
+        ) as subpath:
+            got = pulumi_state_splitter.split.StateDir.resource_subpaths(resources)
+        # once per resource, not once per resource and ancestor
+        self.assertEqual(subpath.call_count, len(resources))
+
+        want = {
+            resource.urn: pulumi_state_splitter.split.StateDir.resource_subpath(
+                resource
+            )
+            for resource in resources
+        }
+        self.assertEqual(got, want)
+        self.assertEqual(
+            got[resources[-1].urn],
+            pathlib.Path(
+                *(f"test-index-Component{i}/component-{3**i - 1}-2" for i in range(6))
+            ).with_suffix(".yaml"),
+        )
 
-class TestStateDirFilesystem(util.TmpDirTest):
+
+class TestStateDirFilesystem(  # pylint: disable=too-many-public-methods
+    util.TmpDirTest,
+):
     """Testing `StateDir` with filesystem interactions"""
 
     _TRIVIAL_DIRECTORY = util.Directory(
         {
             "test-project": {
                 "test-stack": {
+                    "manifest.yaml": yaml.dump({"files": []}),
                     "state.yaml": yaml.dump(
                         {
                             "checkpoint": {"stack": "test-stack"},
@@ -163,6 +271,9 @@ class TestStateDirFilesystem(util.TmpDirTest):
             },
         }
     )
+    _DIRECTORY["test-project"]["test-stack"]["manifest.yaml"] = _manifest(
+        _DIRECTORY["test-project"]["test-stack"]
+    )
 
     def test_find(self):
         """Testing `StateDir.find`."""
@@ -188,7 +299,8 @@ class TestStateDirFilesystem(util.TmpDirTest):
             _TRIVIAL_MODEL.model_dump(),
         )
 
-    def test_load(self):
+    @parameterized.parameterized.expand([(1,), (2,)])
+    def test_load(self, jobs):
         """Testing `StateDir.load` with a more complex stack."""
         state_dir = pulumi_state_splitter.split.StateDir(
             backend_dir=self._tmp_dir,
@@ -197,7 +309,14 @@ class TestStateDirFilesystem(util.TmpDirTest):
 
         self._DIRECTORY.save(self._tmp_dir)
 
-        state_dir.load()
+        state_dir.load(jobs=jobs)
+
+        # references share the strings of the referred resources' URNs
+        resources = state_dir.state.checkpoint.latest.resources
+        urns = {resource.urn: resource.urn for resource in resources}
+        for resource in resources:
+            for urn in resource.dependencies:
+                self.assertIs(urn, urns[urn])
 
         want = data.stack_model()
 
@@ -212,6 +331,62 @@ class TestStateDirFilesystem(util.TmpDirTest):
             want,
         )
 
+    def test_load_cache(self):
+        """Testing `StateDir.load` with a resource cache."""
+        cache = pulumi_state_splitter.cache.ResourceCache(
+            directory=self._tmp_dir / "cache",
+        )
+        self._DIRECTORY.save(self._tmp_dir)
+        want = data.stack_model()
+        want.checkpoint.latest.resources.sort(key=util.resource_key)
+        for resource in want.checkpoint.latest.resources:
+            _delattr_if_exists(resource, "sourcePosition")
+            resource.dependencies.sort()
+
+        for parsed in 5, 0:
+            state_dir = pulumi_state_splitter.split.StateDir(
+                backend_dir=self._tmp_dir,
+                stack_name=data.STACK_NAME,
+            )
+            with unittest.mock.patch.object(
+                pulumi_state_splitter.yaml_io,
+                "load",
+                side_effect=pulumi_state_splitter.yaml_io.load,
+            ) as load:
+                state_dir.load(cache=cache)
+            # the state and stack outputs files are never cached
+            self.assertEqual(load.call_count, 2 + parsed)
+            state_dir.state.checkpoint.latest.resources.sort(key=util.resource_key)
+            self.assertEqual(state_dir.state, want)
+
+    def test_load_trust(self):
+        """Testing `StateDir.load` trusting files listed in the manifest."""
+        self._DIRECTORY.save(self._tmp_dir)
+        stack_dir = self._tmp_dir / "test-project" / "test-stack"
+        modified = stack_dir / "command-local-Command" / "true.yaml"
+        modified.write_text(modified.read_text() + "\n")
+        want = data.stack_model()
+        want.checkpoint.latest.resources.sort(key=util.resource_key)
+        for resource in want.checkpoint.latest.resources:
+            _delattr_if_exists(resource, "sourcePosition")
+            resource.dependencies.sort()
+
+        for trust, validated in (False, 5), (True, 1):
+            state_dir = pulumi_state_splitter.split.StateDir(
+                backend_dir=self._tmp_dir,
+                stack_name=data.STACK_NAME,
+            )
+            with unittest.mock.patch.object(
+                pulumi_state_splitter.model.Resource,
+                "model_validate",
+                side_effect=pulumi_state_splitter.model.Resource.model_validate,
+            ) as model_validate:
+                state_dir.load(trust=trust)
+            # only the modified file is validated
+            self.assertEqual(model_validate.call_count, validated)
+            state_dir.state.checkpoint.latest.resources.sort(key=util.resource_key)
+            self.assertEqual(state_dir.state, want)
+
     def test_remove(self):
         """Testing `StateDir.remove`."""
         state_dir = pulumi_state_splitter.split.StateDir(
@@ -263,7 +438,8 @@ class TestStateDirFilesystem(util.TmpDirTest):
         got = util.Directory.load(self._tmp_dir)
         self._TRIVIAL_DIRECTORY.compare(got, self)
 
-    def test_save(self):
+    @parameterized.parameterized.expand([(1,), (2,)])
+    def test_save(self, jobs):
         """Testing `StateDir.save` with a more complex stack."""
         state_dir = pulumi_state_splitter.split.StateDir(
             backend_dir=self._tmp_dir,
@@ -271,12 +447,140 @@ class TestStateDirFilesystem(util.TmpDirTest):
             state=data.stack_model(),
         )
 
-        state_dir.save()
+        state_dir.save(jobs=jobs)
 
         got = util.Directory.load(self._tmp_dir)
 
         self._DIRECTORY.compare(got, self)
 
+    def test_save_incremental(self):
+        """Testing `StateDir.save` rewriting only changed files."""
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+            state=data.stack_model(),
+        )
+        self.assertEqual(
+            state_dir.save(),
+            pulumi_state_splitter.split.SaveReport(written=8),
+        )
+        provider_path = state_dir.path / "pulumi-providers-command/default_0_9_2.yaml"
+        mtime = provider_path.stat().st_mtime_ns
+        time.sleep(0.01)
+
+        self.assertEqual(
+            state_dir.save(),
+            pulumi_state_splitter.split.SaveReport(skipped=8),
+        )
+        self.assertEqual(provider_path.stat().st_mtime_ns, mtime)
+
+        resources = state_dir.state.checkpoint.latest.resources
+        del resources[4]
+        resources[3].inputs = {"create": "false"}
+        self.assertEqual(
+            state_dir.save(),
+            pulumi_state_splitter.split.SaveReport(written=2, skipped=5, deleted=1),
+        )
+        self.assertEqual(provider_path.stat().st_mtime_ns, mtime)
+        want_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "want",
+            stack_name=data.STACK_NAME,
+            state=state_dir.state,
+        )
+        want_dir.save()
+        util.Directory.load(want_dir.path).compare(
+            util.Directory.load(state_dir.path), self
+        )
+
+        del resources[1:]
+        self.assertEqual(
+            state_dir.save(),
+            pulumi_state_splitter.split.SaveReport(written=1, skipped=2, deleted=4),
+        )
+        self.assertCountEqual(
+            [path.name for path in state_dir.path.iterdir()],
+            ["manifest.yaml", "pulumi-providers-command", "state.yaml"],
+        )
+
+    def test_verify(self):
+        """Testing `StateDir.verify`."""
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+            state=data.stack_model(),
+        )
+        self.assertIsNone(state_dir.verify())
+
+        state_dir.save()
+        report = state_dir.verify()
+        self.assertTrue(report)
+        self.assertEqual(report, pulumi_state_splitter.split.VerifyReport())
+
+        (state_dir.path / "command-local-Command/cat1.yaml").write_text("{}")
+        (state_dir.path / "command-local-Command/true.yaml").unlink()
+        (state_dir.path / "command-local-Command/false.yaml").write_text("{}")
+        report = state_dir.verify()
+        self.assertFalse(report)
+        self.assertEqual(
+            report,
+            pulumi_state_splitter.split.VerifyReport(
+                missing=["command-local-Command/true.yaml"],
+                modified=["command-local-Command/cat1.yaml"],
+                unlisted=["command-local-Command/false.yaml"],
+            ),
+        )
+        self.assertEqual(
+            str(report),
+            "missing: command-local-Command/true.yaml\n"
+            "modified: command-local-Command/cat1.yaml\n"
+            "unlisted: command-local-Command/false.yaml",
+        )
+
+    def test_save_fan_out(self):
+        """Testing `StateDir.save` with a wide resource hierarchy."""
+        resources = _component_hierarchy(depth=2, fan_out=10)
+        directories = {}
+        for jobs in 1, 4:
+            state_dir = pulumi_state_splitter.split.StateDir(
+                backend_dir=self._tmp_dir / str(jobs),
+                stack_name=data.STACK_NAME,
+                state=pulumi_state_splitter.model.State(
+                    checkpoint=pulumi_state_splitter.model.Checkpoint(
+                        latest=pulumi_state_splitter.model.Latest(
+                            resources=resources,
+                        ),
+                        stack="test-stack",
+                    ),
+                    version=3,
+                ),
+            )
+            state_dir.path.mkdir(parents=True)
+            with unittest.mock.patch.object(
+                pathlib.Path,
+                "mkdir",
+                autospec=True,
+                side_effect=pathlib.Path.mkdir,
+            ) as mkdir:
+                state_dir.save(jobs=jobs)
+
+            created = [
+                call.args[0]
+                for call in mkdir.call_args_list
+                # not the ones of the lock file
+                if call.args[0].is_relative_to(state_dir.path)
+            ]
+            self.assertEqual(len(set(created)), len(created), jobs)
+            # the stack directory, two type directories in it
+            # and two for each of the top level components
+            self.assertEqual(len(created), 1 + 2 + 2 * 10, jobs)
+            directories[jobs] = util.Directory.load(state_dir.path)
+            # a file and a directory for each of the top level components
+            self.assertEqual(
+                len(directories[jobs]["test-index-Component0"]), 2 * 10, jobs
+            )
+
+        directories[1].compare(directories[4], self)
+
     def test_save_no_outputs(self):
         """Testing `StateDir.save` with no stack outputs."""
         state = pulumi_state_splitter.model.State(
@@ -328,6 +632,77 @@ class TestStateDirFilesystem(util.TmpDirTest):
         }
         want.compare(got, self)
 
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_split_state_file_streaming(self, streaming):
+        """Testing `StateDir.split_state_file` with and without streaming."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+        if not streaming:
+            state_file.load()
+
+        pulumi_state_splitter.split.StateDir.split_state_file(
+            state_file,
+            streaming=streaming,
+        )
+
+        got = util.Directory.load(self._tmp_dir)
+        self._DIRECTORY.compare(got, self)
+
+    def test_split_state_file_streaming_order(self):
+        """Testing streaming `StateDir.split_state_file` with children first."""
+        state = data.stack_state()
+        state["checkpoint"]["latest"]["resources"].reverse()
+        state_file = util.write_state_file(self._tmp_dir, data.STACK_NAME, state)
+
+        with self.assertRaisesRegex(ValueError, "precedes its parent"):
+            pulumi_state_splitter.split.StateDir.split_state_file(
+                state_file,
+                streaming=True,
+            )
+
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_fanout(self, streaming):
+        """Testing a split state with the resource files spread further."""
+        for backend, fanout in ("flat", 1), ("fanout", 4):
+            state_file = util.write_state_file(
+                self._tmp_dir / backend, data.STACK_NAME, data.stack_state()
+            )
+            if not streaming:
+                state_file.load()
+            pulumi_state_splitter.split.StateDir.split_state_file(
+                state_file,
+                streaming=streaming,
+                layout=pulumi_state_splitter.layout.Layout(fanout=fanout),
+            )
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "fanout",
+            stack_name=data.STACK_NAME,
+        )
+
+        state = yaml.safe_load((state_dir.path / "state.yaml").read_text())
+        self.assertEqual(state["layout"], {"fanout": 4})
+        for path in state_dir.path.glob("*/**/*.yaml"):
+            _, shard, _ = path.relative_to(state_dir.path).parts
+            self.assertIn(shard, "0123")
+        self.assertTrue(state_dir.verify())
+        self.assertEqual(
+            list(pulumi_state_splitter.split.StateDir.find(self._tmp_dir / "fanout")),
+            [data.STACK_NAME],
+        )
+
+        flat = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "flat",
+            stack_name=data.STACK_NAME,
+        )
+        flat.load()
+        state_dir.load()
+        self.assertEqual(state_dir.layout.fanout, 4)
+        self.assertEqual(state_dir.state, flat.state)
+
+        state_dir.remove()
+        self.assertFalse(state_dir.path.exists())
+
     def test_unsplit_state(self):
         """Testing `StateDir.unsplit`."""
         input_ = data.multi_stack_split()
@@ -354,70 +729,263 @@ class TestStateDirFilesystem(util.TmpDirTest):
         }
         want.compare(got, self)
 
-
-class TestUnsplitter(util.TmpDirTest):
-    """Testing `Unsplitter`."""
-
-    def test_unsplitter_some_stacks(self):
-        """Testing `Unsplitter` with specified stacks."""
+    @parameterized.parameterized.expand(itertools.product([False, True], [False, True]))
+    def test_unsplit_state_exists(self, streaming, newer):
+        """Testing `StateDir.unsplit` with the state file there already."""
         input_ = data.multi_stack_split()
+        unsplit = data.multi_stack_unsplit()
+        input_[".pulumi"] = {"stacks": {"test-project-1": {"test-stack-1.json": "{}"}}}
+        if not newer:
+            input_[".pulumi"] = unsplit[".pulumi"]
         input_.save(self._tmp_dir)
-
-        with pulumi_state_splitter.split.Unsplitter(
+        state_dir = pulumi_state_splitter.split.StateDir(
             backend_dir=self._tmp_dir,
-            stacks_names=data.MULTI_STACK_NAMES[:2],
-        ):
-            got = util.Directory.load(self._tmp_dir)
-            want = data.multi_stack_unsplit()
-            want[".pulumi"]["stacks"].pop("test-project-2")
-            want["test-project-2"] = input_["test-project-2"]
-            want.compare(got, self)
-
+            stack_name=data.MULTI_STACK_NAMES[0],
+        )
+        with contextlib.ExitStack() as stack:
+            if newer:
+                stack.enter_context(
+                    self.assertRaisesRegex(
+                        FileExistsError, "test-stack-1.json exists with other contents"
+                    )
+                )
+            if streaming:
+                state_dir.unsplit_streaming()
+            else:
+                state_dir.load()
+                state_dir.unsplit()
         got = util.Directory.load(self._tmp_dir)
-        input_.compare(got, self)
+        want = input_
+        if not newer:
+            want["test-project-1"].pop("test-stack-1")
+        want.compare(got, self)
 
-    def test_unsplitter_all_stacks(self):
-        """Testing `Unsplitter` with all stacks."""
-        input_ = data.multi_stack_split()
-        input_.save(self._tmp_dir)
+    @parameterized.parameterized.expand(
+        itertools.product(["fresh", "missing", "resized", "stale", "trusted"], [1, 2])
+    )
+    def test_unsplit_streaming(self, manifest, jobs):
+        """Testing `StateDir.unsplit_streaming`."""
+        for backend in ("whole", "streaming"):
+            self._DIRECTORY.save(self._tmp_dir / backend)
+        stack_dir = self._tmp_dir / "streaming" / "test-project" / "test-stack"
+        manifest_path = stack_dir / "manifest.yaml"
+        if manifest == "missing":
+            manifest_path.unlink()
+        elif manifest == "resized":
+            with (stack_dir / "command-local-Command" / "cat2.yaml").open("a") as f:
+                f.write("\n")
+        elif manifest == "stale":
+            # the files are listed with their sizes, but not their headers
+            contents = yaml.safe_load(manifest_path.read_text())
+            for entry in contents["files"]:
+                entry.pop("dependencies", None)
+            manifest_path.write_text(yaml.dump(contents))
 
-        with pulumi_state_splitter.split.Unsplitter(
-            backend_dir=self._tmp_dir,
-            stacks_names=None,
-        ):
-            got = util.Directory.load(self._tmp_dir)
-            want = data.multi_stack_unsplit()
-            want.compare(got, self)
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "whole",
+            stack_name=data.STACK_NAME,
+        )
+        state_dir.load()
+        state_dir.unsplit()
+        pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "streaming",
+            stack_name=data.STACK_NAME,
+        ).unsplit_streaming(jobs=jobs, trust=manifest == "trusted")
+
+        want = util.Directory.load(self._tmp_dir / "whole")
+        got = util.Directory.load(self._tmp_dir / "streaming")
+        want.compare(got, self)
 
+    def test_unsplit_streaming_trivial(self):
+        """Testing `StateDir.unsplit_streaming` without resources."""
+        self._TRIVIAL_DIRECTORY.save(self._tmp_dir)
+        pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+        ).unsplit_streaming()
         got = util.Directory.load(self._tmp_dir)
-        input_.compare(got, self)
+        self.assertEqual(list(got), [".pulumi"])
+
+
+@unittest.mock.patch.object(pulumi_state_splitter.yaml_io, "USE_LIBYAML", False)
+class TestStateDirFilesystemPurePython(TestStateDirFilesystem):
+    """Testing `StateDir` with filesystem interactions without libyaml."""
+
+
+class TestStateDirPacked(util.TmpDirTest):
+    """Testing `StateDir` with a packed layout"""
+
+    def test_packed(self):
+        """Testing a split state with the resources of each type in a file."""
+        for backend, packed in ("flat", False), ("packed", True):
+            state_file = util.write_state_file(
+                self._tmp_dir / backend, data.STACK_NAME, data.stack_state()
+            )
+            state_file.load()
+            pulumi_state_splitter.split.StateDir.split_state_file(
+                state_file,
+                layout=pulumi_state_splitter.layout.Layout(packed=packed),
+            )
+        flat = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "flat",
+            stack_name=data.STACK_NAME,
+        )
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir / "packed",
+            stack_name=data.STACK_NAME,
+        )
 
-    def test_unsplitter_no_stacks(self):
-        """Testing `Unsplitter` with no stacks."""
-        input_ = data.multi_stack_split()
-        input_.save(self._tmp_dir)
+        got = util.Directory.load(state_dir.path)
+        want = util.Directory.load(flat.path)
+        self.assertEqual(
+            sorted(got),
+            [
+                "command-local-Command.yaml",
+                "manifest.yaml",
+                "outputs.yaml",
+                "pulumi-providers-command.yaml",
+                "pulumi-pulumi-Stack.yaml",
+                "state.yaml",
+            ],
+        )
+        self.assertEqual(
+            got["command-local-Command.yaml"],
+            "---\n".join(
+                want["command-local-Command"][name]
+                for name in ("cat1.yaml", "cat2.yaml", "true.yaml")
+            ),
+        )
+        self.assertTrue(state_dir.verify())
+
+        flat.load()
+        documents = {}
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.model.Resource,
+            "model_validate",
+            side_effect=pulumi_state_splitter.model.Resource.model_validate,
+        ) as model_validate:
+            state_dir.load(trust=True, documents=documents)
+        self.assertEqual(model_validate.call_count, 0)
+        self.assertTrue(state_dir.layout.packed)
+        self.assertEqual(state_dir.state, flat.state)
+        self.assertEqual(
+            documents,
+            {
+                urn: (flat.path / subpath).read_bytes()
+                for urn, subpath in flat.resource_subpaths(
+                    flat.state.checkpoint.latest.resources
+                ).items()
+            },
+        )
 
-        with pulumi_state_splitter.split.Unsplitter(
-            backend_dir=self._tmp_dir,
-            stacks_names=[],
-        ):
-            got = util.Directory.load(self._tmp_dir)
-            input_.compare(got, self)
+        packed_file = state_dir.path / "command-local-Command.yaml"
+        packed_file.write_text(packed_file.read_text().replace("cat1", "cat3", 1))
+        self.assertEqual(
+            state_dir.verify(),
+            pulumi_state_splitter.split.VerifyReport(
+                modified=["command-local-Command.yaml"]
+            ),
+        )
 
-        got = util.Directory.load(self._tmp_dir)
-        input_.compare(got, self)
+        state_dir.remove()
+        self.assertFalse(state_dir.path.exists())
 
-    def test_unsplitter_new(self):
-        """Testing `Unsplitter` with a new stack added."""
-        input_ = data.multi_stack_split()
-        input_["test-project-1"].pop("test-stack-2")
-        input_.save(self._tmp_dir)
+    def test_packed_children(self):
+        """Testing a packed split state with resources having children."""
+        resources = _component_hierarchy(depth=2, fan_out=3)
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+            state=pulumi_state_splitter.model.State(
+                checkpoint=pulumi_state_splitter.model.Checkpoint(
+                    latest=pulumi_state_splitter.model.Latest(
+                        manifest={"magic": "test"}, resources=resources
+                    ),
+                    stack="test-stack",
+                ),
+                version=3,
+            ),
+            layout=pulumi_state_splitter.layout.Layout(packed=True),
+        )
+        state_dir.save()
+
+        got = util.Directory.load(state_dir.path)
+        # the stack's children are in the state directory itself
+        self.assertEqual(
+            sorted(got["test-index-Component0"]),
+            [f"component-0-{k}" for k in range(3)],
+        )
+        packed_file = got["test-index-Component0"]["component-0-1"][
+            "test-index-Component1.yaml"
+        ]
+        self.assertEqual(
+            len(pulumi_state_splitter.yaml_io.split_documents(packed_file.encode())),
+            3,
+        )
+        self.assertTrue(state_dir.verify())
 
-        with pulumi_state_splitter.split.Unsplitter(
+        loaded = pulumi_state_splitter.split.StateDir(
             backend_dir=self._tmp_dir,
-            stacks_names=None,
-        ):
-            data.multi_stack_unsplit().save(self._tmp_dir)
+            stack_name=data.STACK_NAME,
+        )
+        loaded.load()
+        self.assertEqual(
+            sorted(
+                resource.urn for resource in loaded.state.checkpoint.latest.resources
+            ),
+            sorted(resource.urn for resource in resources),
+        )
 
-        got = util.Directory.load(self._tmp_dir)
-        data.multi_stack_split().compare(got, self)
+        loaded.remove()
+        self.assertFalse(state_dir.path.exists())
+
+    def test_packed_streaming(self):
+        """Testing that packed split states are not streamed."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+        layout = pulumi_state_splitter.layout.Layout(packed=True)
+        with self.assertRaisesRegex(ValueError, "packed"):
+            pulumi_state_splitter.split.StateDir.split_state_file(
+                state_file, streaming=True, layout=layout
+            )
+
+        state_file.load()
+        pulumi_state_splitter.split.StateDir.split_state_file(state_file, layout=layout)
+        state_dir = pulumi_state_splitter.split.StateDir(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+        )
+        with self.assertRaisesRegex(ValueError, "packed"):
+            state_dir.unsplit_streaming()
+
+    def test_packed_file_count(self):
+        """Testing that a packed layout takes far fewer files for many resources."""
+        resources = _component_hierarchy(depth=2, fan_out=50)
+        counts = {}
+        for packed in False, True:
+            state_dir = pulumi_state_splitter.split.StateDir(
+                backend_dir=self._tmp_dir / str(packed),
+                stack_name=data.STACK_NAME,
+                state=pulumi_state_splitter.model.State(
+                    checkpoint=pulumi_state_splitter.model.Checkpoint(
+                        latest=pulumi_state_splitter.model.Latest(
+                            manifest={"magic": "test"}, resources=resources
+                        ),
+                        stack="test-stack",
+                    ),
+                    version=3,
+                ),
+                layout=pulumi_state_splitter.layout.Layout(packed=packed),
+            )
+            state_dir.save()
+            state_dir.load()
+            self.assertEqual(
+                len(state_dir.state.checkpoint.latest.resources), len(resources)
+            )
+            counts[packed] = sum(1 for _ in state_dir.path.rglob("*.yaml"))
+
+        # state, outputs, manifest and a file per resource or per type
+        # directory, each top level component's children being of one type
+        self.assertEqual(counts[False], 3 + 1 + 50 + 50 * 50)
+        self.assertEqual(counts[True], 3 + 1 + 1 + 50)
@@ -0,0 +1,442 @@
+"""Testing `pulumi_state_splitter.stacks`."""
+
+import concurrent.futures
+import fcntl
+import json
+import os
+import pathlib
+import unittest
+import unittest.mock
+
+import parameterized
+import typeguard
+
+from . import data, util
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.layout
+    import pulumi_state_splitter.lock
+    import pulumi_state_splitter.split
+    import pulumi_state_splitter.stacks
+    import pulumi_state_splitter.state_file
+    import pulumi_state_splitter.yaml_io
+
+
+def _stack_jobs(stack_name, jobs):
+    if stack_name.stack == "test-stack-2":
+        raise ValueError("test error")
+    return str(stack_name), jobs, os.getpid()
+
+
+def _split_unsplit(backend_dir, stack_name, times):
+    for _ in range(times):
+        pulumi_state_splitter.stacks.unsplit_stack(backend_dir, stack_name)
+        pulumi_state_splitter.stacks.split_stack(backend_dir, stack_name)
+
+
+class TestSplitStack(util.TmpDirTest):
+    """Testing `split_stack` and `unsplit_stack`."""
+
+    def test_split_unsplit_siblings(self):
+        """Testing `split_stack` and `unsplit_stack` concurrently on sibling stacks.
+
+        The directories of their project, holding their lock files, split
+        states and state files, are created and removed by both processes.
+        """
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            futures = [
+                executor.submit(_split_unsplit, self._tmp_dir, stack_name, 100)
+                for stack_name in data.MULTI_STACK_NAMES[:2]
+            ]
+            for future in futures:
+                future.result()
+        input_.compare(util.Directory.load(self._tmp_dir), self)
+
+
+class TestForEachStack(unittest.TestCase):
+    """Testing `for_each_stack`."""
+
+    @parameterized.parameterized.expand([(1,), (3,)])
+    def test_for_each_stack(self, jobs):
+        """Testing `for_each_stack` with many stacks."""
+        got = pulumi_state_splitter.stacks.for_each_stack(
+            _stack_jobs, data.MULTI_STACK_NAMES, jobs=jobs
+        )
+        self.assertEqual([result.stack_name for result in got], data.MULTI_STACK_NAMES)
+        failed = [result for result in got if result.error is not None]
+        self.assertEqual(
+            [str(result.stack_name) for result in failed],
+            ["test-project-1/test-stack-2"],
+        )
+        self.assertEqual(failed[0].error, "ValueError: test error")
+        self.assertRegex(
+            str(failed[0]),
+            r"^test-project-1/test-stack-2: failed: ValueError: test error \(.*s\)$",
+        )
+        results = [result.result for result in got if result.error is None]
+        self.assertEqual(
+            [name for name, _, _ in results],
+            [
+                str(name)
+                for name in data.MULTI_STACK_NAMES
+                if name.stack != "test-stack-2"
+            ],
+        )
+        # each stack gets a single job in a worker process
+        self.assertEqual({jobs for _, jobs, _ in results}, {1})
+        self.assertEqual(os.getpid() in {pid for _, _, pid in results}, jobs == 1)
+
+    def test_for_each_stack_single(self):
+        """Testing `for_each_stack` with a single stack."""
+        (got,) = pulumi_state_splitter.stacks.for_each_stack(
+            _stack_jobs, data.MULTI_STACK_NAMES[:1], jobs=3
+        )
+        self.assertEqual(got.result, (str(data.MULTI_STACK_NAMES[0]), 3, os.getpid()))
+
+
+class TestUnsplitter(util.TmpDirTest):
+    """Testing `Unsplitter`."""
+
+    def test_unsplitter_some_stacks(self):
+        """Testing `Unsplitter` with specified stacks."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir,
+            stacks_names=data.MULTI_STACK_NAMES[:2],
+        ):
+            got = util.Directory.load(self._tmp_dir)
+            want = data.multi_stack_unsplit()
+            want[".pulumi"]["stacks"].pop("test-project-2")
+            want["test-project-2"] = input_["test-project-2"]
+            want.add_locks(data.MULTI_STACK_NAMES[:2])
+            want.compare(got, self)
+
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    @parameterized.parameterized.expand([(1, False), (2, False), (2, True)])
+    def test_unsplitter_all_stacks(self, jobs, streaming):
+        """Testing `Unsplitter` with all stacks."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir,
+            stacks_names=None,
+            jobs=jobs,
+            streaming=streaming,
+        ):
+            got = util.Directory.load(self._tmp_dir)
+            want = data.multi_stack_unsplit()
+            want.add_locks(data.MULTI_STACK_NAMES)
+            want.compare(got, self)
+
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    def test_unsplitter_no_stacks(self):
+        """Testing `Unsplitter` with no stacks."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir,
+            stacks_names=[],
+        ):
+            got = util.Directory.load(self._tmp_dir)
+            input_.compare(got, self)
+
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    def test_unsplitter_new(self):
+        """Testing `Unsplitter` with a new stack added."""
+        input_ = data.multi_stack_split()
+        input_["test-project-1"].pop("test-stack-2")
+        input_.save(self._tmp_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir,
+            stacks_names=None,
+        ):
+            data.multi_stack_unsplit().save(self._tmp_dir)
+
+        got = util.Directory.load(self._tmp_dir)
+        data.multi_stack_split().compare(got, self)
+
+    def test_unsplitter_unchanged(self):
+        """Testing `Unsplitter` with a stack state left unchanged."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+        state_file.load()
+        pulumi_state_splitter.split.StateDir.split_state_file(state_file)
+        input_ = util.Directory.load(self._tmp_dir)
+
+        with (
+            unittest.mock.patch.object(
+                pulumi_state_splitter.state_file.StateFile, "load"
+            ) as load,
+            unittest.mock.patch.object(
+                pulumi_state_splitter.yaml_io,
+                "dump",
+                wraps=pulumi_state_splitter.yaml_io.dump,
+            ) as dump,
+            pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir,
+                stacks_names=[data.STACK_NAME],
+            ),
+        ):
+            dump.reset_mock()
+
+        load.assert_not_called()
+        # only outputs, manifest and state files
+        self.assertEqual(dump.call_count, 3)
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    def test_unsplitter_removed(self):
+        """Testing `Unsplitter` with a specified stack state removed."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+
+        with self.assertRaisesRegex(
+            pulumi_state_splitter.stacks.StacksError,
+            "^test-project-1/test-stack-1: failed: FileNotFoundError",
+        ):
+            with pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir,
+                stacks_names=data.MULTI_STACK_NAMES[:1],
+            ):
+                pulumi_state_splitter.split.StateDir(
+                    backend_dir=self._tmp_dir,
+                    stack_name=data.MULTI_STACK_NAMES[0],
+                ).to_state_file().remove()
+
+        # not split back from the state kept in memory
+        self.assertFalse((self._tmp_dir / "test-project-1" / "test-stack-1").exists())
+
+    def test_unsplitter_reads_once(self):
+        """Testing that `Unsplitter` reads the resource files once on entry."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+        state_file.load()
+        pulumi_state_splitter.split.StateDir.split_state_file(state_file)
+        stack_dir = self._tmp_dir / "test-project" / "test-stack"
+        resource_paths = {
+            path for path in stack_dir.rglob("*.yaml") if path.parent != stack_dir
+        }
+
+        with (
+            unittest.mock.patch.object(
+                pathlib.Path,
+                "read_bytes",
+                autospec=True,
+                side_effect=pathlib.Path.read_bytes,
+            ) as read_bytes,
+            pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir,
+                stacks_names=[data.STACK_NAME],
+            ),
+        ):
+            read = [call.args[0] for call in read_bytes.call_args_list]
+        self.assertCountEqual(
+            [path for path in read if path in resource_paths], resource_paths
+        )
+
+    def test_unsplitter_changed(self):
+        """Testing `Unsplitter` with a resource changed in a stack state."""
+        state = data.stack_state()
+        for backend in ("unsplitter", "split"):
+            if backend == "split":
+                state["checkpoint"]["latest"]["resources"][3]["outputs"]["stdout"] = "x"
+            state_file = util.write_state_file(
+                self._tmp_dir / backend, data.STACK_NAME, state
+            )
+            state_file.load()
+            pulumi_state_splitter.split.StateDir.split_state_file(state_file)
+
+        with (
+            unittest.mock.patch.object(
+                pulumi_state_splitter.yaml_io,
+                "dump",
+                wraps=pulumi_state_splitter.yaml_io.dump,
+            ) as dump,
+            pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir / "unsplitter",
+                stacks_names=[data.STACK_NAME],
+            ),
+        ):
+            dump.reset_mock()
+            state_file.backend_dir = self._tmp_dir / "unsplitter"
+            state_file.path.write_text(json.dumps(state, indent=4))
+
+        # outputs, manifest and state files, and the changed resource
+        self.assertEqual(dump.call_count, 4)
+        want = util.Directory.load(self._tmp_dir / "split")
+        got = util.Directory.load(self._tmp_dir / "unsplitter")
+        want.compare(got, self)
+
+    @parameterized.parameterized.expand(
+        [
+            (streaming, changed, layout)
+            for streaming, changed in [(False, False), (False, True), (True, True)]
+            for layout in [{"fanout": 4}, {"packed": True}]
+        ]
+    )
+    def test_unsplitter_layout(self, streaming, changed, layout):
+        """Testing that `Unsplitter` splits stacks back in their layout."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+        state_file.load()
+        pulumi_state_splitter.split.StateDir.split_state_file(
+            state_file, layout=pulumi_state_splitter.layout.Layout(**layout)
+        )
+        input_ = util.Directory.load(self._tmp_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=self._tmp_dir,
+            stacks_names=[data.STACK_NAME],
+            streaming=streaming,
+        ):
+            if changed:
+                state_file.path.write_text(json.dumps(data.stack_state(), indent=4))
+
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_unsplitter_state_file_backend_dir(self, streaming):
+        """Testing `Unsplitter` with the state files in another backend."""
+        backend_dir = self._tmp_dir / "backend"
+        scratch_dir = self._tmp_dir / "scratch"
+        state_file = util.write_state_file(
+            backend_dir, data.STACK_NAME, data.stack_state()
+        )
+        state_file.load()
+        pulumi_state_splitter.split.StateDir.split_state_file(state_file)
+        input_ = util.Directory.load(backend_dir)
+
+        with pulumi_state_splitter.stacks.Unsplitter(
+            backend_dir=backend_dir,
+            stacks_names=None,
+            streaming=streaming,
+            state_file_backend_dir=scratch_dir,
+        ):
+            # the split state is kept
+            want = util.Directory(input_)
+            want.add_locks([data.STACK_NAME])
+            want.compare(util.Directory.load(backend_dir), self)
+            self.assertEqual(
+                json.loads(
+                    (
+                        scratch_dir / ".pulumi/stacks/test-project/test-stack.json"
+                    ).read_text()
+                )["checkpoint"]["stack"],
+                data.stack_state()["checkpoint"]["stack"],
+            )
+
+        input_.compare(util.Directory.load(backend_dir), self)
+        self.assertFalse((scratch_dir / ".pulumi").exists())
+
+    @parameterized.parameterized.expand([(1,), (2,)])
+    def test_unsplitter_errors(self, jobs):
+        """Testing `Unsplitter` failing for some of the stacks."""
+        input_ = data.multi_stack_split()
+        input_["test-project-1"]["test-stack-2"]["state.yaml"] = "{}"
+        input_.save(self._tmp_dir)
+
+        with self.assertRaisesRegex(
+            pulumi_state_splitter.stacks.StacksError,
+            "^test-project-1/test-stack-2: failed: ValidationError",
+        ) as raised:
+            with pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir,
+                stacks_names=None,
+                jobs=jobs,
+            ):
+                self.fail("entered")
+        self.assertEqual(len(raised.exception.results), 1)
+
+        # the other stacks are split back
+        got = util.Directory.load(self._tmp_dir)
+        input_.compare(got, self)
+
+    def test_unsplitter_locked(self):
+        """Testing `Unsplitter` with a stack locked by another process."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        path = pulumi_state_splitter.lock.lock_path(
+            self._tmp_dir, data.MULTI_STACK_NAMES[1]
+        )
+        path.parent.mkdir(parents=True)
+        path.touch()
+        with path.open() as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            with self.assertRaisesRegex(
+                TimeoutError, "^stack test-project-1/test-stack-2 locked"
+            ):
+                with unittest.mock.patch.dict(
+                    os.environ, {"PULUMI_STATE_SPLITTER_LOCK_TIMEOUT": "0"}
+                ):
+                    with pulumi_state_splitter.stacks.Unsplitter(
+                        backend_dir=self._tmp_dir,
+                        stacks_names=data.MULTI_STACK_NAMES,
+                    ):
+                        self.fail("entered")
+            # the stack locked first is released, nothing is unsplit
+            self.assertEqual(list(path.parent.iterdir()), [path])
+        path.unlink()
+        for directory in path.parents[:3]:
+            directory.rmdir()
+        input_.compare(util.Directory.load(self._tmp_dir), self)
+
+    def test_unsplitter_unsplit_by_other(self):
+        """Testing `Unsplitter` with a stack unsplit by another process."""
+        input_ = data.multi_stack_split()
+        input_.save(self._tmp_dir)
+        stack_name = data.MULTI_STACK_NAMES[0]
+        pulumi_state_splitter.stacks.unsplit_stack(self._tmp_dir, stack_name)
+        path = pulumi_state_splitter.lock.lock_path(self._tmp_dir, stack_name)
+        path.parent.mkdir(parents=True)
+        path.touch()
+        with path.open() as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            with pulumi_state_splitter.stacks.Unsplitter(
+                backend_dir=self._tmp_dir, stacks_names=None
+            ):
+                pass
+            # left to the other process, which did not finish with it
+            self.assertFalse(
+                (self._tmp_dir / "test-project-1" / "test-stack-1").exists()
+            )
+        path.unlink()
+        pulumi_state_splitter.stacks.split_stack(self._tmp_dir, stack_name)
+        input_.compare(util.Directory.load(self._tmp_dir), self)
+
+
+class TestStacksNames(unittest.TestCase):
+    """Testing the names moved to `pulumi_state_splitter.stacks`."""
+
+    def test_stacks_names(self):
+        """Testing that the moved names are still available."""
+        for name in (
+            "for_each_stack",
+            "split_stack",
+            "unsplit_stack",
+            "Unsplitter",
+            "StackResult",
+            "StacksError",
+        ):
+            self.assertIs(
+                getattr(pulumi_state_splitter.split, name),
+                getattr(pulumi_state_splitter.stacks, name),
+            )
+        with self.assertRaises(AttributeError):
+            getattr(pulumi_state_splitter.split, "_Unsplit")
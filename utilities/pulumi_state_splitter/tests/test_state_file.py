@@ -2,7 +2,10 @@
 
 import json
 import pathlib
+import random
+import tracemalloc
 import unittest
+from unittest import mock
 
 import typeguard
 
@@ -13,6 +16,68 @@ with typeguard.install_import_hook("pulumi_state_splitter"):
 from . import data, util
 
 
+def _generated_resources(count: int):
+    """Generates a large graph of resources.
+
+    Every resource is a child of the previous one, depends on two earlier
+    ones and uses a common provider, so the graph is both deep and wide.
+    """
+    provider_urn = "urn:pulumi:stack::project::pulumi:providers:provider::default"
+    resources = [
+        pulumi_state_splitter.model.Resource(
+            type="pulumi:providers:provider",
+            urn=provider_urn,
+        )
+    ]
+    for i in range(count - 1):
+        resources.append(
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn=f"urn:pulumi:stack::project::foo::resource-{i:06}",
+                dependencies=[resources[j].urn for j in sorted({i // 2, i // 3})],
+                parent=resources[i].urn if i else None,
+                provider=f"{provider_urn}::deadbeef",
+            )
+        )
+    random.Random(count).shuffle(resources)
+    return resources
+
+
+def _recursive_sorted_resources(resources):
+    """The straightforward recursive version of `sorted_resources`."""
+    urn2resource = {resource.urn: resource for resource in resources}
+    output = {}
+
+    def dependencies_first(resource):
+        dependencies = resource.dependencies.copy()
+        if resource.provider:
+            dependencies.append(resource.provider.rsplit("::", 1)[0])
+        if resource.parent:
+            dependencies.append(resource.parent)
+        for dependency in sorted(dependencies):
+            dependencies_first(urn2resource[dependency])
+        output.setdefault(resource.urn, resource)
+
+    for urn in sorted(urn2resource):
+        dependencies_first(urn2resource[urn])
+    return list(output.values())
+
+
+def _whole_state_json(state: pulumi_state_splitter.model.State) -> str:
+    """Serializes a state with sorted resources at once."""
+    state = state.model_copy(deep=True)
+    if state.checkpoint.latest:
+        state.checkpoint.latest.resources = (
+            pulumi_state_splitter.state_file.sorted_resources(
+                state.checkpoint.latest.resources
+            )
+        )
+    return state.model_dump_json(
+        exclude=pulumi_state_splitter.model.State.file_exclude,
+        indent=4,
+    )
+
+
 class TestStateFilePure(unittest.TestCase):
     """Testing `pulumi_state_splitter.state_file` without filesystem interactions."""
 
@@ -71,6 +136,87 @@ class TestStateFilePure(unittest.TestCase):
         ]
         self.assertEqual(got, want)
 
+    def test_sorted_resources_recursive(self):
+        """Testing that sorting matches the recursive definition."""
+        resources = _generated_resources(40)
+        self.assertEqual(
+            [
+                resource.urn
+                for resource in pulumi_state_splitter.state_file.sorted_resources(
+                    resources
+                )
+            ],
+            [resource.urn for resource in _recursive_sorted_resources(resources)],
+        )
+
+    def test_sorted_resources_scaling(self):
+        """Testing sorting of large, deep resource graphs."""
+        count = 10_000
+        resources = _generated_resources(count)
+        # pylint: disable-next=protected-access
+        references_function = pulumi_state_splitter.state_file._references
+        with mock.patch.object(
+            pulumi_state_splitter.state_file,
+            "_references",
+            wraps=references_function,
+        ) as references:
+            # deeper than the recursion limit
+            got = pulumi_state_splitter.state_file.sorted_resources(resources)
+        # each resource is visited once
+        self.assertEqual(references.call_count, count)
+
+        self.assertEqual(len(got), count)
+        position = {resource.urn: i for i, resource in enumerate(got)}
+        for i, resource in enumerate(got):
+            for dependency in resource.dependencies:
+                self.assertLess(position[dependency], i)
+            if resource.parent:
+                self.assertLess(position[resource.parent], i)
+
+    def test_sorted_resources_cycle(self):
+        """Testing sorting of resources with a dependency cycle."""
+        resources = [
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn="resource_0",
+            ),
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn="resource_1",
+                dependencies=["resource_3"],
+            ),
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn="resource_2",
+                parent="resource_1",
+            ),
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn="resource_3",
+                dependencies=["resource_0", "resource_2"],
+            ),
+        ]
+        with self.assertRaisesRegex(
+            ValueError,
+            "resource_1 -> resource_3 -> resource_2 -> resource_1",
+        ):
+            pulumi_state_splitter.state_file.sorted_resources(resources)
+
+    def test_sorted_resources_unknown(self):
+        """Testing sorting of resources referring to a missing resource."""
+        resources = [
+            pulumi_state_splitter.model.Resource(
+                type="foo",
+                urn="resource_0",
+                provider="provider::deadbeef",
+            ),
+        ]
+        with self.assertRaisesRegex(
+            ValueError,
+            "resource_0 refers to unknown resource provider",
+        ):
+            pulumi_state_splitter.state_file.sorted_resources(resources)
+
     def test_path(self):
         """Testing the `StateFile.path` property."""
         state_file = pulumi_state_splitter.state_file.StateFile(
@@ -129,6 +275,145 @@ class TestStateFileFilesystem(util.TmpDirTest):
             want,
         )
 
+    def test_load_resources(self):
+        """Testing StateFile.load_resources."""
+        state_file = util.write_state_file(
+            self._tmp_dir, data.STACK_NAME, data.stack_state()
+        )
+
+        got = list(state_file.load_resources())
+
+        # in the order from the file
+        self.assertEqual(
+            got,
+            [
+                pulumi_state_splitter.model.Resource.model_validate(resource)
+                for resource in data.stack_state()["checkpoint"]["latest"]["resources"]
+            ],
+        )
+        want = data.stack_model()
+        want.checkpoint.latest.resources = []
+        self.assertEqual(state_file.state, want)
+
+    def test_load_resources_memory(self):
+        """Testing peak memory usage of StateFile.load_resources."""
+        state = data.stack_state()
+        resources = state["checkpoint"]["latest"]["resources"]
+        resources[2:] = [
+            {
+                "type": "foo",
+                "urn": f"urn:pulumi:test-stack::test-project::foo::resource-{i}",
+                "outputs": {"payload": [f"value-{i}-{j}" for j in range(100)]},
+            }
+            for i in range(2_000)
+        ]
+        state_file = util.write_state_file(self._tmp_dir, data.STACK_NAME, state)
+
+        peaks = {}
+        for streaming in False, True:
+            tracemalloc.start()
+            try:
+                if streaming:
+                    for _ in state_file.load_resources():
+                        pass
+                else:
+                    state_file.load()
+                _, peaks[streaming] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            state_file.state = None
+
+        self.assertLess(peaks[True], peaks[False] / 10)
+
+    def test_load_interning(self):
+        """Testing memory usage of the loaded state with shared strings."""
+        state = data.stack_state()
+        state["checkpoint"]["latest"]["resources"] = [
+            resource.model_dump(
+                exclude=pulumi_state_splitter.model.Resource.file_exclude
+            )
+            for resource in _generated_resources(2_000)
+        ]
+        state_file = util.write_state_file(self._tmp_dir, data.STACK_NAME, state)
+
+        sizes = {}
+        for interning in False, True:
+            with mock.patch.object(
+                pulumi_state_splitter.model.Resource,
+                "intern",
+                (
+                    pulumi_state_splitter.model.Resource.intern
+                    if interning
+                    else lambda resource, strings: None
+                ),
+            ):
+                tracemalloc.start()
+                try:
+                    state_file.load()
+                    sizes[interning], _ = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+            resources = state_file.state.checkpoint.latest.resources
+            if interning:
+                self.assertIs(resources[1].provider, resources[2].provider)
+            state_file.state = None
+
+        self.assertLess(sizes[True], sizes[False] * 0.8)
+
+    def test_save_identical(self):
+        """Testing that StateFile.save writes the whole state serialization."""
+        unusual = data.stack_model()
+        unusual.checkpoint.latest.resources[0].outputs = {
+            "float": 1e20,
+            "nested": {"empty": {}, "list": [[], [1, 2.5]], "resources": []},
+            "text": 'unicode ü☃ and "quotes"\n',
+        }
+        unusual.checkpoint.latest.resources = [
+            *_generated_resources(100),
+            *unusual.checkpoint.latest.resources,
+        ]
+        no_resources = data.stack_model()
+        no_resources.checkpoint.latest.resources = []
+        for state in (
+            data.stack_model(),
+            unusual,
+            no_resources,
+            data.MULTI_STACK_MODELS[0]["state"],
+        ):
+            state_file = pulumi_state_splitter.state_file.StateFile(
+                backend_dir=self._tmp_dir,
+                stack_name=data.STACK_NAME,
+                state=state,
+            )
+            want = _whole_state_json(state)
+            state_file.save()
+            self.assertEqual(state_file.path.read_text(), want)
+
+    def test_save_memory(self):
+        """Testing peak memory usage of StateFile.save."""
+        state = data.stack_model()
+        for i, resource in enumerate(_generated_resources(2_000)):
+            resource.outputs = {"payload": [f"value-{i}-{j}" for j in range(100)]}
+            state.checkpoint.latest.resources.append(resource)
+        state_file = pulumi_state_splitter.state_file.StateFile(
+            backend_dir=self._tmp_dir,
+            stack_name=data.STACK_NAME,
+            state=state,
+        )
+        peaks = {}
+        for whole in False, True:
+            tracemalloc.start()
+            try:
+                if whole:
+                    state_file.path.write_text(_whole_state_json(state))
+                else:
+                    state_file.save()
+                _, peaks[whole] = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertLess(peaks[False], peaks[True] / 3)
+
     def test_remove(self):
         """Testing StateFile.remove."""
         state_file = pulumi_state_splitter.state_file.StateFile(
@@ -0,0 +1,81 @@
+"""Testing `pulumi_state_splitter.targets`."""
+
+import parameterized
+import typeguard
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.stored_state
+    import pulumi_state_splitter.targets
+
+from . import util
+
+
+class TestTargets(util.TmpDirTest):
+    """Testing `pulumi_state_splitter.targets`."""
+
+    def setUp(self):
+        super().setUp()
+        (self._tmp_dir / "Pulumi.yaml").write_text("name: project\nruntime: go\n")
+        (self._tmp_dir / "other").mkdir()
+        (self._tmp_dir / "other" / "Pulumi.yml").write_text("name: other\n")
+        (self._tmp_dir / "empty").mkdir()
+        (self._tmp_dir / "nameless").mkdir()
+        (self._tmp_dir / "nameless" / "Pulumi.yaml").write_text("runtime: go\n")
+        (self._tmp_dir / "blank").mkdir()
+        (self._tmp_dir / "blank" / "Pulumi.yaml").write_text("")
+        (self._tmp_dir / "invalid").mkdir()
+        (self._tmp_dir / "invalid" / "Pulumi.yaml").write_text("name: [\n")
+
+    @parameterized.parameterized.expand(
+        [
+            (["pulumi", "up", "-s", "dev"], {}, "project/dev"),
+            (["pulumi", "up", "--stack", "dev"], {}, "project/dev"),
+            (["pulumi", "up", "--stack=dev"], {}, "project/dev"),
+            (["pulumi", "up", "-sdev"], {}, "project/dev"),
+            (["pulumi", "up", "-s=dev"], {}, "project/dev"),
+            (["/usr/bin/pulumi", "up", "-s", "dev"], {}, "project/dev"),
+            (["pulumi", "up", "-s", "a", "-s", "b"], {}, "project/b"),
+            (["pulumi", "up", "-s", "p/dev"], {}, "p/dev"),
+            (["pulumi", "up", "-s", "organization/p/dev"], {}, "p/dev"),
+            (["pulumi", "up", "-C", "other", "-s", "dev"], {}, "other/dev"),
+            (["pulumi", "up", "--cwd=other", "-s", "dev"], {}, "other/dev"),
+            (["pulumi", "up"], {"PULUMI_STACK": "dev"}, "project/dev"),
+            (["pulumi", "up", "-s", "dev"], {"PULUMI_STACK": "prod"}, "project/dev"),
+            (["pulumi", "up"], {}, None),
+            (["pulumi", "up", "-s"], {}, None),
+            (["pulumi", "up", "-s", "org/p/dev"], {}, None),
+            (["pulumi", "up", "-C", "empty", "-s", "dev"], {}, None),
+            (["pulumi", "up", "-C", "nameless", "-s", "dev"], {}, None),
+            (["pulumi", "up", "-C", "blank", "-s", "dev"], {}, None),
+            (["pulumi", "up", "-C", "invalid", "-s", "dev"], {}, None),
+            (["pulumi", "up", "-C", "Pulumi.yaml", "-s", "dev"], {}, None),
+            (["terraform", "apply", "-s", "dev"], {}, None),
+            ([], {}, None),
+        ]
+    )
+    def test_command_stack(self, command, env, want):
+        """Testing `command_stack`."""
+        got = pulumi_state_splitter.targets.command_stack(command, env, self._tmp_dir)
+        if want is None:
+            self.assertIsNone(got)
+        else:
+            self.assertEqual(
+                got, pulumi_state_splitter.stored_state.StackName.from_path(want)
+            )
+
+    def test_commands_stacks(self):
+        """Testing `commands_stacks`."""
+        commands = [
+            ["pulumi", "preview", "-s", "dev"],
+            ["pulumi", "up", "-s", "dev"],
+            ["pulumi", "stack", "output", "-s", "other/prod"],
+        ]
+        got = pulumi_state_splitter.targets.commands_stacks(commands, {}, self._tmp_dir)
+        self.assertEqual(
+            [str(stack_name) for stack_name in got], ["project/dev", "other/prod"]
+        )
+        self.assertIsNone(
+            pulumi_state_splitter.targets.commands_stacks(
+                commands + [["true"]], {}, self._tmp_dir
+            )
+        )
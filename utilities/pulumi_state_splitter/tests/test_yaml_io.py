@@ -0,0 +1,118 @@
+"""Testing `pulumi_state_splitter.yaml_io`."""
+
+import io
+import random
+import string
+import unittest
+import unittest.mock
+
+import parameterized
+import typeguard
+import yaml
+
+with typeguard.install_import_hook("pulumi_state_splitter"):
+    import pulumi_state_splitter.yaml_io
+
+from . import data
+
+_DOCUMENTS = [
+    {},
+    [],
+    {"foo": "bar"},
+    data.stack_state(),
+    {"": "empty key"},
+    {"k" * 200: "long key"},
+    {"it's a key": "it's a value"},
+    {"multi": "line\nstring"},
+    {"trailing": "space \nafter the line"},
+    {"unicode": "zażółć gęślą jaźń"},
+    {"control": "bell\x07"},
+    {"long": " ".join(["word"] * 100)},
+    {"quoted": "'" * 100 + "\n" + '"' * 100},
+    {"numbers": [0, -1, 2.5, 1e300, 10**30, float("inf")]},
+    {"timestamp": "1970-01-01T00:12:37.0Z"},
+    {"other": [None, True, False, "yes", "null", "0x1f", "~"]},
+    {1: "int key", None: "null key"},
+]
+
+
+def _random_string(rng: random.Random) -> str:
+    alphabet = rng.choice([string.printable, "ab :-#'\"\n", "aü\x85 "])
+    length = rng.choice([rng.randint(0, 10), rng.randint(0, 300)])
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def _random_document(rng: random.Random, depth: int = 0):
+    kind = rng.random()
+    if depth > 3 or kind < 0.4:
+        return rng.choice([_random_string(rng), rng.randint(-100, 100), None])
+    if kind < 0.7:
+        return [_random_document(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {
+        _random_string(rng): _random_document(rng, depth + 1)
+        for _ in range(rng.randint(0, 4))
+    }
+
+
+class TestYamlIo(unittest.TestCase):
+    """Testing `pulumi_state_splitter.yaml_io`."""
+
+    @staticmethod
+    def _dump(document, use_libyaml):
+        stream = io.StringIO()
+        with unittest.mock.patch.object(
+            pulumi_state_splitter.yaml_io, "USE_LIBYAML", use_libyaml
+        ):
+            pulumi_state_splitter.yaml_io.dump(document, stream)
+        return stream.getvalue()
+
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_load(self, use_libyaml):
+        """Testing `pulumi_state_splitter.yaml_io.load`."""
+        if use_libyaml and not yaml.__with_libyaml__:
+            self.skipTest("PyYAML built without libyaml")
+        for document in _DOCUMENTS:
+            with unittest.mock.patch.object(
+                pulumi_state_splitter.yaml_io, "USE_LIBYAML", use_libyaml
+            ):
+                got = pulumi_state_splitter.yaml_io.load(
+                    io.StringIO(yaml.dump(document))
+                )
+            self.assertEqual(got, document)
+
+    @parameterized.parameterized.expand([(False,), (True,)])
+    def test_dump(self, use_libyaml):
+        """Testing `pulumi_state_splitter.yaml_io.dump`."""
+        if use_libyaml and not yaml.__with_libyaml__:
+            self.skipTest("PyYAML built without libyaml")
+        for document in _DOCUMENTS:
+            self.assertEqual(self._dump(document, use_libyaml), yaml.dump(document))
+
+    @unittest.skipUnless(yaml.__with_libyaml__, "PyYAML built without libyaml")
+    def test_dump_identical(self):
+        """Testing that output does not depend on libyaml with random documents."""
+        rng = random.Random(0)
+        for _ in range(2000):
+            document = {"key": _random_document(rng)}
+            self.assertEqual(
+                self._dump(document, use_libyaml=True),
+                self._dump(document, use_libyaml=False),
+                document,
+            )
+
+    def test_split_documents(self):
+        """Testing that `split_documents` reverses `join_documents`."""
+        rng = random.Random(0)
+        documents = [
+            {"key": document}
+            for document in _DOCUMENTS + [_random_document(rng) for _ in range(200)]
+        ]
+        documents.append({"---": "---\n---", "text": "a\n---\nb\n"})
+        dumped = [self._dump(document, False).encode() for document in documents]
+        joined = pulumi_state_splitter.yaml_io.join_documents(dumped)
+        self.assertEqual(pulumi_state_splitter.yaml_io.split_documents(joined), dumped)
+        self.assertEqual(list(yaml.safe_load_all(joined)), documents)
+        # as written by hand, with the first document started explicitly
+        self.assertEqual(
+            pulumi_state_splitter.yaml_io.split_documents(b"---\n" + joined), dumped
+        )
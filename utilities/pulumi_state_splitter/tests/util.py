@@ -13,6 +13,7 @@ import yaml
 
 with typeguard.install_import_hook("pulumi_state_splitter"):
     import pulumi_state_splitter.model
+    import pulumi_state_splitter.state_file
     import pulumi_state_splitter.stored_state
 
 DATA_DIR = pathlib.Path(__file__).parent / "data"
@@ -38,6 +39,21 @@ def sorted_stored_states(
     return sorted(stored_states, key=_key)
 
 
+def write_state_file(
+    backend_dir: pathlib.Path,
+    stack_name: pulumi_state_splitter.stored_state.StackName,
+    state: Mapping,
+) -> pulumi_state_splitter.state_file.StateFile:
+    """Writes a Pulumi stack state file with the given contents."""
+    state_file = pulumi_state_splitter.state_file.StateFile(
+        backend_dir=backend_dir,
+        stack_name=stack_name,
+    )
+    state_file.path.parent.mkdir(parents=True)
+    state_file.path.write_text(json.dumps(state, indent=4))
+    return state_file
+
+
 class Directory(dict):
     """Represents a filesystem directory tree."""
 
@@ -61,6 +77,14 @@ class Directory(dict):
             else:
                 path.write_text(contents)
 
+    def add_locks(
+        self, stacks_names: Iterable[pulumi_state_splitter.stored_state.StackName]
+    ):
+        """Adds the lock files of stacks locked by the current process."""
+        for stack_name in stacks_names:
+            locks = self.setdefault(".pulumi", {}).setdefault("locks", {})
+            locks.setdefault(stack_name.project, {})[f"{stack_name.stack}.lock"] = ""
+
     def compare(
         self,
         other: "Directory",
@@ -81,8 +105,9 @@ class Directory(dict):
                 contents = json.loads(contents)
                 other_contents = json.loads(other_contents)
             if name.endswith(".yaml"):
-                contents = yaml.load(contents, yaml.Loader)
-                other_contents = yaml.load(other_contents, yaml.Loader)
+                # packed resource files hold many documents
+                contents = list(yaml.load_all(contents, yaml.Loader))
+                other_contents = list(yaml.load_all(other_contents, yaml.Loader))
             test_case.assertEqual(contents, other_contents, subpath / name)
 
 